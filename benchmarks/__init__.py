@@ -0,0 +1,12 @@
+"""
+Benchmark suite for small fish pipeline functions.
+
+Run from the repository root with `python -m benchmarks --output benchmark.json`.
+Synthetic images are generated with a fixed seed so results can be compared between releases.
+"""
+
+from .synthetic import make_synthetic_acquisition
+from .synthetic import SYNTHETIC_PRESETS
+from .runner import run_benchmarks
+from .runner import time_function
+from .startup import benchmark_startup
@@ -0,0 +1,31 @@
+import argparse, json, sys
+
+from .synthetic import SYNTHETIC_PRESETS
+from .runner import BENCHMARKS, run_benchmarks
+from .startup import benchmark_startup
+
+def main() :
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description="Times small fish pipeline functions on synthetic smFISH acquisitions.")
+    parser.add_argument('--output', '-o', default='benchmark_results.json', help="JSON file where results are saved.")
+    parser.add_argument('--presets', nargs='+', choices=list(SYNTHETIC_PRESETS.keys()), default=None, help="Synthetic acquisitions to run, defaults to all.")
+    parser.add_argument('--benchmarks', nargs='+', choices=list(BENCHMARKS.keys()), default=None, help="Functions to time, defaults to all.")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--check-startup', action='store_true', help="Only run the startup benchmark, exits with code 1 if heavy modules are imported at startup.")
+    args = parser.parse_args()
+
+    if args.check_startup :
+        result = benchmark_startup(repeat=args.repeat)
+        print(json.dumps(result, indent=2))
+        sys.exit(0 if result['passed'] else 1)
+
+    run_benchmarks(
+        presets=args.presets,
+        benchmarks=args.benchmarks,
+        repeat=args.repeat,
+        seed=args.seed,
+        output_path=args.output,
+    )
+
+if __name__ == '__main__' :
+    main()
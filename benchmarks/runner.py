@@ -0,0 +1,241 @@
+"""
+Timing of small fish pipeline functions on synthetic acquisitions, results are exported as JSON.
+"""
+
+import json, os, platform, sys, tempfile, time
+import numpy as np
+from datetime import datetime
+
+from .synthetic import make_synthetic_acquisition, SYNTHETIC_PRESETS
+from .startup import benchmark_startup
+
+def time_function(funct, *args, repeat=3, **kwargs) -> dict :
+    """
+    Calls `funct(*args, **kwargs)` `repeat` times and returns timing statistics (seconds).
+    """
+    durations = []
+    for _ in range(repeat) :
+        start = time.perf_counter()
+        funct(*args, **kwargs)
+        durations.append(time.perf_counter() - start)
+
+    return {
+        'repeat' : repeat,
+        'min_s' : min(durations),
+        'median_s' : float(np.median(durations)),
+        'mean_s' : float(np.mean(durations)),
+        'max_s' : max(durations),
+    }
+
+def _bench_detect_spots(acquisition, repeat) :
+    from small_fish_gui.pipeline.detection import detect_spots
+    parameters = {
+        'voxel_size' : acquisition['voxel_size'],
+        'spot_size' : acquisition['spot_size'],
+        'threshold' : None,
+        'log_kernel_size' : None,
+        'minimum_distance' : None,
+    }
+    return time_function(detect_spots, acquisition['image'], parameters, hide_loading=True, repeat=repeat)
+
+def _bench_dense_region_deconvolution(acquisition, repeat) :
+    from small_fish_gui.pipeline.detection import launch_dense_region_deconvolution
+    parameters = {
+        'voxel_size' : acquisition['voxel_size'],
+        'spot_size' : acquisition['spot_size'],
+        'alpha' : 0.5,
+        'beta' : 1,
+        'gamma' : 5,
+        'deconvolution_kernel' : None,
+    }
+    return time_function(launch_dense_region_deconvolution, acquisition['image'], acquisition['spots'], parameters, hide_loading=True, repeat=repeat)
+
+def _bench_compute_snr_spots(acquisition, repeat) :
+    from small_fish_gui.pipeline._bigfish_wrapers import compute_snr_spots
+    return time_function(
+        compute_snr_spots,
+        acquisition['image'],
+        acquisition['spots'].copy(),
+        acquisition['voxel_size'],
+        acquisition['spot_size'],
+        repeat=repeat,
+    )
+
+def _bench_cluster_detection(acquisition, repeat) :
+    from small_fish_gui.pipeline.detection import cluster_detection
+    return time_function(
+        cluster_detection,
+        acquisition['spots'],
+        voxel_size=acquisition['voxel_size'],
+        radius=350,
+        nb_min_spots=4,
+        repeat=repeat,
+    )
+
+def _bench_launch_cell_extraction(acquisition, repeat) :
+    from small_fish_gui.pipeline.detection import launch_cell_extraction
+    if acquisition['cell_label'] is None : return None
+    image = acquisition['image']
+    parameters = {
+        'dim' : image.ndim,
+        'do_cluster_computation' : True,
+        'voxel_size' : acquisition['voxel_size'],
+        'spot_size' : acquisition['spot_size'],
+    }
+    return time_function(
+        launch_cell_extraction,
+        acquisition_id=0,
+        spots=acquisition['spots'],
+        clusters=acquisition['clusters'],
+        spots_cluster_id=acquisition['spots_cluster_id'],
+        image=image,
+        nucleus_signal=image,
+        cell_label=acquisition['cell_label'],
+        nucleus_label=acquisition['nucleus_label'],
+        user_parameters=parameters,
+        hide_loading=True,
+        repeat=repeat,
+    )
+
+def _bench_spots_colocalisation(acquisition, repeat) :
+    from small_fish_gui.pipeline._colocalisation import spots_colocalisation
+    spots = acquisition['spots']
+    half = len(spots) // 2
+    return time_function(
+        spots_colocalisation,
+        spots[:half],
+        spots[half:],
+        distance=300,
+        voxel_size=acquisition['voxel_size'],
+        repeat=repeat,
+    )
+
+def _bench_compute_Spots(acquisition, repeat) :
+    from small_fish_gui.pipeline.spots import compute_Spots
+    return time_function(
+        compute_Spots,
+        acquisition_id=0,
+        image=acquisition['image'],
+        spots=acquisition['spots'],
+        cluster_id=acquisition['spots_cluster_id'],
+        nucleus_label=acquisition['nucleus_label'],
+        cell_label=acquisition['cell_label'],
+        repeat=repeat,
+    )
+
+def _bench_write_results(acquisition, repeat) :
+    from small_fish_gui.pipeline.spots import compute_Spots
+    from small_fish_gui.interface import write_results
+    Spots = compute_Spots(
+        acquisition_id=0,
+        image=acquisition['image'],
+        spots=acquisition['spots'],
+        cluster_id=acquisition['spots_cluster_id'],
+        nucleus_label=acquisition['nucleus_label'],
+        cell_label=acquisition['cell_label'],
+    )
+    with tempfile.TemporaryDirectory() as output_dir :
+        return time_function(
+            write_results,
+            Spots,
+            path=output_dir,
+            filename='benchmark_spots',
+            do_excel=False,
+            do_csv=True,
+            overwrite=True,
+            repeat=repeat,
+        )
+
+BENCHMARKS = {
+    'detect_spots' : _bench_detect_spots,
+    'dense_region_deconvolution' : _bench_dense_region_deconvolution,
+    'compute_snr_spots' : _bench_compute_snr_spots,
+    'cluster_detection' : _bench_cluster_detection,
+    'launch_cell_extraction' : _bench_launch_cell_extraction,
+    'spots_colocalisation' : _bench_spots_colocalisation,
+    'compute_Spots' : _bench_compute_Spots,
+    'write_results' : _bench_write_results,
+}
+
+def _get_environment() -> dict :
+    try :
+        from importlib.metadata import version
+        small_fish_version = version('small_fish_gui')
+    except Exception :
+        small_fish_version = None
+
+    return {
+        'small_fish_gui' : small_fish_version,
+        'python' : sys.version.split()[0],
+        'numpy' : np.__version__,
+        'platform' : platform.platform(),
+        'processor' : platform.processor(),
+        'cpu_count' : os.cpu_count(),
+        'date' : datetime.now().isoformat(timespec='seconds'),
+    }
+
+def run_benchmarks(presets : list = None, benchmarks : list = None, repeat = 3, seed = 0, output_path : str = None, include_startup = True) -> dict :
+    """
+    Runs benchmarks on synthetic acquisitions.
+
+    Parameters
+    ----------
+        presets : list
+            Keys of `SYNTHETIC_PRESETS`, defaults to all.
+        benchmarks : list
+            Keys of `BENCHMARKS`, defaults to all.
+        repeat : int
+            Number of timed calls per function.
+        seed : int
+        output_path : str
+            If given results are written to this path as JSON.
+        include_startup : bool
+            Also times startup imports (see `benchmark_startup`).
+
+    Returns
+    -------
+        results : dict
+    """
+
+    if presets is None : presets = list(SYNTHETIC_PRESETS.keys())
+    if benchmarks is None : benchmarks = list(BENCHMARKS.keys())
+
+    results = {
+        'environment' : _get_environment(),
+        'seed' : seed,
+        'cases' : [],
+    }
+
+    if include_startup :
+        print("Timing startup imports...")
+        results['startup'] = benchmark_startup(repeat=repeat)
+        if not results['startup']['passed'] : print("WARNING : startup check failed : {0}".format(results['startup']))
+
+    for preset in presets :
+        case_parameters = SYNTHETIC_PRESETS[preset]
+        print("Generating synthetic acquisition '{0}'...".format(preset))
+        acquisition = make_synthetic_acquisition(seed=seed, **case_parameters)
+
+        case = {
+            'name' : preset,
+            'parameters' : {key : list(value) if isinstance(value, tuple) else value for key, value in case_parameters.items()},
+            'timings' : {},
+        }
+
+        for benchmark in benchmarks :
+            print("  {0}...".format(benchmark), end=' ', flush=True)
+            try :
+                timing = BENCHMARKS[benchmark](acquisition, repeat)
+            except Exception as error :
+                timing = {'error' : "{0}: {1}".format(type(error).__name__, error)}
+            case['timings'][benchmark] = timing
+            print("skipped" if timing is None else timing.get('median_s', timing.get('error')))
+
+        results['cases'].append(case)
+
+    if output_path is not None :
+        with open(output_path, 'w') as output_file :
+            json.dump(results, output_file, indent=2)
+        print("Benchmark results saved at {0}".format(output_path))
+
+    return results
@@ -0,0 +1,54 @@
+"""
+Startup benchmark : imports everything the main menu needs before drawing the hub window, in a fresh interpreter.
+Heavy subsystems (napari, cellpose, torch, AF_eraser) must only be imported on first use.
+"""
+
+import json, subprocess, sys
+
+#Modules imported by small_fish_gui.main_menu before the hub window is drawn (main_menu itself starts the GUI loop on import).
+STARTUP_MODULES = [
+    'small_fish_gui.pipeline.actions',
+    'small_fish_gui.pipeline._preprocess',
+    'small_fish_gui.interface',
+    'small_fish_gui.batch',
+    'small_fish_gui.gui',
+    'small_fish_gui.hints',
+]
+
+LAZY_MODULES = ['napari', 'magicgui', 'cellpose', 'torch', 'AF_eraser']
+
+_STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+for module in {modules} :
+    __import__(module)
+duration = time.perf_counter() - start
+loaded = [module for module in {lazy_modules} if module in sys.modules]
+print(json.dumps({{'import_time_s' : duration, 'eagerly_loaded' : loaded, 'module_count' : len(sys.modules)}}))
+"""
+
+def benchmark_startup(repeat = 3) -> dict :
+    """
+    Times startup imports in `repeat` fresh interpreters.
+
+    Returns
+    -------
+        result : dict
+            'import_time_s' (list), 'eagerly_loaded' : heavy modules imported at startup (should be empty), 'module_count', 'passed'.
+    """
+    script = _STARTUP_SCRIPT.format(modules=STARTUP_MODULES, lazy_modules=LAZY_MODULES)
+    import_times = []
+    for _ in range(repeat) :
+        process = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True)
+        if process.returncode != 0 :
+            return {'error' : process.stderr.strip().splitlines()[-1] if process.stderr else "import failed", 'passed' : False}
+        measure = json.loads(process.stdout.strip().splitlines()[-1])
+        import_times.append(measure['import_time_s'])
+
+    return {
+        'import_time_s' : import_times,
+        'median_import_time_s' : sorted(import_times)[len(import_times) // 2],
+        'eagerly_loaded' : measure['eagerly_loaded'],
+        'module_count' : measure['module_count'],
+        'passed' : len(measure['eagerly_loaded']) == 0,
+    }
@@ -0,0 +1,143 @@
+"""
+Generation of synthetic smFISH acquisitions : spots, clusters, cell and nucleus labels.
+"""
+
+import numpy as np
+from scipy.ndimage import gaussian_filter
+from scipy.spatial import cKDTree
+
+SYNTHETIC_PRESETS = {
+    'small_2D' : {'shape' : (512,512), 'spot_number' : 500, 'cluster_number' : 10, 'cell_number' : 10},
+    'medium_2D' : {'shape' : (2048,2048), 'spot_number' : 10000, 'cluster_number' : 100, 'cell_number' : 60},
+    'small_3D' : {'shape' : (15,512,512), 'spot_number' : 1000, 'cluster_number' : 10, 'cell_number' : 10},
+    'medium_3D' : {'shape' : (40,1024,1024), 'spot_number' : 10000, 'cluster_number' : 80, 'cell_number' : 40},
+}
+
+def _make_labels(plane_shape, cell_number, rng : np.random.Generator) :
+    """
+    Cells are pixels closer than `cell_radius` to a random seed (Voronoi split between touching cells), nuclei are pixels closer than half of it.
+    """
+    cell_radius = int(np.sqrt(plane_shape[0] * plane_shape[1] / cell_number) / 2)
+    margin = min(cell_radius, min(plane_shape) // 4)
+    seeds = np.column_stack([
+        rng.integers(margin, plane_shape[0] - margin, size=cell_number),
+        rng.integers(margin, plane_shape[1] - margin, size=cell_number),
+    ])
+
+    grid = np.indices(plane_shape).reshape(2,-1).T
+    distance, nearest = cKDTree(seeds).query(grid)
+    distance = distance.reshape(plane_shape)
+    nearest = nearest.reshape(plane_shape) + 1
+
+    cell_label = np.where(distance <= cell_radius, nearest, 0).astype(np.int64)
+    nucleus_label = np.where(distance <= cell_radius / 2, nearest, 0).astype(np.int64)
+
+    return cell_label, nucleus_label
+
+def _make_spots(shape, spot_number, cluster_number, spots_per_cluster, cluster_spread, rng : np.random.Generator) :
+    """
+    Returns spots coordinates, spots cluster id (-1 for free spots) and clusters with bigfish layout (coordinates, spot number, cluster id).
+    """
+    shape = np.array(shape)
+    free_spot_number = max(spot_number - cluster_number * spots_per_cluster, 0)
+    free_spots = rng.integers(0, shape, size=(free_spot_number, len(shape)))
+
+    clustered_spots = []
+    clusters = []
+    for cluster_id in range(cluster_number) :
+        centroid = rng.integers(cluster_spread, shape - cluster_spread)
+        spread = np.full(len(shape), cluster_spread)
+        if len(shape) == 3 : spread[0] = max(1, cluster_spread // 3)
+        cluster_spots = centroid + rng.integers(-spread, spread + 1, size=(spots_per_cluster, len(shape)))
+        cluster_spots = np.clip(cluster_spots, 0, shape - 1)
+        clustered_spots.append(cluster_spots)
+        clusters.append(list(cluster_spots.mean(axis=0).astype(int)) + [spots_per_cluster, cluster_id])
+
+    if cluster_number > 0 :
+        clustered_spots = np.concatenate(clustered_spots)
+        clusters = np.array(clusters, dtype=np.int64)
+    else :
+        clustered_spots = np.empty(shape=(0,len(shape)), dtype=np.int64)
+        clusters = np.empty(shape=(0,len(shape) + 2), dtype=np.int64)
+
+    spots = np.concatenate([free_spots, clustered_spots]).astype(np.int64)
+    spots_cluster_id = np.concatenate([
+        np.full(len(free_spots), -1),
+        np.repeat(np.arange(cluster_number), spots_per_cluster),
+    ]).astype(np.int64)
+
+    return spots, spots_cluster_id, clusters
+
+def _render_image(shape, spots, spot_sigma, spot_amplitude, background, rng : np.random.Generator) :
+    signal = np.zeros(shape, dtype=np.float32)
+    np.add.at(signal, tuple(spots.T), spot_amplitude)
+    sigma = (spot_sigma / 2, spot_sigma, spot_sigma) if len(shape) == 3 else (spot_sigma, spot_sigma)
+    signal = gaussian_filter(signal, sigma=sigma) * (2 * np.pi * spot_sigma**2)
+    image = rng.poisson(background + signal)
+
+    return np.clip(image, 0, np.iinfo(np.uint16).max).astype(np.uint16)
+
+def make_synthetic_acquisition(
+        shape : tuple,
+        spot_number : int,
+        cluster_number : int = 0,
+        cell_number : int = 0,
+        spots_per_cluster : int = 8,
+        cluster_spread : int = 3,
+        spot_sigma : float = 1.5,
+        spot_amplitude : float = 400,
+        background : float = 100,
+        voxel_size : tuple = None,
+        seed : int = 0,
+) -> dict :
+    """
+    Generates a reproducible synthetic smFISH acquisition.
+
+    Parameters
+    ----------
+        shape : tuple
+            (y,x) or (z,y,x) image shape.
+        spot_number : int
+            Total number of spots, clustered spots included.
+        cluster_number : int
+        cell_number : int
+            Number of cells in 2D labels, no labels are created if 0.
+        spots_per_cluster : int
+        cluster_spread : int
+            Maximum distance (pixel) from a clustered spot to its cluster centroid.
+        spot_sigma : float
+            Spot standard deviation in pixels (halved along z).
+        voxel_size : tuple
+            Defaults to (300,103,103) in 3D and (103,103) in 2D.
+        seed : int
+
+    Returns
+    -------
+        acquisition : dict
+            keys : 'image', 'spots', 'spots_cluster_id', 'clusters', 'cell_label', 'nucleus_label', 'voxel_size', 'spot_size'
+    """
+
+    rng = np.random.default_rng(seed=seed)
+    dim = len(shape)
+    if dim not in (2,3) : raise ValueError("shape should be (y,x) or (z,y,x).")
+    if voxel_size is None : voxel_size = (300,103,103) if dim == 3 else (103,103)
+    spot_size = tuple([int(2 * spot_sigma * voxel) for voxel in voxel_size])
+
+    spots, spots_cluster_id, clusters = _make_spots(shape, spot_number, cluster_number, spots_per_cluster, cluster_spread, rng)
+    image = _render_image(shape, spots, spot_sigma, spot_amplitude, background, rng)
+
+    if cell_number > 0 :
+        cell_label, nucleus_label = _make_labels(shape[-2:], cell_number, rng)
+    else :
+        cell_label, nucleus_label = None, None
+
+    return {
+        'image' : image,
+        'spots' : spots,
+        'spots_cluster_id' : spots_cluster_id,
+        'clusters' : clusters,
+        'cell_label' : cell_label,
+        'nucleus_label' : nucleus_label,
+        'voxel_size' : voxel_size,
+        'spot_size' : spot_size,
+    }
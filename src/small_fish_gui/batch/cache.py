@@ -0,0 +1,95 @@
+"""
+Content-addressed cache of batch results : segmentation labels, spots and clusters are saved as npz files named after
+the hash of (image file content, stage, parameters used by this stage) so re-running a batch only recomputes stages whose inputs changed.
+"""
+
+import os, hashlib
+import numpy as np
+
+from ..utils import hash_parameters
+
+RESULT_CACHE_DIRNAME = ".small_fish_cache"
+
+SEGMENTATION_PARAMETERS_PREFIXES = ('nucleus_', 'cytoplasm_')
+SEGMENTATION_PARAMETERS = ['anisotropy', 'segment_only_nuclei']
+DETECTION_PARAMETERS = [
+    'dim',
+    'is_multichannel',
+    'channel_to_compute',
+    'voxel_size',
+    'spot_size',
+    'log_kernel_size',
+    'minimum_distance',
+    'threshold',
+    'threshold_penalty',
+    'do_dense_regions_deconvolution',
+    'alpha',
+    'beta',
+    'gamma',
+    'deconvolution_kernel',
+]
+CLUSTERING_PARAMETERS = ['do_cluster_computation', 'cluster_size', 'min_number_of_spots']
+
+def get_segmentation_parameters(parameters : dict) -> dict :
+    return {
+        key : value for key, value in parameters.items() 
+        if isinstance(key, str) and (key.startswith(SEGMENTATION_PARAMETERS_PREFIXES) or key in SEGMENTATION_PARAMETERS) and key != 'nucleus_channel_signal'
+        }
+
+def get_detection_parameters(parameters : dict) -> dict :
+    return {key : parameters.get(key) for key in DETECTION_PARAMETERS}
+
+def get_clustering_parameters(parameters : dict) -> dict :
+    return {key : parameters.get(key) for key in CLUSTERING_PARAMETERS}
+
+def hash_array(array : np.ndarray) -> str :
+    if type(array) == type(None) : return None
+    return hashlib.sha256(np.ascontiguousarray(array).tobytes()).hexdigest()
+
+class ResultCache :
+    """
+    On disk cache of stage results. 
+    Entries are npz files named by `key(file_hash, stage, stage_parameters)`; a stage is recomputed only if no entry exists for its key.
+    """
+
+    def __init__(self, cache_dir : str) :
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self._file_hashes = {}
+
+    def file_hash(self, path : str, chunk_size = 2**20) -> str :
+        """
+        sha256 of file content; kept in memory for the session as long as file size and modification time don't change.
+        """
+        stat = os.stat(path)
+        memory_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        if memory_key not in self._file_hashes :
+            sha = hashlib.sha256()
+            with open(path, 'rb') as file :
+                for chunk in iter(lambda : file.read(chunk_size), b'') :
+                    sha.update(chunk)
+            self._file_hashes[memory_key] = sha.hexdigest()
+        return self._file_hashes[memory_key]
+
+    def key(self, file_hash : str, stage : str, stage_parameters : dict) -> str :
+        return hashlib.sha256("{0}:{1}:{2}".format(file_hash, stage, hash_parameters(stage_parameters)).encode()).hexdigest()
+
+    def _get_path(self, key : str) -> str :
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def load(self, key : str) -> dict :
+        """
+        Returns dict of arrays saved under key, None if no entry exists.
+        """
+        path = self._get_path(key)
+        if not os.path.isfile(path) : return None
+        try :
+            with np.load(path, allow_pickle=False) as entry :
+                return {name : entry[name] for name in entry.files}
+        except (OSError, ValueError) : #Corrupted entry, recomputed.
+            return None
+
+    def save(self, key : str, **arrays) :
+        temp_path = os.path.join(self.cache_dir, key + ".tmp.npz")
+        np.savez_compressed(temp_path, **arrays)
+        os.replace(temp_path, self._get_path(key))
@@ -0,0 +1,135 @@
+"""
+Checkpoint of batch runs : a manifest saved in batch folder records finished acquisitions so a stopped batch can be resumed.
+"""
+
+import os, json
+import numpy as np
+from glob import glob
+
+CHECKPOINT_FILENAME = "checkpoint.json"
+
+#Parameters not affecting results or changing during batch run, not used for checkpoint hash.
+CHECKPOINT_IGNORED_KEYS = [
+    'output_folder',
+    'batch_name',
+    'resume_batch',
+    'use_result_cache',
+    'profile_memory',
+    'cell_features_workers',
+    'image',
+    'filename',
+    'shape',
+    'reordered_shape',
+    'dim',
+    'segmentation_done',
+    'spots_extraction_folder',
+    'spots_filename',
+    'do_spots_excel',
+    'do_spots_csv',
+    'show_interactive_threshold_selector',
+    'show_napari_corrector',
+]
+
+class BatchCheckpoint :
+    """
+    Manifest of a batch run, saved as json in batch folder after each finished acquisition.
+    Keeps finished files with their acquisition id, parameters hash and size of results tables (to remove lines written by an interrupted acquisition).
+    """
+
+    def __init__(self, main_dir : str, parameters_hash : str, first_acquisition_id : int, state : dict = None) :
+        self.main_dir = main_dir
+        self.path = os.path.join(main_dir, CHECKPOINT_FILENAME)
+        if type(state) == type(None) :
+            state = {
+                'parameters_hash' : parameters_hash,
+                'first_acquisition_id' : first_acquisition_id,
+                'finished_files' : {},
+                'offsets' : {},
+                'results_sizes' : {},
+            }
+        self.state = state
+
+    @classmethod
+    def load(cls, main_dir : str) -> 'BatchCheckpoint' :
+        with open(os.path.join(main_dir, CHECKPOINT_FILENAME), 'r') as checkpoint_file :
+            state = json.load(checkpoint_file)
+        return cls(main_dir, state['parameters_hash'], state['first_acquisition_id'], state=state)
+
+    @property
+    def first_acquisition_id(self) -> int :
+        return self.state['first_acquisition_id']
+
+    @property
+    def offsets(self) -> dict :
+        """
+        Writing offsets (xlsx start lines, header flags) at last finished acquisition.
+        """
+        return self.state['offsets']
+
+    def is_done(self, filename : str) -> bool :
+        return filename in self.state['finished_files']
+
+    def done_count(self) -> int :
+        return len(self.state['finished_files'])
+
+    def _get_results_sizes(self) -> dict :
+        results_dir = os.path.join(self.main_dir, "results")
+        return {
+            os.path.basename(table) : os.path.getsize(table) 
+            for table in glob(os.path.join(results_dir, "*.csv"))
+            }
+
+    def record(self, filename : str, acquisition_id : int, **offsets) :
+        """
+        Marks filename as finished and saves checkpoint. Written to a temporary file first so an interruption never leaves a corrupted checkpoint.
+        """
+        self.state['finished_files'][filename] = acquisition_id
+        self.state['offsets'].update(offsets)
+        self.state['results_sizes'] = self._get_results_sizes()
+
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as checkpoint_file :
+            json.dump(self.state, checkpoint_file, indent=2)
+        os.replace(temp_path, self.path)
+
+    def restore_results(self) :
+        """
+        Truncates csv results tables to their size at last finished acquisition, removing lines written by an interrupted acquisition.
+        """
+        recorded_sizes = self.state['results_sizes']
+        for table, size in self._get_results_sizes().items() :
+            table_path = os.path.join(self.main_dir, "results", table)
+            if table not in recorded_sizes :
+                os.remove(table_path)
+            elif size > recorded_sizes[table] :
+                with open(table_path, 'r+b') as table_file :
+                    table_file.truncate(recorded_sizes[table])
+
+def encode_array(array : np.ndarray) -> dict :
+    """
+    Json serializable form of array (None is kept), see `decode_array`.
+    """
+    if type(array) == type(None) : return None
+    return {'data' : array.tolist(), 'dtype' : array.dtype.str, 'shape' : list(array.shape)}
+
+def decode_array(encoded_array : dict) -> np.ndarray :
+    if type(encoded_array) == type(None) : return None
+    return np.array(encoded_array['data'], dtype=encoded_array['dtype']).reshape(encoded_array['shape'])
+
+def find_resumable_batch(output_path : str, batch_name : str, parameters_hash : str) -> str :
+    """
+    Returns most recent batch folder named `batch_name`_<date> in output_path with a checkpoint made with the same parameters, None if not found.
+    """
+    candidates = []
+    for batch_dir in glob(os.path.join(output_path, batch_name + "_*")) :
+        checkpoint_path = os.path.join(batch_dir, CHECKPOINT_FILENAME)
+        if not os.path.isfile(checkpoint_path) : continue
+        try :
+            with open(checkpoint_path, 'r') as checkpoint_file :
+                checkpoint_hash = json.load(checkpoint_file).get('parameters_hash')
+        except (json.JSONDecodeError, OSError) :
+            continue
+        if checkpoint_hash == parameters_hash : candidates.append(batch_dir)
+
+    if len(candidates) == 0 : return None
+    return max(candidates, key=os.path.getmtime) + "/"
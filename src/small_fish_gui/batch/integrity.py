@@ -134,6 +134,22 @@ def check_detection_parameters(
         sg.popup_error(e)
     else :
         detection_is_ok = True
+
+    if values.get('do_batch_calibration') :
+        try :
+            values['calibration_sample_number'] = int(values['calibration_sample_number'])
+            if values['calibration_sample_number'] < 1 : raise ValueError()
+        except (ValueError, TypeError) :
+            detection_is_ok = False
+            sg.popup("Calibration : number of files should be a positive integer.")
+
+    if values.get('do_channels_colocalisation') :
+        try :
+            values['channels_coloc_distance'] = int(values['channels_coloc_distance'])
+            if values['channels_coloc_distance'] < 0 : raise ValueError()
+        except (ValueError, TypeError) :
+            detection_is_ok = False
+            sg.popup("Colocalisation : distance should be a positive integer (nanometers).")
     
     return detection_is_ok, values
 
@@ -3,10 +3,11 @@ Submodule keeping necessary calls from main pipeline for batch processing.
 """
 
 import os, traceback
+from concurrent.futures import ThreadPoolExecutor
+from itertools import permutations
 import pandas as pd
 import FreeSimpleGUI as sg
 import numpy as np
-from AF_eraser import remove_autofluorescence_RANSACfit
 
 from ..hints import pipeline_parameters
 
@@ -19,13 +20,296 @@ from ..pipeline import launch_spots_extraction
 from ..pipeline import get_nucleus_signal
 from ..pipeline import _cast_segmentation_parameters, convert_parameters_types
 from ..pipeline import plot_segmentation, output_spot_tiffvisual
-from ..utils import get_datetime
+from ..pipeline import profile_stage, AcquisitionProfiler
+from ..pipeline import compute_auto_threshold, detect_spots, compute_dense_reference_spot
+from ..pipeline import spots_colocalisation, compute_nearest_neighbour_table
+from ..pipeline import ProjectionCache, maximum_projection
+from ..pipeline.utils import compact_label
+from ..utils import get_datetime, hash_parameters
 from .utils import clean_filename
+from .checkpoint import BatchCheckpoint, find_resumable_batch, encode_array, decode_array, CHECKPOINT_IGNORED_KEYS
+from .cache import ResultCache, RESULT_CACHE_DIRNAME, get_segmentation_parameters, get_detection_parameters, get_clustering_parameters, hash_array
+from .staging import AcquisitionPrefetcher, ResultsWriter
+
+#Parameters that can differ between detection channels of a same batch
+DETECTION_CHANNEL_PARAMETERS = [
+    'channel_to_compute',
+    'spot_size',
+    'log_kernel_size',
+    'minimum_distance',
+    'threshold',
+    'threshold_penalty',
+    'do_dense_regions_deconvolution',
+    'alpha',
+    'beta',
+    'gamma',
+    'deconvolution_kernel',
+    'do_cluster_computation',
+    'cluster_size',
+    'min_number_of_spots',
+]
 
 def window_print(window: sg.Window, *args) :
     print(*args)
     window.refresh()
 
+def get_detection_channel(parameters : pipeline_parameters) -> dict :
+    """
+    Returns a copy of the detection parameters of one channel, merged over batch parameters for each channel during batch run.
+    """
+    return {key : parameters.get(key) for key in DETECTION_CHANNEL_PARAMETERS}
+
+def _detect_channel(
+        image : np.ndarray,
+        other_image : np.ndarray,
+        channel_parameters : pipeline_parameters,
+        cytoplasm_label : np.ndarray,
+        nucleus_label : np.ndarray,
+        dense_reference_spot : np.ndarray,
+        result_cache : ResultCache,
+        file_hash : str,
+        map_ : dict,
+) :
+    """
+    Detection of one channel, spots and clusters are loaded from result cache if available. Safe to call from worker threads (no GUI call).
+
+    RETURNS
+    -------
+        launch_detection results + loaded_from_cache : bool
+    """
+    cached_spots, cached_clusters = None, None
+    if type(result_cache) != type(None) :
+        detection_parameters = {
+            **get_detection_parameters(channel_parameters),
+            'map' : map_,
+            'dense_reference_spot' : hash_array(dense_reference_spot),
+            }
+        detection_key = result_cache.key(file_hash, 'detection', detection_parameters)
+        clustering_key = result_cache.key(file_hash, 'clustering', {**detection_parameters, **get_clustering_parameters(channel_parameters)})
+        cached_detection = result_cache.load(detection_key)
+        if type(cached_detection) != type(None) :
+            cached_spots = cached_detection['spots']
+            channel_parameters['threshold'] = int(cached_detection['threshold'])
+            cached_clustering = result_cache.load(clustering_key) if channel_parameters['do_cluster_computation'] else None
+            if type(cached_clustering) != type(None) :
+                cached_clusters = (cached_clustering['clusters'], cached_clustering['spots_cluster_id'])
+
+    with profile_stage('detection') :
+        detection_results = launch_detection(
+            image,
+            other_image,
+            channel_parameters,
+            cell_label=cytoplasm_label,
+            nucleus_label=nucleus_label,
+            hide_loading=True,
+            dense_reference_spot=dense_reference_spot,
+            precomputed_spots=cached_spots,
+            precomputed_clusters=cached_clusters,
+        )
+    channel_parameters, frame_result, spots, clusters, spot_cluster_id, *_ = detection_results
+
+    if type(result_cache) != type(None) :
+        if type(cached_spots) == type(None) : result_cache.save(detection_key, spots=spots, threshold=np.array(channel_parameters['threshold']))
+        if channel_parameters['do_cluster_computation'] and type(cached_clusters) == type(None) : result_cache.save(clustering_key, clusters=clusters, spots_cluster_id=spot_cluster_id)
+
+    return (*detection_results, type(cached_spots) != type(None))
+
+def _detect_channel_in_thread(profiler : AcquisitionProfiler, detection_kwargs : dict) :
+    """
+    `_detect_channel` run on a worker thread, its stages are recorded in acquisition profiler under 'detection'.
+    """
+    with profiler.activate_in_thread(parent_stage='detection') :
+        return _detect_channel(**detection_kwargs)
+
+def compute_channels_colocalisation(
+        acquisition_id : int,
+        filename : str,
+        channels_spots : dict,
+        distance : int,
+        voxel_size : tuple,
+) -> pd.DataFrame :
+    """
+    Colocalisation between every pair of detection channels of a field of view.
+
+    PARAMETERS
+    ----------
+        channels_spots : dict
+            channel : spots
+        distance : int
+            nanometers
+
+    RETURNS
+    -------
+        coloc_df : pd.DataFrame
+            One line per ordered pair of channels : number of spots of channel1 closer than distance to a spot of channel2.
+    """
+    coloc_lines = []
+    for channel1, channel2 in permutations(channels_spots.keys(), 2) :
+        spots1, spots2 = channels_spots[channel1], channels_spots[channel2]
+        colocalised_count = spots_colocalisation(spots1, spots2, distance=distance, voxel_size=voxel_size)
+        coloc_lines.append({
+            'acquisition_id' : acquisition_id,
+            'filename' : filename,
+            'channel1' : channel1,
+            'channel2' : channel2,
+            'spot_number1' : len(spots1),
+            'spot_number2' : len(spots2),
+            'colocalised_spot_number' : colocalised_count,
+            'colocalised_fraction' : colocalised_count / len(spots1) if len(spots1) > 0 else np.nan,
+        })
+
+    return pd.DataFrame(coloc_lines)
+
+def load_acquisition(
+        path : str,
+        parameters : pipeline_parameters,
+        do_segmentation : bool,
+        map_ : dict,
+        result_cache : ResultCache = None,
+) -> dict :
+    """
+    First stage of batch pipeline : opens image and segments cells (segmentation is loaded from result cache if available).
+    Run on prefetching thread so next acquisition is segmented while current one is detected : no GUI call, `parameters` is not modified.
+
+    RETURNS
+    -------
+        acquisition : dict
+            keys : 'image', 'file_hash', 'cytoplasm_label', 'nucleus_label', 'segmentation_from_cache', 'projection_cache' (projections of this acquisition computed so far, reused by next stages)
+    """
+    with profile_stage('open_image') :
+        image = open_image(path)
+        file_hash = result_cache.file_hash(path) if type(result_cache) != type(None) else None
+
+    acquisition = {
+        'image' : image,
+        'file_hash' : file_hash,
+        'cytoplasm_label' : None,
+        'nucleus_label' : None,
+        'segmentation_from_cache' : False,
+        'projection_cache' : ProjectionCache(),
+    }
+    if not do_segmentation : return acquisition
+
+    im_seg = reorder_image_stack(map_, image)
+    segmentation_parameters = _cast_segmentation_parameters({key : value for key, value in parameters.items() if isinstance(key, str)})
+    segmentation_parameters.setdefault('anisotropy',1)
+
+    if type(result_cache) != type(None) :
+        segmentation_key = result_cache.key(file_hash, 'segmentation', {**get_segmentation_parameters(segmentation_parameters), 'map' : map_})
+        cached_segmentation = result_cache.load(segmentation_key)
+    else :
+        cached_segmentation = None
+
+    if type(cached_segmentation) != type(None) :
+        acquisition['cytoplasm_label'], acquisition['nucleus_label'] = compact_label(cached_segmentation['cytoplasm_label']), compact_label(cached_segmentation['nucleus_label'])
+        acquisition['segmentation_from_cache'] = True
+    else :
+        with profile_stage('segmentation') :
+            cytoplasm_label, nucleus_label = cell_segmentation(
+                im_seg,
+                channels=[segmentation_parameters['cytoplasm_channel'], segmentation_parameters['nucleus_channel']],
+                do_only_nuc=segmentation_parameters['segment_only_nuclei'],
+                external_nucleus_image = None,
+                nucleus_3D_segmentation=segmentation_parameters['nucleus_radio_3D'],
+                cyto_3D_segmentation=segmentation_parameters['cytoplasm_radio_3D'],
+                projection_cache=acquisition['projection_cache'],
+                **segmentation_parameters
+                )
+        if type(result_cache) != type(None) : result_cache.save(segmentation_key, cytoplasm_label=cytoplasm_label, nucleus_label=nucleus_label)
+        acquisition['cytoplasm_label'], acquisition['nucleus_label'] = cytoplasm_label, nucleus_label
+
+    return acquisition
+
+def calibrate_detection(
+        batch_window : sg.Window,
+        parameters : pipeline_parameters,
+        filenames_list : list,
+        input_path : str,
+        map_ : dict,
+        sample_number : int,
+        seed = 0,
+) :
+    """
+    Calibration pass run before batch loop : a single detection threshold and reference spot (dense regions deconvolution) are computed from `sample_number` files.
+    Threshold is the median of sampled files auto-thresholds, reference spot is the pixel-wise median of sampled files reference spots.
+
+    RETURNS
+    -------
+        threshold : int or None
+            None if user set a threshold.
+        reference_spot : np.ndarray or None
+            None if dense regions deconvolution is disabled.
+        calibration_df : pd.DataFrame
+            One line per sampled file.
+    """
+    sample_number = min(max(int(sample_number), 1), len(filenames_list))
+    sampled_files = sorted(np.random.default_rng(seed).choice(filenames_list, size=sample_number, replace=False))
+    calibration_parameters = convert_parameters_types(parameters.copy())
+    user_threshold = calibration_parameters.get('threshold')
+    threshold_penalty = calibration_parameters.get('threshold_penalty')
+    if type(threshold_penalty) == type(None) : threshold_penalty = 1
+    do_dense_regions_deconvolution = calibration_parameters['do_dense_regions_deconvolution']
+
+    images = []
+    thresholds = []
+    for file in sampled_files :
+        window_print(batch_window, "Calibration : opening {0}".format(file))
+        calibration_parameters['image'] = open_image(input_path + '/' + file)
+        image, _ = prepare_image_detection(map_, calibration_parameters)
+        images.append(image)
+        if type(user_threshold) == type(None) :
+            threshold = threshold_penalty * compute_auto_threshold(
+                image,
+                voxel_size=calibration_parameters['voxel_size'],
+                spot_radius=calibration_parameters.get('spot_size'),
+                log_kernel_size=calibration_parameters.get('log_kernel_size'),
+                minimum_distance=calibration_parameters.get('minimum_distance'),
+            )
+            thresholds.append(max(threshold, 1))
+    del calibration_parameters['image']
+
+    if type(user_threshold) == type(None) :
+        threshold = int(np.median(thresholds))
+        window_print(batch_window, "Calibrated threshold : {0} (std between files : {1:.2f})".format(threshold, np.std(thresholds)))
+    else :
+        threshold = None
+        thresholds = [user_threshold] * len(sampled_files)
+    calibration_parameters['threshold'] = user_threshold if threshold is None else threshold
+
+    reference_spots = []
+    spot_numbers = []
+    for image in images :
+        spots, _ = detect_spots(image, calibration_parameters, hide_loading=True)
+        spot_numbers.append(len(spots))
+        if do_dense_regions_deconvolution and len(spots) > 0 :
+            reference_spots.append(compute_dense_reference_spot(
+                image=image,
+                spots=spots,
+                voxel_size=calibration_parameters['voxel_size'],
+                spot_radius=calibration_parameters.get('spot_size'),
+                kernel_size=calibration_parameters.get('deconvolution_kernel'),
+                alpha=calibration_parameters['alpha'],
+                gamma=calibration_parameters['gamma'],
+            ))
+    del images
+
+    calibration_df = pd.DataFrame({
+        'filename' : sampled_files,
+        'threshold' : thresholds,
+        'spot_number' : spot_numbers,
+    })
+
+    if len(reference_spots) > 0 :
+        reference_spots = np.stack(reference_spots)
+        reference_spot = np.median(reference_spots, axis=0).round().astype(reference_spots.dtype)
+        reference_spot_std = reference_spots.std(axis=0)
+        calibration_df['reference_spot_max'] = reference_spots.reshape(len(reference_spots), -1).max(axis=1)
+        window_print(batch_window, "Calibrated reference spot : max {0} (mean pixel std between files : {1:.2f})".format(reference_spot.max(), reference_spot_std.mean()))
+    else :
+        reference_spot = None
+
+    return threshold, reference_spot, calibration_df
+
 def batch_pipeline(
         batch_window : sg.Window,
         batch_progress_bar : sg.ProgressBar,
@@ -45,21 +329,86 @@ def batch_pipeline(
     output_path = parameters['output_folder']
     batch_name = parameters['batch_name']
     time = '_' + get_datetime()
+    parameters_hash = hash_parameters(parameters, ignored_keys=CHECKPOINT_IGNORED_KEYS)
+
+    #Resuming previous batch (opt)
+    main_dir = None
+    if parameters.get('resume_batch') :
+        main_dir = find_resumable_batch(output_path, batch_name, parameters_hash)
+        if type(main_dir) == type(None) : window_print(batch_window,"No interrupted batch found with same name and parameters, starting new batch.")
+
+    if type(main_dir) != type(None) :
+        checkpoint = BatchCheckpoint.load(main_dir)
+        checkpoint.restore_results()
+        last_acquisition_id = checkpoint.first_acquisition_id
+        window_print(batch_window,"Resuming batch from {0} : {1} files already done.".format(main_dir, checkpoint.done_count()))
+    else :
+        main_dir = output_path + "/" + batch_name + time + "/"
+        checkpoint = BatchCheckpoint(main_dir, parameters_hash, first_acquisition_id= last_acquisition_id)
 
     #Preparing folder
     window_print(batch_window,"Creating folders for output...")
-    main_dir = output_path + "/" + batch_name + time + "/"
     os.makedirs(main_dir + "results/", exist_ok=True)
     if parameters['save segmentation'] : os.makedirs(main_dir + "segmentation/", exist_ok=True)
     if parameters['save detection'] : os.makedirs(main_dir + "detection/", exist_ok=True)
     if parameters['extract spots'] : os.makedirs(main_dir + "results/spots_extraction", exist_ok=True)
-    first_save = True # init for excel append
-    append_to_line = 1 #Start at line one
-    cell_append_to_line = 1 #Start at line one
+    first_save = checkpoint.offsets.get('first_save', True) # init for excel append
+    append_to_line = checkpoint.offsets.get('append_to_line', 1) #Start at line one
+    cell_append_to_line = checkpoint.offsets.get('cell_append_to_line', 1) #Start at line one
+    first_timing_save = checkpoint.offsets.get('first_timing_save', True)
+    first_distances_save = checkpoint.offsets.get('first_distances_save', True) # Empty distance tables are not written : header is set apart
 
     #Setting spot detection dimension
     parameters['dim'] = 3 if is_3D else 2
 
+    #Results cache (opt), shared by all batches saved in output folder
+    result_cache = ResultCache(output_path + "/" + RESULT_CACHE_DIRNAME) if parameters.get('use_result_cache') else None
+
+    #Detection channels : one set of detection parameters per channel, batch parameters if user didn't add channels
+    detection_channels = [dict(detection_channel) for detection_channel in parameters.get('detection_channels', [])]
+    if len(detection_channels) == 0 : detection_channels = [get_detection_channel(parameters)]
+    is_multi_detection = len(detection_channels) > 1
+    do_channels_colocalisation = is_multi_detection and parameters.get('do_channels_colocalisation')
+
+    #Thresholds and reference spots kept by an interrupted batch : resumed files are detected as they would have been without interruption
+    dense_reference_spots = [None] * len(detection_channels)
+    for detection_channel, threshold in zip(detection_channels, checkpoint.offsets.get('detection_thresholds', [])) :
+        if type(threshold) != type(None) : detection_channel['threshold'] = threshold
+    is_calibration_restored = 'dense_reference_spots' in checkpoint.offsets
+    if is_calibration_restored :
+        dense_reference_spots = [decode_array(reference_spot) for reference_spot in checkpoint.offsets['dense_reference_spots']]
+
+    #Calibration (opt) : same threshold and reference spot for every file
+    if parameters.get('do_batch_calibration') and not is_calibration_restored :
+        calibration_df_list = []
+        for channel_index, detection_channel in enumerate(detection_channels) :
+            window_print(batch_window,"Calibrating detection on a sample of files (channel {0})...".format(detection_channel['channel_to_compute']))
+            threshold, dense_reference_spots[channel_index], calibration_df = calibrate_detection(
+                batch_window=batch_window,
+                parameters={**parameters, **detection_channel},
+                filenames_list=filenames_list,
+                input_path=input_path,
+                map_=map_,
+                sample_number=parameters['calibration_sample_number'],
+            )
+            if type(threshold) != type(None) : detection_channel['threshold'] = threshold
+            if is_multi_detection : calibration_df['channel'] = detection_channel['channel_to_compute']
+            calibration_df_list.append(calibration_df)
+
+        write_results(
+            pd.concat(calibration_df_list, axis=0),
+            path= main_dir + "results/",
+            filename=batch_name + '_calibration',
+            do_excel= False,
+            do_csv= True,
+            overwrite=True,
+        )
+
+    #Channels are detected in parallel : cpus are shared between their dense regions decompositions
+    dense_regions_workers = max(1, (os.cpu_count() or 1) // len(detection_channels))
+
+    calibration_offsets = {'dense_reference_spots' : [encode_array(reference_spot) for reference_spot in dense_reference_spots]} if parameters.get('do_batch_calibration') else {}
+
     #Pipeline loop
     window_print(batch_window,"Launching batch analysis...")
     batch_progress_bar.update(max=len(filenames_list))
@@ -74,256 +423,411 @@ def batch_pipeline(
                 if col in cell_results_df : cell_results_df.drop(columns=col)
                 if col in results_df : results_df.drop(columns=col)
 
+    #Acquisitions are pipelined : next file is opened and segmented on a prefetching thread while current file is detected, results are written on a writer thread.
+    #Memory profiling needs stages not to overlap.
+    use_threads = not parameters.get('profile_memory', False)
+    acquisitions = []
     for acquisition_id, file in enumerate(filenames_list) :
-        try :
-
-            #GUI
-            window_print(batch_window,"\nNext file : {0}".format(file))
-            batch_progress_bar.update(current_count= acquisition_id, max= len(filenames_list))
-            progress_count.update(value=str(acquisition_id))
-            batch_window = batch_window.refresh()
-
-            #0. Open image
-            image = open_image(input_path + '/' + file)
-            parameters['image'] = image
-            parameters['filename'] = file
-            for key_to_clean in [0,2] : 
-                if key_to_clean in parameters : del parameters[key_to_clean]
-
-            #1. Re-order shape
-            shape = image.shape
-            parameters['shape'] = shape
-            parameters['reordered_shape'] = reorder_shape(shape, map_=map_)
-
-            #2. Segmentation (opt)
-            if do_segmentation :
-                window_print(batch_window,"Segmenting cells...")
-                im_seg = reorder_image_stack(map_, image)
-                parameters = _cast_segmentation_parameters(parameters)
-                nucleus_3D_segmentation = parameters['nucleus_radio_3D']
-                cytoplasm_3D_segmentation = parameters['cytoplasm_radio_3D']
-                parameters.setdefault('anisotropy',1),
-
-                cytoplasm_label, nucleus_label = cell_segmentation(
-                    im_seg,
-                    channels=[parameters['cytoplasm_channel'], parameters['nucleus_channel']],
-                    do_only_nuc=parameters['segment_only_nuclei'],
-                    external_nucleus_image = None,
-                    nucleus_3D_segmentation=nucleus_3D_segmentation,
-                    cyto_3D_segmentation=cytoplasm_3D_segmentation,
-                    **parameters
-                    )
-
-                parameters['segmentation_done'] = True
-
-                if cytoplasm_label.max() == 0 : #No cell segmented
-                    window_print(batch_window,"No cell was segmented, computing next image.")
-                    continue
-                else : 
-                    window_print(batch_window, "{0} cells segmented.".format(cytoplasm_label.max()))
-
-                    if parameters['save segmentation'] :
-                        plot_segmentation(
-                            cyto_image=im_seg[parameters['cytoplasm_channel']],
-                            cyto_label= cytoplasm_label,
-                            nuc_image= im_seg[parameters['nucleus_channel']],
-                            nuc_label=nucleus_label,
-                            path= main_dir + "segmentation/" + clean_filename(file),
-                            do_only_nuc= parameters['segment_only_nuclei'],
-                        )
-
-                    if parameters["save_masks"] :
-                        output_masks(
-                            batch_path= main_dir,
-                            acquisition_name= clean_filename(file),
-                            nucleus_label= nucleus_label,
-                            cytoplasm_label= cytoplasm_label if not parameters['segment_only_nuclei'] else None,
-                        )
-
-            else :
-                cytoplasm_label, nucleus_label = None,None
-                parameters['segmentation_done'] = False
-
-            #2.5 Background removal (opt)
-            print("do_background_removal : ", parameters['do_background_removal'])
-            print("is_multichannel : ", parameters['is_multichannel'])
-            if parameters["do_background_removal"] and parameters["is_multichannel"] :
-                window_print(batch_window, "Removing background....")
-                
-                _, other_image = prepare_image_detection(map_, parameters) 
-                image_stack = reorder_image_stack(map_, image)
-                signal_channel = int(parameters['channel_to_compute'])
-                background_channel = int(parameters["background_channel"])
+        if checkpoint.is_done(file) : window_print(batch_window,"\n{0} already done, skipping.".format(file))
+        else : acquisitions.append((acquisition_id + last_acquisition_id, file))
+
+    segmentation_parameters = dict(parameters) #Copy : parameters is modified by main thread during loading.
+    prefetcher = AcquisitionPrefetcher(
+        acquisitions,
+        load_function= lambda file : load_acquisition(input_path + '/' + file, segmentation_parameters, do_segmentation, map_, result_cache),
+        trace_memory= parameters.get('profile_memory', False),
+        use_thread= use_threads,
+    )
+    results_writer = ResultsWriter(use_thread=use_threads)
+
+    with prefetcher, results_writer :
+        for batch_acquisition_id, file, acquisition, loading_error, profiler in prefetcher :
+            acquisition_id = batch_acquisition_id - last_acquisition_id
+            acquisition_done = False
+            try :
+                with profiler :
+
+                    #GUI
+                    window_print(batch_window,"\nNext file : {0}".format(file))
+                    batch_progress_bar.update(current_count= acquisition_id, max= len(filenames_list))
+                    progress_count.update(value=str(acquisition_id))
+                    batch_window = batch_window.refresh()
+
+                    #0. Open image and 2. Segmentation (opt) : done on prefetching thread
+                    if type(loading_error) != type(None) : raise loading_error
+                    image = acquisition['image']
+                    file_hash = acquisition['file_hash']
+                    projection_cache = acquisition['projection_cache']
+                    parameters['image'] = image
+                    parameters['filename'] = file
+                    for key_to_clean in [0,2] : 
+                        if key_to_clean in parameters : del parameters[key_to_clean]
+
+                    #1. Re-order shape
+                    shape = image.shape
+                    parameters['shape'] = shape
+                    parameters['reordered_shape'] = reorder_shape(shape, map_=map_)
+
+                    #2. Segmentation (opt)
+                    if do_segmentation :
+                        im_seg = reorder_image_stack(map_, image)
+                        parameters = _cast_segmentation_parameters(parameters)
+                        cytoplasm_label, nucleus_label = acquisition['cytoplasm_label'], acquisition['nucleus_label']
+                        if acquisition['segmentation_from_cache'] : window_print(batch_window,"Segmentation loaded from cache.")
+
+                        parameters['segmentation_done'] = True
+
+                        if cytoplasm_label.max() == 0 : #No cell segmented
+                            window_print(batch_window,"No cell was segmented, computing next image.")
+                            acquisition_done = True
+                            continue
+                        else : 
+                            window_print(batch_window, "{0} cells segmented.".format(cytoplasm_label.max()))
+
+                            if parameters['save segmentation'] :
+                                with profile_stage('segmentation_visuals') :
+                                    plot_segmentation(
+                                        cyto_image=im_seg[parameters['cytoplasm_channel']],
+                                        cyto_label= cytoplasm_label,
+                                        nuc_image= im_seg[parameters['nucleus_channel']],
+                                        nuc_label=nucleus_label,
+                                        path= main_dir + "segmentation/" + clean_filename(file),
+                                        do_only_nuc= parameters['segment_only_nuclei'],
+                                        projection_cache= projection_cache,
+                                    )
+
+                            if parameters["save_masks"] :
+                                with profile_stage('masks_saving') :
+                                    output_masks(
+                                        batch_path= main_dir,
+                                        acquisition_name= clean_filename(file),
+                                        nucleus_label= nucleus_label,
+                                        cytoplasm_label= cytoplasm_label if not parameters['segment_only_nuclei'] else None,
+                                    )
+
+                    else :
+                        cytoplasm_label, nucleus_label = None,None
+                        parameters['segmentation_done'] = False
+
+                    #2.5 Background removal (opt)
+                    print("do_background_removal : ", parameters['do_background_removal'])
+                    print("is_multichannel : ", parameters['is_multichannel'])
+                    channels_images = []
+                    for detection_channel in detection_channels :
+                        channel_parameters = {**parameters, **detection_channel}
+                        if parameters["do_background_removal"] and parameters["is_multichannel"] :
+                            window_print(batch_window, "Removing background....")
+                            from AF_eraser import remove_autofluorescence_RANSACfit #Lazy import : only needed for background removal
+                    
+                            _, other_image = prepare_image_detection(map_, channel_parameters) 
+                            image_stack = reorder_image_stack(map_, parameters['image'])
+                            signal_channel = int(channel_parameters['channel_to_compute'])
+                            background_channel = int(parameters["background_channel"])
+                    
+                            image= image_stack[signal_channel]
+                            background = image_stack[background_channel]
+
+                            with profile_stage('background_removal') :
+                                result, score = remove_autofluorescence_RANSACfit(
+                                    signal=image,
+                                    background=background,
+                                    max_trials=100
+                                )
+
+
+                            print("\rBackground substraction done.")
+                        else :
+                            image, other_image = prepare_image_detection(map_, channel_parameters) 
+                        channels_images.append((image, other_image))
+
+
+                    #3. Detection, deconvolution, clusterisation
+                    window_print(batch_window,"Detecting spots...")
+                    parameters = convert_parameters_types(parameters)
+                    parameters['show_interactive_threshold_selector'] = False #Disactivated in batch mode
+                    parameters['show_napari_corrector'] = False
+
+                    detection_kwargs = [{
+                        'image' : image,
+                        'other_image' : other_image,
+                        'channel_parameters' : convert_parameters_types({**parameters, **detection_channel, 'dense_regions_workers' : dense_regions_workers}),
+                        'cytoplasm_label' : cytoplasm_label,
+                        'nucleus_label' : nucleus_label,
+                        'dense_reference_spot' : dense_reference_spot,
+                        'result_cache' : result_cache,
+                        'file_hash' : file_hash,
+                        'map_' : map_,
+                    } for detection_channel, (image, other_image), dense_reference_spot in zip(detection_channels, channels_images, dense_reference_spots)]
+
+                    try : # Catch error raised if user enter a spot size too small compare to voxel size
+                        if is_multi_detection : #Channels are detected in parallel, numpy and bigfish release the GIL for most of the work
+                            with profile_stage('detection'), ThreadPoolExecutor(max_workers=len(detection_channels)) as executor :
+                                detection_results = list(executor.map(lambda kwargs : _detect_channel_in_thread(profiler, kwargs), detection_kwargs))
+                        else :
+                            detection_results = [_detect_channel(**detection_kwargs[0])]
+
+                    except ValueError as error :
+                        if "The array should have an upper bound of 1" in str(error) :
+                            window_print(batch_window,"Spot size too small for current voxel size.")
+                            acquisition_done = True
+                            continue
+                        else :
+                            raise(error)
+
+                    #Labels used for features computation
+                    if do_segmentation :
+                        features_nucleus_label = nucleus_label if nucleus_label.ndim == 2 else maximum_projection(nucleus_label, projection_cache)
+                        features_cytoplasm_label= cytoplasm_label if cytoplasm_label.ndim == 2 else maximum_projection(cytoplasm_label, projection_cache)
+                    else :
+                        features_nucleus_label = None
+                        features_cytoplasm_label = None
+
+                    channels_spots = {}
+                    channels_clusters = {}
+                    channels_results_df_list = []
+                    channels_cell_results_df_list = []
+                    for detection_channel, (image, other_image), detection_result in zip(detection_channels, channels_images, detection_results) :
+                        parameters_used, frame_result, spots, clusters, spot_cluster_id, *_, loaded_from_cache = detection_result
+                        #As in single channel batch, threshold computed on first file is kept for next files (python scalar : saved in checkpoint and hashed in cache keys)
+                        detection_channel['threshold'] = parameters_used['threshold'] if type(parameters_used['threshold']) == type(None) else np.asarray(parameters_used['threshold']).item()
+                        channel = parameters_used['channel_to_compute']
+                        channel_suffix = "_channel{0}".format(channel) if is_multi_detection else ""
+                        channels_spots[channel] = spots
+                        channels_clusters[channel] = clusters
+                        if is_multi_detection : window_print(batch_window,"Channel {0} : {1} spots detected.".format(channel, len(spots)))
+                        if loaded_from_cache : window_print(batch_window,"Spots loaded from cache.")
+
+                        if parameters['save detection'] :
+                            if parameters_used['do_cluster_computation'] : 
+                                if len(clusters) > 0 :
+                                    spots_list = [spots, clusters[:,:-2]]
+                                else : spots_list = [spots]
+                            else : spots_list = [spots]
+                            with profile_stage('detection_visuals') :
+                                output_spot_tiffvisual(
+                                    image,
+                                    spots_list= spots_list,
+                                    dot_size=2,
+                                    path_output= main_dir + "detection/" + clean_filename(file) + channel_suffix + "_spot_detection.tiff",
+                                    projection_cache= projection_cache,
+                                )
+
+                        #4. Spots extraction
+                        window_print(batch_window,"Extracting spots : ")
+                        if parameters['extract spots'] :
+
+                            #Setting parameter for call to lauch spot extraction
+                            #Only spots have one file per image to avoir memory overload
+                            parameters_used['do_spots_excel'] = parameters['xlsx']
+                            parameters_used['do_spots_csv'] = parameters['csv']
+                            parameters_used['spots_filename'] = "spots_extractions_{0}".format(clean_filename(file) + channel_suffix)
+                            parameters_used['spots_extraction_folder'] = main_dir + "results/spots_extraction/"
+
+                            with profile_stage('spots_extraction') :
+                                launch_spots_extraction(
+                                        acquisition_id=acquisition_id + last_acquisition_id,
+                                        user_parameters=parameters_used,
+                                        image=image,
+                                        spots=spots,
+                                        cluster_id=spot_cluster_id,
+                                        nucleus_label= nucleus_label,
+                                        cell_label= cytoplasm_label,
+                                    )
+
+                        #5. Features computation
+                        window_print(batch_window,"computing features...")
+                        nucleus_signal = get_nucleus_signal(image, other_image, parameters_used)
+
+                        with profile_stage('features_computation') :
+                            new_results_df, new_cell_results_df = launch_features_computation(
+                            acquisition_id=acquisition_id + last_acquisition_id,
+                            image=image,
+                            nucleus_signal = nucleus_signal,
+                            spots=spots,
+                            clusters=clusters,
+                            spots_cluster_id=spot_cluster_id,            
+                            nucleus_label=features_nucleus_label,
+                            cell_label=features_cytoplasm_label,
+                            user_parameters=parameters_used,
+                            frame_results=frame_result,
+                            projection_cache=projection_cache,
+                            )
+
+                        if is_multi_detection :
+                            new_results_df['channel'] = channel
+                            new_cell_results_df['channel'] = channel
+
+                        for col in COLUMNS_TO_DROP :
+                            if col in new_cell_results_df : new_cell_results_df.drop(columns=col)
+                            if col in new_results_df : new_results_df.drop(columns=col)
+
+                        channels_results_df_list.append(new_results_df.reset_index(drop=True))
+                        channels_cell_results_df_list.append(new_cell_results_df.reset_index(drop=True))
+
+                    #Results added once every channel succeeded : an error on a channel skips the whole acquisition
+                    results_df = pd.concat([results_df.reset_index(drop=True)] + channels_results_df_list, axis=0)
+                    cell_results_df = pd.concat([cell_results_df.reset_index(drop=True)] + channels_cell_results_df_list, axis=0)
+
+                    #5.5 Colocalisation between channels (opt)
+                    if do_channels_colocalisation :
+                        window_print(batch_window,"computing colocalisation between channels...")
+                        with profile_stage('colocalisation') :
+                            coloc_df = compute_channels_colocalisation(
+                                acquisition_id=acquisition_id + last_acquisition_id,
+                                filename=file,
+                                channels_spots=channels_spots,
+                                distance=int(parameters['channels_coloc_distance']),
+                                voxel_size=parameters['voxel_size'],
+                            )
+
+                    #5.6 Nearest neighbour distances (opt)
+                    if parameters.get('do_distance_tables') :
+                        window_print(batch_window,"computing nearest neighbour distances...")
+                        with profile_stage('distance_tables') :
+                            distances_df = compute_nearest_neighbour_table(
+                                channels={channel : (channels_spots[channel], channels_clusters[channel]) for channel in channels_spots},
+                                voxel_size=parameters['voxel_size'],
+                            )
+                            distances_df.insert(0, 'acquisition_id', np.int32(acquisition_id + last_acquisition_id))
+
+                    #6. Saving results
+                    if parameters['xlsx'] :
+                        if first_save : xlsx_header = True
+                        else : xlsx_header = False
+
+                    window_print(batch_window,"saving image_results...")
+                    #1 file per batch + 1 file per batch if segmentation
+                    with profile_stage('writing') : #Only waiting for writer queue, tables are written on writer thread
+                        results_writer.submit(
+                            batch_acquisition_id,
+                            write_results,
+                            results_df, 
+                            path= main_dir + "results/", 
+                            filename=batch_name, 
+                            do_excel= parameters["xlsx"], 
+                            do_csv= parameters["csv"],
+                            overwrite=True,
+                            batch_mode=True,
+                            header=first_save,
+                            xlsx_start_line=append_to_line
+                            )
+                        append_to_line += len(results_df)
+                        results_df = results_df.drop(results_df.index)
+
+                        if do_segmentation :
+                            results_writer.submit(
+                                batch_acquisition_id,
+                                write_results,
+                                cell_results_df, 
+                                path= main_dir + "results/", 
+                                filename=batch_name + '_cell_result', 
+                                do_excel= parameters["xlsx"], 
+                                do_csv= parameters["csv"],
+                                overwrite=True,
+                                batch_mode=True,
+                                header=first_save,
+                                xlsx_start_line=cell_append_to_line
+                                )
+                            cell_append_to_line += len(cell_results_df)
+                            cell_results_df = cell_results_df.drop(cell_results_df.index)
+
+                        if do_channels_colocalisation :
+                            results_writer.submit(
+                                batch_acquisition_id,
+                                write_results,
+                                coloc_df,
+                                path= main_dir + "results/",
+                                filename=batch_name + '_coloc',
+                                do_excel= False,
+                                do_csv= True,
+                                overwrite=True,
+                                batch_mode=True,
+                                header=first_save,
+                                )
+                        if parameters.get('do_distance_tables') :
+                            results_writer.submit(
+                                batch_acquisition_id,
+                                write_results,
+                                distances_df,
+                                path= main_dir + "results/",
+                                filename=batch_name + '_distances',
+                                do_excel= False,
+                                do_csv= True,
+                                overwrite=True,
+                                batch_mode=True,
+                                header=first_distances_save,
+                                )
+                            if len(distances_df) > 0 : first_distances_save = False
+                    first_save = False
+                    acquisition_done = True
+                    window_print(batch_window,"Results sent to writer.")
+
+
+            except Exception as error :
+            
+            
+                with open(main_dir + "error_log", mode='a') as error_log :
+            
+                    error_count +=1
+                    print("Exception raised for acquisition, writting error in error log.")
+
+                    log = [
+                        f"Error raised during acquisition {acquisition_id}.\n",
+                        f"{error}\n",
+                        f"traceback :\n{traceback.format_exc()}"
+                    ]
                 
-                image= image_stack[signal_channel]
-                background = image_stack[background_channel]
 
-                result, score = remove_autofluorescence_RANSACfit(
-                    signal=image,
-                    background=background,
-                    max_trials=100
-                )
-
-
-                print("\rBackground substraction done.")
-            else :
-                image, other_image = prepare_image_detection(map_, parameters) 
-
-
-            #3. Detection, deconvolution, clusterisation
-            window_print(batch_window,"Detecting spots...")
-            parameters = convert_parameters_types(parameters)
-            nucleus_signal = get_nucleus_signal(image, other_image, parameters)
-            try : # Catch error raised if user enter a spot size too small compare to voxel size
-                parameters['show_interactive_threshold_selector'] = False #Disactivated in batch mode
-                parameters['show_napari_corrector'] = False
-                parameters, frame_result, spots, clusters, spot_cluster_id, *_ = launch_detection(
-                    image,
-                    other_image,
-                    parameters,
-                    cell_label=cytoplasm_label,
-                    nucleus_label=nucleus_label,
-                    hide_loading=True,
-                )
-
-            except ValueError as error :
-                if "The array should have an upper bound of 1" in str(error) :
-                    window_print(batch_window,"Spot size too small for current voxel size.")
-                    continue
-                else :
-                    raise(error)
-
-            if parameters['save detection'] :
-                if parameters['do_cluster_computation'] : 
-                    if len(clusters) > 0 :
-                        spots_list = [spots, clusters[:,:-2]]
-                    else : spots_list = [spots]
-                else : spots_list = [spots]
-                output_spot_tiffvisual(
-                    image,
-                    spots_list= spots_list,
-                    dot_size=2,
-                    path_output= main_dir + "detection/" + clean_filename(file) + "_spot_detection.tiff"
-                )
-
-            #4. Spots extraction
-            window_print(batch_window,"Extracting spots : ")
-            if parameters['extract spots'] :
-
-                #Setting parameter for call to lauch spot extraction
-                #Only spots have one file per image to avoir memory overload
-                parameters['do_spots_excel'] = parameters['xlsx']
-                parameters['do_spots_csv'] = parameters['csv']
-                parameters['spots_filename'] = "spots_extractions_{0}".format(clean_filename(file))
-                parameters['spots_extraction_folder'] = main_dir + "results/spots_extraction/"
-
-                launch_spots_extraction(
-                        acquisition_id=acquisition_id + last_acquisition_id,
-                        user_parameters=parameters,
-                        image=image,
-                        spots=spots,
-                        cluster_id=spot_cluster_id,
-                        nucleus_label= nucleus_label,
-                        cell_label= cytoplasm_label,
+                    error_log.writelines(log)
+
+                print("Ignoring current acquisition and proceeding to next one.")
+                continue
+
+            finally :
+                #Stage timings are saved even for skipped acquisitions
+                timings = profiler.to_dataframe()
+                if len(timings) > 0 :
+                    results_writer.submit(
+                        batch_acquisition_id,
+                        write_results,
+                        timings,
+                        path= main_dir + "results/",
+                        filename=batch_name + '_timings',
+                        do_excel= False,
+                        do_csv= True,
+                        overwrite=True,
+                        batch_mode=True,
+                        header=first_timing_save,
                     )
-
-            #5. Features computation
-            window_print(batch_window,"computing features...")
-
-            if do_segmentation :
-                nucleus_label = nucleus_label if nucleus_label.ndim == 2 else np.max(nucleus_label,axis=0)
-                cytoplasm_label= cytoplasm_label if cytoplasm_label.ndim == 2 else np.max(cytoplasm_label, axis=0)
-            else :
-                nucleus_label = None
-                cell_label = None
-
-            new_results_df, new_cell_results_df = launch_features_computation(
-            acquisition_id=acquisition_id + last_acquisition_id,
-            image=image,
-            nucleus_signal = nucleus_signal,
-            spots=spots,
-            clusters=clusters,
-            spots_cluster_id=spot_cluster_id,            
-            nucleus_label=nucleus_label,
-            cell_label=cytoplasm_label,
-            user_parameters=parameters,
-            frame_results=frame_result,
-            )
-
-            for col in COLUMNS_TO_DROP :
-                if col in new_cell_results_df : new_cell_results_df.drop(columns=col)
-                if col in new_results_df : new_results_df.drop(columns=col)
-
-            results_df = pd.concat([
-                results_df.reset_index(drop=True), new_results_df.reset_index(drop=True)
-            ], axis=0)
-
-            cell_results_df = pd.concat([
-                cell_results_df.reset_index(drop=True), new_cell_results_df.reset_index(drop=True)
-            ], axis=0)
-
-
-            #6. Saving results
-            if parameters['xlsx'] :
-                if first_save : xlsx_header = True
-                else : xlsx_header = False
-
-            window_print(batch_window,"saving image_results...")
-            #1 file per batch + 1 file per batch if segmentation
-            acquisition_success = write_results(
-                results_df, 
-                path= main_dir + "results/", 
-                filename=batch_name, 
-                do_excel= parameters["xlsx"], 
-                do_csv= parameters["csv"],
-                overwrite=True,
-                batch_mode=True,
-                header=first_save,
-                xlsx_start_line=append_to_line
-                )
-            append_to_line += len(results_df)
-            results_df = results_df.drop(results_df.index)
-
-            if do_segmentation :
-                cell_success = write_results(
-                    cell_results_df, 
-                    path= main_dir + "results/", 
-                    filename=batch_name + '_cell_result', 
-                    do_excel= parameters["xlsx"], 
-                    do_csv= parameters["csv"],
-                    overwrite=True,
-                    batch_mode=True,
-                    header=first_save,
-                    xlsx_start_line=cell_append_to_line
+                    first_timing_save = False
+
+                if acquisition_done : #Recorded after acquisition tables are written, skipped by writer if one of them failed
+                    results_writer.submit(
+                        batch_acquisition_id,
+                        checkpoint.record,
+                        file,
+                        acquisition_id + last_acquisition_id,
+                        first_save=first_save,
+                        append_to_line=append_to_line,
+                        cell_append_to_line=cell_append_to_line,
+                        first_timing_save=first_timing_save,
+                        first_distances_save=first_distances_save,
+                        detection_thresholds=[detection_channel['threshold'] for detection_channel in detection_channels],
+                        **calibration_offsets,
                     )
-                cell_append_to_line += len(cell_results_df)
-                cell_results_df = cell_results_df.drop(cell_results_df.index)
-            first_save = False
-            window_print(batch_window,"Sucessfully saved.")
 
-
-        except Exception as error :
-            
-            
-            with open(main_dir + "error_log", mode='a') as error_log :
-            
+    #Errors raised while writing results
+    if len(results_writer.errors) > 0 :
+        with open(main_dir + "error_log", mode='a') as error_log :
+            for batch_acquisition_id, error, error_traceback in results_writer.errors :
                 error_count +=1
-                print("Exception raised for acquisition, writting error in error log.")
-
-                log = [
-                    f"Error raised during acquisition {acquisition_id}.\n",
+                error_log.writelines([
+                    f"Error raised while writing results of acquisition {batch_acquisition_id - last_acquisition_id}.\n",
                     f"{error}\n",
-                    f"traceback :\n{traceback.format_exc()}"
-                ]
-                
+                    f"traceback :\n{error_traceback}"
+                ])
 
-                error_log.writelines(log)
-
-            print("Ignoring current acquisition and proceeding to next one.")
-            continue
-
-    
-        
+    acquisition_id = len(filenames_list) - 1
     batch_progress_bar.update(current_count= acquisition_id+1, max= len(filenames_list))
     progress_count.update(value=str(acquisition_id+1))
     batch_window = batch_window.refresh()
@@ -7,7 +7,7 @@ import FreeSimpleGUI as sg
 
 
 from .utils import get_elmt_from_key, create_map, call_auto_map
-from .pipeline import batch_pipeline
+from .pipeline import batch_pipeline, get_detection_channel
 from .update import (
     update_detection_tab, 
     update_map_tab, 
@@ -128,7 +128,17 @@ def batch_promp(
         default_dict= preset,
     )
     apply_detection_button = sg.Button('apply', key='apply-detection')
-    detection_layout += [[apply_detection_button]]
+    detection_channels_text = sg.Text("Detection channels : none (single channel batch)")
+    detection_layout += [
+        [sg.Text("Calibration", font=('bold',15), pad=(0,10))],
+        [sg.Checkbox("calibrate on sample", key='do_batch_calibration', tooltip= "Compute threshold and reference spot (dense regions deconvolution) once on a random sample of files,\nthen use them for every file of the batch."), sg.Text("files : "), sg.InputText(default_text='5', size=5, key='calibration_sample_number')],
+        [sg.Text("Multi-channel detection", font=('bold',15), pad=(0,10))],
+        [sg.Button('add channel', key='add-detection-channel', tooltip= "Save current detection settings for the selected channel.\nEach file is then opened and segmented once and every added channel is detected with its own settings."), sg.Button('clear channels', key='clear-detection-channels')],
+        [detection_channels_text],
+        [sg.Checkbox("nearest neighbour distances", key='do_distance_tables', tooltip= "Save distance (nm) from every spot and cluster to the nearest spot and cluster of each channel (csv table).")],
+        [sg.Checkbox("colocalisation between channels", key='do_channels_colocalisation', tooltip= "Count spots of each channel closer than distance to a spot of another channel (csv table)."), sg.Text("distance (nm) : "), sg.InputText(default_text='', size=5, key='channels_coloc_distance')],
+        [apply_detection_button]
+        ]
     detection_keys_to_hide = ['do_spots_csv', 'do_spots_excel', 'spots_filename','spots_extraction_folder', 'spots_extraction_folder_browse']
     detection_tab = sg.Tab("Detection", detection_layout, visible=False)
 
@@ -142,14 +152,20 @@ def batch_promp(
     save_segmentation_masks_box = sg.Check("save labels",  disabled=True, key="save_masks", tooltip= "Save segmentation labels as .npy files.")
     save_detection_box = sg.Checkbox("create spot detection visuals", key= 'save detection', tooltip="Create is_multichannel tiff with raw spot signal and detected spots.\nWarning if processing a lot of files make sure you have enough free space on your hard drive.")
     extract_spots_box = sg.Checkbox("extract spots", key='extract spots')
+    profile_memory_box = sg.Checkbox("trace memory usage (slower)", key='profile_memory', tooltip= "Record python memory peak of each stage in the timings table.\nStage timings are always saved in the results folder.")
+    result_cache_box = sg.Checkbox("reuse cached results", key='use_result_cache', tooltip= "Segmentation, spots and clusters are cached in output folder.\nWhen re-analysing the same files only stages whose parameters changed are recomputed.")
+    resume_batch_box = sg.Checkbox("resume interrupted batch", key='resume_batch', tooltip= "If a batch with the same name and parameters was interrupted in output folder, files already done are skipped and results are appended to its tables.")
     batch_name_input = sg.InputText(size=25, key='batch_name')
     output_layout=[
         [sg.Text("Output folder", font=('bold',15), pad=(0,10))],
         [show_batch_folder_text],
         [sg.Text("Select a folder : "), sg.FolderBrowse(initial_folder=default.working_directory, key='output_folder', target=(1,-1))],
         [sg.Text("Name for batch : "), batch_name_input],
+        [resume_batch_box],
+        [result_cache_box],
         [save_detection_box],
         [extract_spots_box],
+        [profile_memory_box],
         [sg.Text("Data extension", font=('bold',15), pad=(0,10))],
         [sg.Checkbox(".csv", key='csv'),sg.Checkbox(".xlsx", key='xlsx')],
         [sg.Text("Segmentation", font=('bold',15), pad=(0,10))],
@@ -238,6 +254,7 @@ def batch_promp(
         '_is_output_correct' : output_ok_text,
 
     }
+    detection_channels = []
     timeout = 1
     last_shape = None
     talk=True
@@ -371,6 +388,28 @@ def batch_promp(
                     shape=last_shape
                 )
 
+            elif event == 'add-detection-channel' :
+                is_channel_ok, values = check_detection_parameters(
+                    values=values,
+                    do_dense_region_deconvolution=do_dense_regions_deconvolution,
+                    do_clustering=do_clustering,
+                    is_multichannel=is_multichanel,
+                    is_3D=is_3D,
+                    map_= Master_parameters_dict.get('_map'),
+                    shape=last_shape
+                )
+                if not is_multichanel :
+                    sg.popup("Several detection channels can only be set for multichannel images.")
+                elif is_channel_ok :
+                    detection_channel = get_detection_channel(values)
+                    detection_channels = [channel for channel in detection_channels if channel['channel_to_compute'] != detection_channel['channel_to_compute']] #Replacing previous settings of this channel
+                    detection_channels.append(detection_channel)
+                    detection_channels_text.update("Detection channels : " + ", ".join([str(channel['channel_to_compute']) for channel in detection_channels]))
+
+            elif event == 'clear-detection-channels' :
+                detection_channels = []
+                detection_channels_text.update("Detection channels : none (single channel batch)")
+
             elif event == 'apply-output' :
                 Master_parameters_dict['_is_output_correct'], values = check_output_parameters(values)
                 batch_name_input.update(value=values.get('batch_name'))
@@ -389,6 +428,8 @@ def batch_promp(
 
             elif event == 'Start' :
                 start_button.update(disabled=True)
+                values['detection_channels'] = detection_channels
+                values['cell_features_workers'] = get_settings().cell_features_workers
                 results_df, cell_results_df, acquisition_id = batch_pipeline(
                     batch_window= window,
                     batch_progress_bar= batch_progression_bar,
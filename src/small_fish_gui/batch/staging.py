@@ -0,0 +1,152 @@
+"""
+Threads overlapping batch pipeline stages between acquisitions : next acquisition is opened and segmented while current acquisition is detected,
+and results of previous acquisition are written in background. Queues are bounded so only a few acquisitions are held in memory at once.
+
+Functions run on these threads must not call the GUI, window updates stay in main thread.
+"""
+
+import threading, queue, traceback
+
+from ..pipeline import AcquisitionProfiler
+
+_STOP = object()
+
+class AcquisitionPrefetcher :
+    """
+    Iterates over acquisitions, loading them with `load_function(file)` ahead of the consumer.
+
+    Yields (acquisition_id, file, acquisition, error, profiler) :
+        acquisition is the output of `load_function`, None if it raised `error`.
+        profiler holds the stages recorded while loading and can be re-entered by consumer to record next stages.
+
+    PARAMETERS
+    ----------
+        acquisitions : list
+            (acquisition_id, file) tuples.
+        load_function : callable
+            Called with file, must not call GUI.
+        queue_size : int
+            Maximum number of loaded acquisitions waiting for consumer.
+        use_thread : bool
+            If False acquisitions are loaded lazily in consumer thread (no overlap).
+    """
+
+    def __init__(self, acquisitions : list, load_function, trace_memory = False, queue_size = 1, use_thread = True) :
+        self.acquisitions = acquisitions
+        self.load_function = load_function
+        self.trace_memory = trace_memory
+        self.use_thread = use_thread
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self) :
+        if self.use_thread :
+            self._thread = threading.Thread(target=self._produce, name="small_fish_prefetcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) :
+        self.close()
+        return False
+
+    def __iter__(self) :
+        if not self.use_thread :
+            for acquisition_id, file in self.acquisitions :
+                yield self._load(acquisition_id, file)
+            return
+
+        while True :
+            item = self._queue.get()
+            if item is _STOP : return
+            yield item
+
+    def _load(self, acquisition_id : int, file : str) :
+        profiler = AcquisitionProfiler(
+            acquisition_id= acquisition_id,
+            filename= file,
+            trace_memory= self.trace_memory,
+        )
+        try :
+            with profiler :
+                acquisition = self.load_function(file)
+        except Exception as error :
+            return acquisition_id, file, None, error, profiler
+
+        return acquisition_id, file, acquisition, None, profiler
+
+    def _put(self, item) -> bool :
+        while not self._stop.is_set() :
+            try :
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full :
+                continue
+        return False
+
+    def _produce(self) :
+        for acquisition_id, file in self.acquisitions :
+            if self._stop.is_set() : return
+            if not self._put(self._load(acquisition_id, file)) : return
+        self._put(_STOP)
+
+    def close(self) :
+        """
+        Stops loading, waits for current load to finish.
+        """
+        self._stop.set()
+        if type(self._thread) != type(None) :
+            self._thread.join()
+            self._thread = None
+
+class ResultsWriter :
+    """
+    Runs writing tasks in submission order on a background thread.
+
+    If a task raises, following tasks of the same acquisition are skipped (so checkpoint is not recorded for it) and error is kept in `errors` as (acquisition_id, error, traceback).
+    With use_thread=False tasks are run on submission.
+    """
+
+    def __init__(self, queue_size = 2, use_thread = True) :
+        self.use_thread = use_thread
+        self.errors = []
+        self._failed_acquisitions = set()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+
+    def __enter__(self) :
+        if self.use_thread :
+            self._thread = threading.Thread(target=self._consume, name="small_fish_writer", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) :
+        self.close()
+        return False
+
+    def submit(self, acquisition_id : int, function, *args, **kwargs) :
+        if self.use_thread : self._queue.put((acquisition_id, function, args, kwargs))
+        else : self._run(acquisition_id, function, args, kwargs)
+
+    def _run(self, acquisition_id : int, function, args, kwargs) :
+        if acquisition_id in self._failed_acquisitions : return
+        try :
+            function(*args, **kwargs)
+        except Exception as error :
+            self._failed_acquisitions.add(acquisition_id)
+            self.errors.append((acquisition_id, error, traceback.format_exc()))
+
+    def _consume(self) :
+        while True :
+            task = self._queue.get()
+            if task is _STOP : return
+            self._run(*task)
+
+    def close(self) :
+        """
+        Waits for all submitted tasks to be written.
+        """
+        if type(self._thread) != type(None) :
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
@@ -10,20 +10,21 @@ import napari
 from napari.viewer import Viewer
 
 from skimage.morphology import erosion, dilation
-from ..pipeline._bigfish_wrapers import _apply_log_filter, _local_maxima_mask
+from skimage.measure import label
+from ..pipeline._bigfish_wrapers import _apply_log_filter, _local_maxima_mask, diff_spots, cluster_spots_locally, decompose_dense_regions
 
 from napari.layers import Labels, Points, Image
 from napari.utils.events import EmitterGroup
 from magicgui import magicgui
 from magicgui.widgets import SpinBox
 from bigfish.detection import spots_thresholding, automated_threshold_setting
+from bigfish.detection.utils import build_reference_spot
 from napari.types import LayerDataTuple
 
 from abc import ABC, abstractmethod
 from typing import Tuple, List
 from ..utils import compute_anisotropy_coef
 
-from AF_eraser import remove_autofluorescence_RANSACfit
 from pathlib import Path
 from ..interface import open_image
 
@@ -84,11 +85,97 @@ def initialize_all_cluster_wizards(single_layer: Points, cluster_layer: Points):
     """
     Initialize all wizards for cluster interaction in Napari
     """
+    _CLUSTER_INDEXES.clear()
+    get_cluster_index(single_layer)
     return [
         cls(single_layer, cluster_layer)
         for cls in CLUSTER_WIZARDS
     ]
 
+class ClusterIndex :
+    """
+    Inverted index cluster_id -> row indices of spots in single layer, so wizards don't filter the whole spot table.
+    Index is updated in place by `set_cluster_id` and rebuilt on next lookup when spots are added/removed or when layer features are replaced.
+    """
+
+    def __init__(self, single_layer : Points) :
+        self.single_layer = single_layer
+        self.version = 0 # Incremented at each rebuild : row indices from an older version may be outdated.
+        self._members = {}
+        self._dirty = True
+        self.single_layer.events.data.connect(self._on_data_change)
+        self.single_layer.events.features.connect(self.invalidate)
+
+    def _on_data_change(self, event) :
+        if str(getattr(event, 'action', '')) in ('changing', 'changed') : return # Spots were moved, membership is unchanged
+        self.invalidate()
+
+    def invalidate(self, *args) :
+        self._dirty = True
+
+    def _get_cluster_id_column(self, spot_indices = slice(None)) -> np.ndarray :
+        # Spots added by hand may have no cluster id yet : they are considered free.
+        cluster_ids = self.single_layer.features['cluster_id'].iloc[spot_indices]
+        return pd.to_numeric(cluster_ids, errors='coerce').fillna(-1).to_numpy().astype(int)
+
+    def _build(self) :
+        cluster_ids = self._get_cluster_id_column()
+        order = np.argsort(cluster_ids, kind='stable')
+        unique_ids, starts = np.unique(cluster_ids[order], return_index=True)
+        groups = np.split(order, starts[1:]) if len(order) > 0 else []
+        self._members = {int(cluster_id) : set(group.tolist()) for cluster_id, group in zip(unique_ids, groups)}
+        self._dirty = False
+        self.version += 1
+
+    def _get_members(self) -> dict :
+        if self._dirty : self._build()
+        return self._members
+
+    def get_spots(self, cluster_ids) -> np.ndarray :
+        """
+        Returns sorted row indices of spots belonging to any of cluster_ids (int or iterable).
+        """
+        members = self._get_members()
+        cluster_ids = np.unique(np.atleast_1d(cluster_ids)).astype(int)
+        spots = [index for cluster_id in cluster_ids for index in members.get(int(cluster_id), ())]
+        return np.sort(np.array(spots, dtype=int))
+
+    def count(self, cluster_id : int) -> int :
+        return len(self._get_members().get(int(cluster_id), ()))
+
+    def get_cluster_ids(self, spot_indices) -> np.ndarray :
+        return self._get_cluster_id_column(np.asarray(spot_indices, dtype=int))
+
+    def set_cluster_id(self, spot_indices, new_cluster_id : int) -> np.ndarray :
+        """
+        Sets cluster_id of spots in single layer features and updates index. Returns previous cluster ids of these spots.
+        """
+        members = self._get_members()
+        spot_indices = np.asarray(spot_indices, dtype=int)
+        if len(spot_indices) == 0 : return np.empty(shape=(0,), dtype=int)
+        old_cluster_ids = self.get_cluster_ids(spot_indices)
+
+        features = self.single_layer.features
+        features.iloc[spot_indices, features.columns.get_loc('cluster_id')] = new_cluster_id
+
+        new_members = members.setdefault(int(new_cluster_id), set())
+        for spot_index, old_cluster_id in zip(spot_indices.tolist(), old_cluster_ids.tolist()) :
+            members[int(old_cluster_id)].discard(spot_index)
+            new_members.add(spot_index)
+
+        return old_cluster_ids
+
+_CLUSTER_INDEXES = {}
+def get_cluster_index(single_layer : Points) -> ClusterIndex :
+    """
+    Returns the ClusterIndex shared by all cluster widgets and wizards working on single_layer.
+    """
+    index = _CLUSTER_INDEXES.get(id(single_layer))
+    if index is None or index.single_layer is not single_layer :
+        index = ClusterIndex(single_layer)
+        _CLUSTER_INDEXES[id(single_layer)] = index
+    return index
+
 
 class CellLabelEraser(NapariWidget) :
     """
@@ -136,9 +223,10 @@ class FreeLabelPicker(NapariWidget) :
             auto_call=False
         )
         def label_pick()->None :
-            max_list = [label_layer.data.max() for label_layer in self.label_list]
+            max_list = [int(label_layer.data.max()) for label_layer in self.label_list]
             new_label = max(max_list) + 1
             for label_layer in self.label_list :
+                if new_label > np.iinfo(label_layer.data.dtype).max : label_layer.data = label_layer.data.astype(np.int32) #Compact labels are promoted when full
                 label_layer.selected_label = new_label
                 label_layer.refresh()
 
@@ -174,6 +262,7 @@ class SegmentationReseter(NapariWidget) :
 class ChangesPropagater(NapariWidget) :
     """
     Apply the changes across the vertical direction (Zstack) if confling values are found for a pixel, max label is kept.
+    2D label layers are already shown on every slice and are left untouched.
     """
     def __init__(self, label_list):
         self.label_list = label_list
@@ -188,12 +277,9 @@ class ChangesPropagater(NapariWidget) :
         )
         def apply_changes(label_number : int) -> None:
             for layer in self.label_list :
-                slices = layer.data.shape[0]
-                masked_layer = layer.data.copy()
-                masked_layer[masked_layer != label_number] = 0
-                masked_layer = np.max(masked_layer, axis=0)
-                expanded_layer = np.repeat(masked_layer[np.newaxis], slices, axis=0)
-                layer.data[expanded_layer == label_number] = expanded_layer[expanded_layer == label_number]
+                if layer.data.ndim < 3 : continue
+                label_mask = np.any(layer.data == label_number, axis=0)
+                layer.data[:, label_mask] = label_number
                 layer.refresh()
         return apply_changes
 
@@ -254,14 +340,14 @@ class ClusterIDSetter(ClusterWidget) :
             cluster_layer = self.viewer.layers["foci"]
             single_layer = self.viewer.layers["single spots"]
 
-            if cluster_id == -1 or cluster_id in cluster_layer.features['cluster_id'] :
+            if cluster_id == -1 or cluster_id in cluster_layer.features['cluster_id'].to_numpy() :
+                cluster_index = get_cluster_index(single_layer)
                 spots_selection = list(single_layer.selected_data)
-                cluster_id_in_selection = list(single_layer.features.loc[spots_selection,["cluster_id"]].to_numpy().flatten()) + [cluster_id]
-                single_layer.features.loc[spots_selection,["cluster_id"]] = cluster_id
+                cluster_id_in_selection = list(cluster_index.set_cluster_id(spots_selection, cluster_id)) + [cluster_id]
 
                 for cluster_id in np.unique(cluster_id_in_selection): # Then update number of spots in cluster
                     if cluster_id == -1 : continue
-                    new_spot_number = len(single_layer.features.loc[single_layer.features['cluster_id'] == cluster_id])
+                    new_spot_number = cluster_index.count(cluster_id)
                     cluster_layer.features.loc[cluster_layer.features['cluster_id'] == cluster_id, ["spot_number"]] = new_spot_number
                 cluster_layer.events.features()
             else :
@@ -286,7 +372,7 @@ class ClusterMerger(ClusterWidget) :
 
             cluster_layer : Points = self.viewer.layers["foci"]
             single_layer = self.viewer.layers["single spots"]
-            single_features = single_layer.features
+            cluster_index = get_cluster_index(single_layer)
             cluster_features = cluster_layer.features
 
             selected_clusters = list(cluster_layer.selected_data)
@@ -297,11 +383,11 @@ class ClusterMerger(ClusterWidget) :
             new_cluster_id = selected_cluster_ids.min()
 
             #Updating spots
-            belonging_spots = single_features.loc[single_features['cluster_id'].isin(selected_cluster_ids)].index
+            belonging_spots = cluster_index.get_spots(selected_cluster_ids)
 
             cluster_layer.remove_selected()
             #Creating new cluster
-            centroid = list(single_layer.data[list(belonging_spots)].mean(axis=0).round().astype(int))
+            centroid = list(single_layer.data[belonging_spots].mean(axis=0).round().astype(int))
             spot_number = len(belonging_spots)
             
             points_data = np.append(
@@ -334,34 +420,19 @@ class ClusterMerger(ClusterWidget) :
                     },"Points"
                 ))
 
-            #Updating spots
-            single_features.loc[belonging_spots, ["cluster_id"]] = new_cluster_id
-            single_layer_data = LayerDataTuple((
-                    single_layer.data,
-                    {
-                        "name" : "single spots",
-                        "scale" : tuple(single_layer.scale),
-                        "size" : max(single_layer.size),
-                        "opacity" : single_layer.opacity,
-                        "face_color" : single_layer.face_color,
-                        "border_color" : single_layer.border_color,
-                        "symbol" : "disc",
-                        "features" : {
-                            "cluster_id" : single_features["cluster_id"],
-                            "end" : single_features["end"]
-                        }
-                    },"Points"
-                ))
-
+            #Updating spots : features are modified in place, single layer doesn't need to be rebuilt.
+            cluster_index.set_cluster_id(belonging_spots, new_cluster_id)
+            single_layer.refresh()
                 
             cluster_layer.refresh()
-            return [cluster_layer_data, single_layer_data]
+            return [cluster_layer_data]
 
         return merge_cluster
 
 class ClusterUpdater(NapariWidget) :
     """
     Relaunch clustering algorithm taking into consideration new spots, new clusters and deleted clusters.
+    Unless parameters change or full recompute is asked, clustering is only recomputed around spots added or removed since last clustering.
     """
     def __init__(
             self, 
@@ -376,6 +447,7 @@ class ClusterUpdater(NapariWidget) :
         self.cluster_radius = default_cluster_radius
         self.min_spot = default_min_spot
         self.voxel_size = voxel_size
+        self._clustered_spots = single_layer.data.copy() # Spots at last clustering, to find spots added or removed since.
         super().__init__()
 
     def _compute_clusters(
@@ -424,12 +496,100 @@ class ClusterUpdater(NapariWidget) :
         self.single_layer.features.loc[:,["cluster_id"]] = spots_features['cluster_id']
         self.cluster_layer.features.loc[:,["cluster_id"]] = clusters_features['cluster_id']
         self.cluster_layer.features.loc[:,["spot_number"]] = clusters_features['spot_number']
+        get_cluster_index(self.single_layer).invalidate()
 
         self.cluster_layer.selected_data.clear()
         self.single_layer.refresh()
         self.cluster_layer.refresh()
 
-        
+    def _compute_clusters_locally(
+            self,
+            cluster_radius : int,
+            min_spot : int
+    ) -> Tuple[np.ndarray, np.ndarray] :
+        """
+        Recompute clusters only around spots added or removed since last clustering.
+        Returns new cluster id of each spot and indices of spots whose cluster was recomputed.
+        """
+        spots = self.single_layer.data
+        added, removed = diff_spots(self._clustered_spots, spots)
+        changed_spots = np.concatenate([spots[added], self._clustered_spots[removed]], axis=0)
+        spots_cluster_id = get_cluster_index(self.single_layer).get_cluster_ids(np.arange(len(spots)))
+        next_cluster_id = max(
+            spots_cluster_id.max(initial=-1),
+            pd.to_numeric(self.cluster_layer.features['cluster_id'], errors='coerce').max() if len(self.cluster_layer.features) > 0 else -1,
+        ) + 1
+
+        return cluster_spots_locally(
+            spots=spots,
+            spots_cluster_id=spots_cluster_id,
+            changed_spots=changed_spots,
+            voxel_size=self.voxel_size,
+            radius=cluster_radius,
+            nb_min_spots=min_spot,
+            new_spots_mask=added,
+            next_cluster_id=int(next_cluster_id),
+        )
+
+    def _patch_layers(
+            self,
+            spots_cluster_id : np.ndarray,
+            reclustered_idx : np.ndarray,
+    ) -> None :
+        """
+        Update only changed spots and clusters inside napari viewer.
+        """
+        cluster_index = get_cluster_index(self.single_layer)
+        previous_cluster_id = cluster_index.get_cluster_ids(reclustered_idx)
+        new_cluster_id = spots_cluster_id[reclustered_idx]
+        changed = previous_cluster_id != new_cluster_id
+        for cluster_id in np.unique(new_cluster_id[changed]) :
+            cluster_index.set_cluster_id(reclustered_idx[changed][new_cluster_id[changed] == cluster_id], cluster_id)
+
+        affected_clusters = np.unique(np.concatenate([previous_cluster_id, new_cluster_id]))
+        affected_clusters = affected_clusters[affected_clusters >= 0]
+
+        clusters_coordinates = self.cluster_layer.data.copy()
+        clusters_features = self.cluster_layer.features
+        layer_cluster_id = clusters_features['cluster_id'].to_numpy()
+        kept_rows = np.ones(len(clusters_coordinates), dtype=bool)
+        new_clusters = []
+        for cluster_id in affected_clusters :
+            belonging_spots = cluster_index.get_spots(cluster_id)
+            rows = np.flatnonzero(layer_cluster_id == cluster_id)
+            if len(belonging_spots) == 0 :
+                kept_rows[rows] = False
+                continue
+            centroid = self.single_layer.data[belonging_spots].mean(axis=0).round().astype(int)
+            if len(rows) > 0 :
+                clusters_coordinates[rows] = centroid
+                clusters_features.iloc[rows, clusters_features.columns.get_loc('spot_number')] = len(belonging_spots)
+            else :
+                new_clusters.append((centroid, len(belonging_spots), cluster_id))
+
+        if kept_rows.all() and len(new_clusters) == 0 :
+            self.cluster_layer.data = clusters_coordinates
+        else :
+            clusters_features = pd.concat([
+                clusters_features.loc[kept_rows],
+                pd.DataFrame({
+                    "spot_number" : [spot_number for _, spot_number, _ in new_clusters],
+                    "cluster_id" : [cluster_id for _, _, cluster_id in new_clusters],
+                    "end" : True,
+                })
+            ], axis=0, ignore_index=True)
+            clusters_coordinates = np.concatenate(
+                [clusters_coordinates[kept_rows]] + [[centroid] for centroid, _, _ in new_clusters],
+                axis=0
+            )
+            self.cluster_layer.data = clusters_coordinates
+            self.cluster_layer.features = clusters_features
+
+        self.cluster_layer.events.features()
+        self.cluster_layer.selected_data.clear()
+        self.single_layer.refresh()
+        self.cluster_layer.refresh()
+
 
     def _create_widget(self):
 
@@ -440,9 +600,15 @@ class ClusterUpdater(NapariWidget) :
         def relaunch_clustering(
             cluster_radius : int = self.cluster_radius,
             min_spot : int = self.min_spot,
+            full_recompute : bool = False,
         ) :
-            clusters_coordinates, spots_coordinates, clusters_features, spots_features = self._compute_clusters(cluster_radius=cluster_radius, min_spot=min_spot)
-            self._update_layers(clusters_coordinates, spots_coordinates, clusters_features, spots_features )
+            if full_recompute or cluster_radius != self.cluster_radius or min_spot != self.min_spot :
+                clusters_coordinates, spots_coordinates, clusters_features, spots_features = self._compute_clusters(cluster_radius=cluster_radius, min_spot=min_spot)
+                self._update_layers(clusters_coordinates, spots_coordinates, clusters_features, spots_features )
+            else :
+                spots_cluster_id, reclustered_idx = self._compute_clusters_locally(cluster_radius=cluster_radius, min_spot=min_spot)
+                self._patch_layers(spots_cluster_id, reclustered_idx)
+            self._clustered_spots = self.single_layer.data.copy()
             self.cluster_radius = cluster_radius
             self.min_spot = min_spot
 
@@ -461,10 +627,10 @@ class ClusterCreator(ClusterWidget) :
         def create_foci() -> list[LayerDataTuple] :
             single_layer : Points = self.viewer.layers["single spots"]
             cluster_layer = self.viewer.layers["foci"]
+            cluster_index = get_cluster_index(single_layer)
 
-            selected_spots_idx = pd.Index(list(single_layer.selected_data))
-            free_spots_idx : pd.Index = single_layer.features.loc[single_layer.features['cluster_id'] == -1].index
-            selected_spots_idx = selected_spots_idx[selected_spots_idx.isin(free_spots_idx)]
+            selected_spots_idx = np.array(sorted(single_layer.selected_data), dtype=int)
+            selected_spots_idx = selected_spots_idx[cluster_index.get_cluster_ids(selected_spots_idx) == -1] # Only free spots
 
             spot_number = len(selected_spots_idx)
             if spot_number == 0 :
@@ -508,28 +674,11 @@ class ClusterCreator(ClusterWidget) :
                     },"Points"
                 ))
 
-                #Update spots cluster_id
-                single_features = single_layer.features
-                single_features.loc[selected_spots_idx,["cluster_id"]] = new_cluster_id
-                single_layer_data = LayerDataTuple((
-                    single_layer.data,
-                    {
-                        "name" : "single spots",
-                        "scale" : tuple(single_layer.scale),
-                        "size" : max(single_layer.size),
-                        "opacity" : single_layer.opacity,
-                        "face_color" : single_layer.face_color,
-                        "border_color" : single_layer.border_color,
-                        "symbol" : "disc",
-                        "features" : {
-                            "cluster_id" : single_features["cluster_id"],
-                            "end" : single_features["end"]
-                        }
-                    },"Points"
-                ))
-
+                #Update spots cluster_id : features are modified in place, single layer doesn't need to be rebuilt.
+                cluster_index.set_cluster_id(selected_spots_idx, new_cluster_id)
+                single_layer.refresh()
                 
-                return [cluster_layer_data, single_layer_data]
+                return [cluster_layer_data]
         
         return create_foci
 
@@ -541,6 +690,9 @@ class ClusterInspector :
     def __init__(self, single_layer : Points, cluster_layer : Points):
         self.single_layer = single_layer
         self.cluster_layer = cluster_layer
+        self.cluster_index = get_cluster_index(single_layer)
+        self._colored_spots = np.empty(shape=(0,), dtype=int)
+        self._colored_version = None
         self.start_listening()
 
     def reset_single_colors(self) -> None:
@@ -550,13 +702,19 @@ class ClusterInspector :
     def start_listening(self) :
 
         def color_single_molecule_in_foci() -> None:
-            self.reset_single_colors()
-            selected_cluster_indices = self.cluster_layer.selected_data
-            for idx in selected_cluster_indices :
-                selected_cluster = self.cluster_layer.features.at[idx,"cluster_id"]
-                belonging_single_idex = self.single_layer.features.loc[self.single_layer.features['cluster_id'] == selected_cluster].index.to_numpy()
-                self.single_layer.face_color[belonging_single_idex] = [0,1,0,1] #Green
-                self.single_layer.refresh()
+            selected_cluster_indices = list(self.cluster_layer.selected_data)
+            selected_clusters = self.cluster_layer.features['cluster_id'].to_numpy()[selected_cluster_indices]
+            belonging_single_idex = self.cluster_index.get_spots(selected_clusters)
+
+            face_color = self.single_layer.face_color
+            if self._colored_version == self.cluster_index.version : #Only previously colored spots are reset
+                face_color[self._colored_spots] = [0,0,0,0] #transparent
+            else :
+                face_color[:] = [0,0,0,0]
+            face_color[belonging_single_idex] = [0,1,0,1] #Green
+            self._colored_spots = belonging_single_idex
+            self._colored_version = self.cluster_index.version
+            self.single_layer.refresh()
 
         self.cluster_layer.selected_data.events.items_changed.connect(color_single_molecule_in_foci)
 
@@ -573,10 +731,10 @@ class ClusterEraser(ClusterWizard) :
         self.original_remove_selected = self.cluster_layer.remove_selected
     
         def remove_selected_cluster() :
-            selected_cluster = self.cluster_layer.selected_data
-            for cluster_idx in selected_cluster : #First we update spots data
-                cluster_id = self.cluster_layer.features.at[cluster_idx, "cluster_id"]
-                self.single_layer.features.loc[self.single_layer.features['cluster_id'] == cluster_id, ['cluster_id']] = -1
+            cluster_index = get_cluster_index(self.single_layer)
+            selected_cluster = list(self.cluster_layer.selected_data)
+            cluster_ids = self.cluster_layer.features['cluster_id'].to_numpy()[selected_cluster]
+            cluster_index.set_cluster_id(cluster_index.get_spots(cluster_ids), -1) #First we update spots data
             
             self.original_remove_selected() # Then we launch the usual napari method
         
@@ -609,12 +767,13 @@ class SingleEraser(ClusterWizard) :
         self._origin_remove_single = self.single_layer.remove_selected
 
         def delete_single(*args, **kwargs) :
+            cluster_index = get_cluster_index(self.single_layer)
             selected_single_idx = list(self.single_layer.selected_data)
-            modified_cluster_ids = self.single_layer.features.loc[selected_single_idx, ["cluster_id"]].to_numpy().flatten()
+            modified_cluster_ids = cluster_index.get_cluster_ids(selected_single_idx)
 
             for cluster_id, count in zip(*np.unique(modified_cluster_ids, return_counts=True)): # Then update number of spots in cluster
                     if cluster_id == -1 : continue
-                    new_spot_number = len(self.single_layer.features.loc[self.single_layer.features['cluster_id'] == cluster_id]) - count #minus number of spot with this cluster id we remove
+                    new_spot_number = cluster_index.count(cluster_id) - count #minus number of spot with this cluster id we remove
                     self.cluster_layer.features.loc[self.cluster_layer.features['cluster_id'] == cluster_id, ["spot_number"]] = new_spot_number
             self._origin_remove_single()
             self.cluster_layer.events.features()
@@ -698,6 +857,7 @@ class BackgroundRemover(NapariWidget) :
                 background = self.other_image[channel]
             if not background.shape == self.signal_data_raw.shape : raise ValueError(f"Shape missmatch between signal and background : {self.signal_data_raw.shape} ; {background.shape}")
 
+            from AF_eraser import remove_autofluorescence_RANSACfit #Lazy import : only needed for background removal
             result, score = remove_autofluorescence_RANSACfit(
                 signal=self.signal_data_raw.copy(),
                 background=background,
@@ -930,42 +1090,51 @@ class DenseRegionDeconvolver(NapariWidget) :
         self.kernel_size = kernel_size
         self.voxel_size = voxel_size
         self.dim = len(voxel_size)
+        self._median_spot = None
+        self._median_spot_key = None
+        self._dense_threshold = None
+        self._reference_spot = None
+        self._reference_spot_key = None
         self.update_dense_regions()
         super().__init__()
 
-    def update_dense_regions(self) :
-        dense_regions, spot_out_regions,max_size = detection.get_dense_region(
-            image=self.image.data,
-            spots=self.spots.data,
-            voxel_size = self.voxel_size,
-            beta=self.beta,
-            spot_radius=self.spot_radius
-        )
-        del spot_out_regions,max_size
-
-        mask = np.zeros(shape=self.image.data.shape, dtype= np.int16)
-        for label, region in enumerate(dense_regions) :
-            reg_im = region.image
-            coordinates = np.argwhere(reg_im)
-
-            if self.dim == 2 :
-                y,x = coordinates.T
-                min_y,min_x,*_ = region.bbox
-                y += min_y
-                x += min_x
+    def _get_median_spot(self) -> np.ndarray :
+        """
+        Median reference spot used by bigfish to compute dense regions threshold; only recomputed when spots or spot radius change.
+        """
+        spots = np.asarray(self.spots.data, dtype=np.int64)
+        spot_radius = self.spot_radius if isinstance(self.spot_radius, (tuple, list)) or type(self.spot_radius) == type(None) else (self.spot_radius,) * self.dim
+        key = (spot_radius, spots.shape, hash(spots.tobytes()))
+        if key != self._median_spot_key :
+            self._median_spot = build_reference_spot(
+                image=self.image.data,
+                spots=spots,
+                voxel_size=self.voxel_size,
+                spot_radius=spot_radius,
+                alpha=0.5
+            )
+            self._median_spot_key = key
+        return self._median_spot
 
-                mask[y,x] = label + 1
+    def update_dense_regions(self) :
+        """
+        Same regions as bigfish get_dense_region (connected components above threshold with at least 2 pixels) labelled in one pass.
+        Labelling is reused as long as threshold doesn't change.
+        """
+        threshold = int(self._get_median_spot().max() * self.beta)
+        if threshold == self._dense_threshold : return
 
-            else :
-                z,y,x = coordinates.T
-                min_z,min_y,min_x,*_ = region.bbox
-                z += min_z
-                y += min_y
-                x += min_x
+        connected_regions = label(self.image.data > threshold)
+        region_areas = np.bincount(connected_regions.ravel())
+        region_areas[0] = 0
+        kept_regions = np.flatnonzero(region_areas >= 2)
 
-                mask[z,y,x] = label + 1
+        label_dtype = np.int16 if len(kept_regions) <= np.iinfo(np.int16).max else np.int32
+        lookup_table = np.zeros(len(region_areas), dtype=label_dtype)
+        lookup_table[kept_regions] = np.arange(1, len(kept_regions) + 1)
 
-        self.dense_regions = mask
+        self.dense_regions = lookup_table[connected_regions]
+        self._dense_threshold = threshold
 
     def _create_widget(self) :
 
@@ -1008,7 +1177,8 @@ class DenseRegionDeconvolver(NapariWidget) :
             self.kernel_size = kernel_size
 
             print("Decomposing dense regions...", end="", flush=True)
-            spots, _dense_region, _reference_spot = detection.decompose_dense(
+            reference_key = (self.spot_radius, self.kernel_size, self.alpha, self.gamma, hash(np.asarray(self.spots.data).tobytes()))
+            spots, reference_spot = decompose_dense_regions(
                 image= self.image.data, 
                 spots= self.spots.data, 
                 voxel_size=self.voxel_size, 
@@ -1016,10 +1186,11 @@ class DenseRegionDeconvolver(NapariWidget) :
                 kernel_size=self.kernel_size, 
                 alpha=self.alpha, 
                 beta=self.beta, 
-                gamma=self.gamma
+                gamma=self.gamma,
+                reference_spot= self._reference_spot if reference_key == self._reference_spot_key else None, # Only beta changed : same reference spot
             )
+            self._reference_spot, self._reference_spot_key = reference_spot, reference_key
             print("\rDecomposing dense regions : done")
-            del _dense_region, _reference_spot
 
             scale = compute_anisotropy_coef(self.voxel_size)
             spot_layer_args = {
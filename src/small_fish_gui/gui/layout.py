@@ -1,10 +1,8 @@
 import FreeSimpleGUI as sg
 import os
 import numpy as np
-import cellpose.models as models
 from typing import Optional, Union
 
-from cellpose.core import use_gpu
 from .tooltips import FLOW_THRESHOLD_TOOLTIP,CELLPROB_TOOLTIP, MIN_SIZE_TOOLTIP
 from ..hints import pipeline_parameters
 from ..utils import check_parameter
@@ -219,6 +217,7 @@ def _segmentation_layout(
         **kwargs
         ) :
     
+    from cellpose.core import use_gpu #Lazy import : cellpose loads torch
     USE_GPU = use_gpu()
     event_dict = dict()
     
@@ -299,6 +298,7 @@ def _segmentate_object_layout(
     **kwargs
     ) -> sg.Column :
 
+    import cellpose.models as models #Lazy import : cellpose loads torch
     models_list = models.get_user_models() + models.MODEL_NAMES
     if len(models_list) == 0 : models_list = ['no model found']
 
@@ -522,6 +522,7 @@ def colocalization_layout(spot_list : list, **default_values) :
 def settings_layout(default_values : SettingsDict = get_default_settings()) :
 
     if not isinstance(default_values, SettingsDict) : raise TypeError(f"Incorect type for default_values : {type(default_values)}; expected SettingsDict")
+    import cellpose.models as models #Lazy import : cellpose loads torch
     models_list = models.get_user_models() + models.MODEL_NAMES
 
     layout = [[sg.Text("Default values", font="ArialBold 20")]]
@@ -555,6 +556,10 @@ def settings_layout(default_values : SettingsDict = get_default_settings()) :
         ["Dense regions deconvolution", "Cluster computation", "show napari corrector", "Autofloresnce background removal", "interactive threshold selector"],
         preset=[default_values.do_dense_regions_deconvolution, default_values.do_cluster, default_values.show_napari_corrector, default_values.do_background_removal, default_values.interactive_threshold_selector], 
         keys=["do_dense_regions_deconvolution", "do_cluster", "show_napari_corrector","do_background_removal", "interactive_threshold_selector"])
+    detection_layout += parameters_layout(
+        ["Cell features workers"],
+        default_values=[default_values.cell_features_workers],
+        keys=["cell_features_workers"])
 
     deconvolution_layout = [[sg.Text("Dense regions deconvolution", font="ArialBold 15")]]
     deconvolution_layout += parameters_layout(
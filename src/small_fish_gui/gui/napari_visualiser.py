@@ -16,6 +16,13 @@ from ._napari_widgets import SpotDetector, DenseRegionDeconvolver, BackgroundRem
 from ._napari_widgets import NapariWidget
 from ..utils import compute_anisotropy_coef
 
+def _label_scale(label : np.ndarray, scale : tuple) -> tuple :
+    """
+    Scale of a label layer : 2D labels on 3D images are added as a single plane (trailing yx scale) which napari displays on every z slice.
+    Edits are then made on the 2D mask itself, no copy is repeated over z.
+    """
+    return tuple(scale[-label.ndim:])
+
 def correct_spots(
         image, 
         spots, 
@@ -39,21 +46,6 @@ def correct_spots(
     check_parameter(image= np.ndarray, voxel_size= (tuple,list))
     dim = len(voxel_size)
 
-    if dim == 3 and type(cell_label) != type(None) :
-        if cell_label.ndim == 2 :
-            cell_label = np.repeat(
-                cell_label[np.newaxis],
-                repeats= len(image),
-                axis=0
-            )
-    if dim == 3 and type(nucleus_label) != type(None) :
-        if nucleus_label.ndim == 2 :
-            nucleus_label = np.repeat(
-                nucleus_label[np.newaxis],
-                repeats= len(image),
-                axis=0
-            )
-
     scale = compute_anisotropy_coef(voxel_size)
     Viewer = napari.Viewer(ndisplay=2, title= 'Spot correction', axis_labels=['z','y','x'], show= False)
     Viewer.add_image(image, scale=scale, name= "rna signal", blending= 'additive', colormap='green', contrast_limits=[image.min(), image.max()])
@@ -100,12 +92,12 @@ def correct_spots(
         )
 
     if type(nucleus_label) != type(None) :
-        nucleus_label_layer = Viewer.add_labels(nucleus_label, scale=scale, opacity= 0.2, blending= 'additive')
+        nucleus_label_layer = Viewer.add_labels(nucleus_label.copy(), scale=_label_scale(nucleus_label, scale), opacity= 0.2, blending= 'additive')
         nucleus_label_layer.preserve_labels = True
         labels_layer_list = [nucleus_label_layer]
     
         if type(cell_label) != type(None) and not segment_only_nuclei : 
-            cell_label_layer = Viewer.add_labels(cell_label, scale=scale, opacity= 0.2, blending= 'additive')
+            cell_label_layer = Viewer.add_labels(cell_label.copy(), scale=_label_scale(cell_label, scale), opacity= 0.2, blending= 'additive')
             cell_label_layer.preserve_labels = True
             labels_layer_list += [cell_label_layer]
 
@@ -190,14 +182,6 @@ def correct_spots(
     else :
         new_nucleus_label = nucleus_label
 
-    if dim == 3 and type(cell_label) != type(None) :
-        if cell_label.ndim == 2 :
-            new_cell_label = new_cell_label.max(axis=0)
-    if dim == 3 and type(nucleus_label) != type(None) :
-        if nucleus_label.ndim == 2 :
-            new_nucleus_label = new_nucleus_label.max(axis=0)
-            
-
 
     return new_spots, new_clusters,  new_cluster_radius, new_min_spot_number, new_nucleus_label, new_cell_label
 
@@ -217,22 +201,8 @@ def show_segmentation(
         if cyto_image.ndim != nuc_image.ndim : raise ValueError("Cyto and Nuc dimensions missmatch.")
         if type(cyto_label) == type(None) : raise ValueError("If cyto image is passed cyto label must be passed too.")
 
-    if dim == 3 and nuc_label.ndim == 2 :
-        nuc_label = np.repeat(
-            nuc_label[np.newaxis],
-            repeats= len(nuc_image),
-            axis=0
-        )
     if type(cyto_label) != type(None) :
-        
         if type(cyto_image) == type(None) : raise ValueError("If cyto label is passed cyto image must be passed too.")
-        
-        if dim == 3 and cyto_label.ndim == 2 :
-            cyto_label = np.repeat(
-                cyto_label[np.newaxis],
-                repeats= len(nuc_image),
-                axis=0
-            )
 
     #Init Napari viewer
     Viewer = napari.Viewer(ndisplay=2, title= 'Show segmentation', axis_labels=['z','y','x'] if dim == 3 else ['y', 'x'])
@@ -241,14 +211,14 @@ def show_segmentation(
 
     # Adding nuclei
     nuc_signal_layer = Viewer.add_image(nuc_image, name= "nucleus signal", blending= 'additive', colormap='blue', contrast_limits=[nuc_image.min(), nuc_image.max()], scale=scale)
-    nuc_label_layer = Viewer.add_labels(nuc_label, opacity= 0.6, name= 'nucleus_label', scale=scale)
+    nuc_label_layer = Viewer.add_labels(nuc_label, opacity= 0.6, name= 'nucleus_label', scale=_label_scale(nuc_label, scale))
     nuc_label_layer.preserve_labels = True
     labels_layer_list = [nuc_label_layer]
     
     #Adding cytoplasm
     if (type(cyto_label) != type(None) and not np.array_equal(cyto_label, nuc_label) ) or (type(cyto_label) != type(None) and cyto_label.max() == 0): 
         Viewer.add_image(cyto_image, name= "cytoplasm signal", blending= 'additive', colormap='red', contrast_limits=[cyto_image.min(), cyto_image.max()], scale=scale)
-        cyto_label_layer = Viewer.add_labels(cyto_label, opacity= 0.6, name= 'cytoplasm_label', scale=scale)
+        cyto_label_layer = Viewer.add_labels(cyto_label, opacity= 0.6, name= 'cytoplasm_label', scale=_label_scale(cyto_label, scale))
         cyto_label_layer.preserve_labels = True
         labels_layer_list += [cyto_label_layer]
 
@@ -64,6 +64,17 @@ class pipeline_parameters(TypedDict) :
             nucleus_selected_slice : int
             other_nucleus_image_path : str
             other_nucleus_image : ndarray
+            profile_memory : bool
+            resume_batch : bool
+            use_result_cache : bool
+            do_batch_calibration : bool
+            calibration_sample_number : int
+            detection_channels : list
+            do_channels_colocalisation : bool
+            channels_coloc_distance : int
+            do_distance_tables : bool
+            dense_regions_workers : int
+            cell_features_workers : int
             reordered_shape : Tuple[int,int,int,int,int]
             do_segmentation : bool
             shape : Tuple[int,int,int,int,int]
@@ -63,6 +63,9 @@ MIN_NUMBER_SPOTS = 5
 #Coloc
 COLOC_RANGE = 400
 
+#Features computation
+CELL_FEATURES_WORKERS = 1
+
 #Spots Extraction
 DO_CSV = False
 DO_EXCEL = False
@@ -115,4 +118,5 @@ def get_default_settings() :
         "nucleus_mean_proj" : NUCLEUS_mean_proj,
         "nucleus_select_slice" : NUCLEUS_select_slice,
         "nucleus_selected_slice" : NUCLEUS_selected_slice,
+        "cell_features_workers" : CELL_FEATURES_WORKERS,
     }
\ No newline at end of file
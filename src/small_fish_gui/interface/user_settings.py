@@ -53,15 +53,27 @@ class SettingsDict(BaseModel) :
     do_excel : bool
     spot_extraction_folder : str
     voxel_size : tuple
+    cell_features_workers : int = 1
     
 
 
+#Settings are loaded and validated once, then reloaded only if settings.json modification time changes.
+_settings_cache = {'settings' : None, 'mtime' : None}
+
 def get_settings() -> SettingsDict :
+    """
+    Returns user settings from memory, settings.json is only read again if it was modified since last load.
+    Returned instance is shared between callers : do not modify it, use `write_settings` instead.
+    """
 
     setting_path = get_settings_path()
 
     if os.path.isfile(setting_path) :
-        return _load_settings()
+        mtime = os.stat(setting_path).st_mtime_ns
+        if _settings_cache['settings'] is None or _settings_cache['mtime'] != mtime :
+            _settings_cache['settings'] = _load_settings()
+            _settings_cache['mtime'] = mtime
+        return _settings_cache['settings']
     else :
         settings = _init_settings()
         write_settings(settings)
@@ -93,4 +105,7 @@ def write_settings(settings : SettingsDict) :
     else :
         settings_path = get_settings_path()
         with open(settings_path, mode="w") as f:
-             json.dump(settings.dict(), f, indent=4)
\ No newline at end of file
+             json.dump(settings.dict(), f, indent=4)
+
+        _settings_cache['settings'] = settings
+        _settings_cache['mtime'] = os.stat(settings_path).st_mtime_ns
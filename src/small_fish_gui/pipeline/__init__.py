@@ -17,5 +17,21 @@ from .detection import launch_features_computation
 from .detection import launch_cell_extraction
 from .detection import get_nucleus_signal
 from .detection import output_spot_tiffvisual
+from .detection import compute_auto_threshold
+from .detection import detect_spots
 
-from .spots import launch_spots_extraction
\ No newline at end of file
+from ._bigfish_wrapers import compute_dense_reference_spot
+
+from .spots import launch_spots_extraction
+
+from ._colocalisation import spots_colocalisation
+
+from ._spatial_index import SpotIndex
+from ._spatial_index import compute_nearest_neighbour_table
+
+from ._projection import ProjectionCache
+from ._projection import maximum_projection
+from ._projection import mean_projection
+
+from ._profiling import AcquisitionProfiler
+from ._profiling import profile_stage
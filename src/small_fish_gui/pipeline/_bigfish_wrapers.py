@@ -2,9 +2,15 @@
 Wrappers from BigFish code.
 """
 
+import os, warnings
 import numpy as np
 import bigfish.stack as stack
 import bigfish.detection as detection
+from scipy.spatial import cKDTree
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from bigfish.detection.utils import (
     get_object_radius_pixel, 
     get_spot_volume, 
@@ -268,4 +274,312 @@ def _local_maxima_mask(
             ndim=ndim)
     mask_local_max = detection.local_maximum_detection(image_filtered, minimum_distance)
     
-    return mask_local_max.astype(bool)
\ No newline at end of file
+    return mask_local_max.astype(bool)
+
+def diff_spots(old_spots : np.ndarray, new_spots : np.ndarray) -> tuple[np.ndarray, np.ndarray] :
+    """
+    Compare two spots coordinates arrays.
+
+    RETURNS
+    -------
+        added : bool mask on `new_spots`, True for spots absent from `old_spots`.
+        removed : bool mask on `old_spots`, True for spots absent from `new_spots`.
+    """
+    old_spots = np.asarray(old_spots)
+    new_spots = np.asarray(new_spots)
+    if len(old_spots) == 0 or len(new_spots) == 0 :
+        return np.ones(len(new_spots), dtype=bool), np.ones(len(old_spots), dtype=bool)
+
+    _, keys = np.unique(np.concatenate([old_spots, new_spots]), axis=0, return_inverse=True)
+    keys = keys.reshape(-1)
+    old_keys, new_keys = keys[:len(old_spots)], keys[len(old_spots):]
+    added = ~np.isin(new_keys, old_keys)
+    removed = ~np.isin(old_keys, new_keys)
+
+    return added, removed
+
+def cluster_spots_locally(
+        spots : np.ndarray,
+        spots_cluster_id : np.ndarray,
+        changed_spots : np.ndarray,
+        voxel_size : tuple,
+        radius : int,
+        nb_min_spots : int,
+        new_spots_mask : np.ndarray = None,
+        next_cluster_id : int = None,
+) -> tuple[np.ndarray, np.ndarray] :
+    """
+    Incremental version of bigfish `detect_clusters` (DBSCAN) : clustering is only recomputed around spots added or removed since previous clustering.
+    Re-clustered region is made of spots within `radius` of spots whose core status may have changed, plus every spot of clusters they touch. 
+    Core status is computed on full neighbourhoods so results match DBSCAN up to border spots ordering; cluster ids are kept when a new cluster overlaps an old one.
+
+    PARAMETERS
+    ----------
+        spots : np.ndarray
+            Current spots coordinates (pixel), shape (nb_spots, dim).
+        spots_cluster_id : np.ndarray
+            Cluster id of spots from previous clustering (-1 for free spots). Values of new spots are ignored.
+        changed_spots : np.ndarray
+            Coordinates (pixel) of spots added and removed since previous clustering.
+        voxel_size : tuple
+        radius : int
+            nm
+        nb_min_spots : int
+        new_spots_mask : np.ndarray
+            bool, True for spots added since previous clustering.
+        next_cluster_id : int
+            First id given to new clusters, defaults to max(spots_cluster_id) + 1.
+
+    RETURNS
+    -------
+        cluster_id : np.ndarray
+            New cluster id of every spot.
+        reclustered_idx : np.ndarray
+            Indices of spots whose cluster was recomputed.
+    """
+    voxel_size = np.asarray(voxel_size, dtype=float)
+    if type(new_spots_mask) == type(None) : new_spots_mask = np.zeros(len(spots), dtype=bool)
+    cluster_id = np.where(new_spots_mask, -1, np.asarray(spots_cluster_id, dtype=int))
+    no_change = np.empty(shape=(0,), dtype=int)
+    if len(spots) == 0 or len(changed_spots) == 0 : return cluster_id, no_change
+    if type(next_cluster_id) == type(None) : next_cluster_id = max(int(cluster_id.max()), -1) + 1
+
+    spots_nm = np.asarray(spots, dtype=float) * voxel_size
+    tree = cKDTree(spots_nm)
+
+    #Spots whose core status may have changed
+    seeds = tree.query_ball_point(np.asarray(changed_spots, dtype=float) * voxel_size, r=radius)
+    seeds = np.union1d(np.concatenate(seeds).astype(int), np.flatnonzero(new_spots_mask))
+    if len(seeds) == 0 : return cluster_id, no_change
+
+    #Spots whose cluster may change : neighbours of seeds and all spots of clusters they touch
+    neighbours = np.unique(np.concatenate(tree.query_ball_point(spots_nm[seeds], r=radius)).astype(int))
+    touched_clusters = np.unique(cluster_id[neighbours])
+    touched_clusters = touched_clusters[touched_clusters != -1]
+    region = np.union1d(neighbours, np.flatnonzero(np.isin(cluster_id, touched_clusters)))
+
+    #Core spots (neighbourhood includes the spot itself, as in DBSCAN)
+    is_core = tree.query_ball_point(spots_nm[region], r=radius, return_length=True) >= nb_min_spots
+    core_idx = region[is_core]
+
+    #Clusters are connected components of core spots
+    if len(core_idx) > 0 :
+        pairs = cKDTree(spots_nm[core_idx]).query_pairs(r=radius, output_type='ndarray')
+        graph = coo_matrix((np.ones(len(pairs), dtype=bool), (pairs[:,0], pairs[:,1])), shape=(len(core_idx), len(core_idx)))
+        component_number, components = connected_components(graph, directed=False)
+    else :
+        component_number, components = 0, np.empty(shape=(0,), dtype=int)
+
+    #Keeping previous ids : biggest components pick first the old id most of their spots had
+    old_cluster_id = cluster_id.copy()
+    component_sizes = np.bincount(components, minlength=component_number)
+    component_ids = np.full(component_number, -1, dtype=int)
+    used_ids = set()
+    for component in np.argsort(-component_sizes, kind='stable') :
+        members_old_id = old_cluster_id[core_idx[components == component]]
+        members_old_id = members_old_id[members_old_id != -1]
+        candidates, counts = np.unique(members_old_id, return_counts=True)
+        for candidate in candidates[np.argsort(-counts, kind='stable')] :
+            if candidate not in used_ids :
+                component_ids[component] = candidate
+                break
+        else :
+            component_ids[component] = next_cluster_id
+            next_cluster_id += 1
+        used_ids.add(component_ids[component])
+
+    cluster_id[region] = -1
+    cluster_id[core_idx] = component_ids[components]
+
+    #Border spots join the cluster of a core neighbour
+    border_idx = region[~is_core]
+    core_mask = np.zeros(len(spots), dtype=bool)
+    core_mask[core_idx] = True
+    border_neighbours = tree.query_ball_point(spots_nm[border_idx], r=radius)
+    outside_neighbours = np.setdiff1d(np.concatenate([np.empty(0)] + list(border_neighbours)).astype(int), region)
+    if len(outside_neighbours) > 0 :
+        core_mask[outside_neighbours] = tree.query_ball_point(spots_nm[outside_neighbours], r=radius, return_length=True) >= nb_min_spots
+    for border, spot_neighbours in zip(border_idx, border_neighbours) :
+        core_neighbours = [neighbour for neighbour in sorted(spot_neighbours) if core_mask[neighbour] and cluster_id[neighbour] != -1]
+        if len(core_neighbours) > 0 : cluster_id[border] = cluster_id[core_neighbours[0]]
+
+    return cluster_id, region
+
+def _decompose_regions_chunk(
+        image : np.ndarray,
+        regions : np.ndarray,
+        voxel_size : tuple,
+        sigma : tuple,
+        amplitude : float,
+        background : float,
+        precomputed_gaussian : tuple,
+) -> np.ndarray :
+    spots_in_regions, _ = detection.simulate_gaussian_mixture(
+        image=image,
+        candidate_regions=regions,
+        voxel_size=voxel_size,
+        sigma=sigma,
+        amplitude=amplitude,
+        background=background,
+        precomputed_gaussian=precomputed_gaussian
+    )
+    return spots_in_regions[:,:image.ndim]
+
+def _denoise_for_decomposition(
+        image : np.ndarray,
+        voxel_size : tuple,
+        spot_radius : tuple,
+        kernel_size : tuple,
+        gamma : float,
+) -> np.ndarray :
+    """
+    Gaussian background removal applied by bigfish before dense regions decomposition.
+    """
+    ndim = image.ndim
+    if type(kernel_size) == type(None) and gamma > 0 :
+        spot_radius_px = get_object_radius_pixel(
+            voxel_size_nm=voxel_size,
+            object_radius_nm=spot_radius,
+            ndim=ndim
+        )
+        kernel_size = tuple([radius * gamma for radius in spot_radius_px])
+    if type(kernel_size) != type(None) :
+        return stack.remove_background_gaussian(image=image, sigma=kernel_size)
+    else :
+        return image.copy()
+
+def compute_dense_reference_spot(
+        image : np.ndarray,
+        spots : np.ndarray,
+        voxel_size : tuple,
+        spot_radius : tuple,
+        kernel_size : tuple = None,
+        alpha : float = 0.5,
+        gamma : float = 5,
+) -> np.ndarray :
+    """
+    Reference spot computed by bigfish `decompose_dense` : `alpha` quantile of spots on the denoised image.
+    """
+    ndim = image.ndim
+    if not isinstance(voxel_size, (tuple, list)) : voxel_size = (voxel_size,) * ndim
+    if not isinstance(spot_radius, (tuple, list)) : spot_radius = (spot_radius,) * ndim
+    if type(kernel_size) != type(None) and not isinstance(kernel_size, (tuple, list)) : kernel_size = (kernel_size,) * ndim
+
+    image_denoised = _denoise_for_decomposition(image, voxel_size, spot_radius, kernel_size, gamma)
+    return detection.build_reference_spot(
+        image=image_denoised,
+        spots=spots,
+        voxel_size=voxel_size,
+        spot_radius=spot_radius,
+        alpha=alpha
+    )
+
+def decompose_dense_regions(
+        image : np.ndarray,
+        spots : np.ndarray,
+        voxel_size : tuple,
+        spot_radius : tuple,
+        kernel_size : tuple = None,
+        alpha : float = 0.5,
+        beta : float = 1,
+        gamma : float = 5,
+        reference_spot : np.ndarray = None,
+        max_workers : int = None,
+) -> tuple[np.ndarray, np.ndarray] :
+    """
+    Same decomposition as bigfish `decompose_dense` but dense regions are decomposed independently in a thread pool.
+    Regions are split in ordered chunks and spots are concatenated back in region order, so result doesn't depend on `max_workers`.
+
+    PARAMETERS
+    ----------
+        reference_spot : np.ndarray
+            If given, this reference spot is used instead of computing one from `image` (for instance one computed on other FOVs of a batch).
+        max_workers : int
+            Threads used for regions decomposition, defaults to cpu number.
+
+    RETURNS
+    -------
+        spots : np.ndarray
+            Spots outside dense regions followed by spots decomposed from dense regions.
+        reference_spot : np.ndarray
+    """
+
+    ndim = image.ndim
+    dtype = spots.dtype
+    if not isinstance(voxel_size, (tuple, list)) : voxel_size = (voxel_size,) * ndim
+    if not isinstance(spot_radius, (tuple, list)) : spot_radius = (spot_radius,) * ndim
+    if type(kernel_size) != type(None) and not isinstance(kernel_size, (tuple, list)) : kernel_size = (kernel_size,) * ndim
+
+    if len(spots) == 0 :
+        return spots, np.zeros((5,) * ndim, dtype=image.dtype) if type(reference_spot) == type(None) else reference_spot
+
+    image_denoised = _denoise_for_decomposition(image, voxel_size, spot_radius, kernel_size, gamma)
+
+    #Reference spot
+    if type(reference_spot) == type(None) :
+        reference_spot = detection.build_reference_spot(
+            image=image_denoised,
+            spots=spots,
+            voxel_size=voxel_size,
+            spot_radius=spot_radius,
+            alpha=alpha
+        )
+    if reference_spot.sum() == 0 :
+        return spots, reference_spot
+
+    parameters_fitted = detection.modelize_spot(
+        reference_spot=reference_spot,
+        voxel_size=voxel_size,
+        spot_radius=spot_radius
+    )
+    if ndim == 3 :
+        sigma_z, sigma_yx, amplitude, background = parameters_fitted
+        sigma = (sigma_z, sigma_yx, sigma_yx)
+    else :
+        sigma_yx, amplitude, background = parameters_fitted
+        sigma = (sigma_yx, sigma_yx)
+
+    #Dense regions
+    regions_to_decompose, spots_out_regions, region_size = detection.get_dense_region(
+        image=image_denoised,
+        spots=spots,
+        voxel_size=voxel_size,
+        spot_radius=spot_radius,
+        beta=beta
+    )
+    if regions_to_decompose.size == 0 :
+        return spots, reference_spot
+
+    precomputed_gaussian = detection.precompute_erf(
+        ndim=ndim,
+        voxel_size=voxel_size,
+        sigma=sigma,
+        max_grid=region_size + 1
+    )
+
+    #Decomposition
+    if type(max_workers) == type(None) : max_workers = os.cpu_count() or 1
+    chunk_number = min(len(regions_to_decompose), max_workers * 4)
+    chunks = np.array_split(regions_to_decompose, chunk_number)
+    decompose_chunk = partial(
+        _decompose_regions_chunk,
+        image_denoised,
+        voxel_size=voxel_size,
+        sigma=sigma,
+        amplitude=amplitude,
+        background=background,
+        precomputed_gaussian=precomputed_gaussian,
+    )
+    if max_workers > 1 and chunk_number > 1 :
+        with ThreadPoolExecutor(max_workers=max_workers) as executor :
+            spots_in_regions = list(executor.map(decompose_chunk, chunks))
+    else :
+        spots_in_regions = [decompose_chunk(chunk) for chunk in chunks]
+    spots_in_regions = np.concatenate(spots_in_regions, axis=0).astype(dtype)
+
+    if len(spots_out_regions) + len(spots_in_regions) < len(spots) :
+        warnings.warn("Problem occurs during the decomposition of dense regions. Less spots are detected after the decomposition than before.", UserWarning)
+
+    spots = np.concatenate((spots_out_regions, spots_in_regions), axis=0)
+
+    return spots, reference_spot
@@ -7,7 +7,7 @@ import numpy as np
 import pandas as pd
 import FreeSimpleGUI as sg
 from scipy.ndimage import distance_transform_edt
-from scipy.signal import fftconvolve
+from scipy.spatial import cKDTree
 
 def reconstruct_boolean_signal(image_shape, spot_list: list):
     signal = np.zeros(image_shape, dtype= bool)
@@ -32,51 +32,11 @@ def nanometer_to_pixel(value, scale) :
 
     return list(np.array(value) / np.array(scale))
 
-def _create_counting_kernel(radius_nm, voxel_size) :
-
-    max_pixel_distance = int(max(nanometer_to_pixel(radius_nm, voxel_size)))
-    kernel = np.ones(shape=[2*max_pixel_distance+1 for i in range(len(voxel_size))]) #always odd number so middle is always at [pixel_radius-1, pixel_radius-1, pixel_radius-1]
-    if len(voxel_size) == 3 :
-        kernel[max_pixel_distance, max_pixel_distance, max_pixel_distance] = 0
-    else :
-        kernel[max_pixel_distance, max_pixel_distance] = 0
-
-    kernel = distance_transform_edt(kernel, sampling= voxel_size) <= radius_nm
-    
-    return kernel.astype(int)
-
-def _spot_count_map(spots_array, radius_px, voxel_size) :
-    """
-    Create a map where each pixel value correspond to the number of spots closer than radius to the position.
-    """
-
-    kernel = _create_counting_kernel(radius_px, voxel_size)
-    _map = fftconvolve(spots_array, kernel, mode= 'same')
-
-    return np.round(_map).astype(int)
-
-def _reconstruct_spot_signal(image_shape, spot_list: list, dim=3):
-    """
-    Create a map where each pixel value correspond to the number of spots located in this position.
-    """
-    signal = np.zeros(image_shape, dtype= int)
-    unique_list, counts = np.unique(spot_list, return_counts= True, axis=0)
-    if dim == 3 :
-        Z, Y, X = list(zip(*unique_list))
-        signal[Z,Y,X] = counts
-    elif dim == 2 :
-        Y, X = list(zip(*unique_list))
-        signal[Y,X] = counts
-    else : 
-        raise ValueError("Wrong dim passed should be 2 or 3, it is {0}".format(dim))
-
-    return signal
-
-def spots_multicolocalisation(spots_list, anchor_list, radius_nm, image_shape, voxel_size) :
+def spots_multicolocalisation(spots_list, anchor_list, radius_nm, voxel_size) :
 
     """
     Compute the number of spots from spots_list closer than radius to a spot from anchor_list. Each spots_list spots will be counted as many times as there are anchors close enough.
-    Note that the radius in nm is converted to pixel using voxel size, and rounded to the closest int value.
+    Distances are computed in nanometers (coordinates scaled by voxel size) with a radius query on a KD-tree of anchors : cost only depends on the number of spots, not on image size.
     
     Example in 2D
     --------
@@ -93,7 +53,6 @@ def spots_multicolocalisation(spots_list, anchor_list, radius_nm, image_shape, v
     spots_list : list
     anchor_list : list
     radius_nm : int, float
-    image_shape : tuple (Z, Y, X)
     voxel_size : tuple (Z, Y, X)
     
     Returns
@@ -103,22 +62,11 @@ def spots_multicolocalisation(spots_list, anchor_list, radius_nm, image_shape, v
     if len(spots_list) == 0 or len(anchor_list) == 0 : return 0
     if len(voxel_size) != len(spots_list[0]) : raise ValueError("Dimensions missmatched; voxel_size : {0} spots : {1}".format(len(voxel_size), len(spots_list[0])))
 
-    dim = len(voxel_size)
+    anchors = np.array([anchor for anchor in anchor_list], dtype=float) * voxel_size
+    spots = np.array([spot for spot in spots_list], dtype=float) * voxel_size
+    res = cKDTree(anchors).query_ball_point(spots, r=radius_nm, return_length=True)
 
-    anchor_array = _reconstruct_spot_signal(image_shape=image_shape, spot_list=anchor_list, dim=dim)
-    count_map = _spot_count_map(anchor_array, radius_px=radius_nm, voxel_size=voxel_size)
-
-    if dim == 3 :
-        Z,Y,X = list(zip(*spots_list))
-        res = list(count_map[Z,Y,X])
-
-    elif dim == 2 :
-        Y,X = list(zip(*spots_list))
-        res = list(count_map[Y,X])
-    else :
-        raise AssertionError(f"Unforseen dimension {dim}")
-
-    return res
+    return list(res)
 
 def spots_colocalisation(
         spot_list1:np.ndarray, 
@@ -155,8 +103,6 @@ def spots_colocalisation(
     shape1 = np.max(spot_list1,axis=0)
     shape2 = np.max(spot_list2,axis=0)
 
-    Z,Y,X = list(zip(*spot_list2))
-
     image_shape = np.max([shape1, shape2],axis=0) + 1
 
     signal2 = reconstruct_boolean_signal(image_shape, spot_list2)
@@ -0,0 +1,129 @@
+"""
+Detection pipeline expressed as a chain of memoized stages for interactive sessions : when user retries detection, only stages whose inputs changed are re-executed.
+"""
+
+import bigfish.detection as detection
+
+from ..hints import pipeline_parameters
+from ._preprocess import prepare_image_detection
+from ._bigfish_wrapers import _apply_log_filter, _local_maxima_mask
+from ._profiling import profile_stage
+from .detection import compute_auto_threshold, launch_dense_region_deconvolution, launch_clustering
+
+class DetectionGraph :
+    """
+    reorder -> log_filter -> local_maxima -> threshold -> spots -> decompose -> cluster
+
+    Each stage keeps its last output along with the key of its inputs : the parameters it reads and the keys of its upstream stages.
+    A stage is re-executed only when its key changes, so changing cluster radius only re-clusters and changing threshold doesn't recompute LoG filter or local maxima.
+    'spots' is keyed on the threshold value rather than on threshold stage key : entering the value of the auto threshold doesn't re-detect spots.
+    """
+
+    #stage : (upstream stages, parameters read by stage)
+    STAGES = {
+        'reorder' : ((), ('is_multichannel', 'channel_to_compute')),
+        'log_filter' : (('reorder',), ('voxel_size', 'spot_size', 'log_kernel_size')),
+        'local_maxima' : (('log_filter',), ('voxel_size', 'spot_size', 'minimum_distance')),
+        'threshold' : (('reorder',), ('voxel_size', 'spot_size', 'log_kernel_size', 'minimum_distance', 'threshold', 'threshold_penalty')),
+        'spots' : (('log_filter', 'local_maxima'), ()), # + threshold value
+        'decompose' : (('reorder', 'spots'), ('do_dense_regions_deconvolution', 'voxel_size', 'spot_size', 'alpha', 'beta', 'gamma', 'deconvolution_kernel')),
+        'cluster' : (('decompose',), ('do_cluster_computation', 'voxel_size', 'cluster_size', 'min_number_of_spots')),
+    }
+
+    def __init__(self) :
+        self._memo = {} # stage : (key, output)
+
+    def _run_stage(self, stage : str, parameters : pipeline_parameters, compute, extra_key = ()) :
+        upstream_stages, parameter_keys = self.STAGES[stage]
+        key = (
+            tuple(self._memo[upstream_stage][0] for upstream_stage in upstream_stages),
+            tuple(repr(parameters.get(parameter_key)) for parameter_key in parameter_keys),
+            extra_key,
+        )
+        memo = self._memo.get(stage)
+        if type(memo) == type(None) or memo[0] != key :
+            with profile_stage(stage) :
+                output = compute()
+            self._memo[stage] = (key, output)
+        return self._memo[stage][1]
+
+    def reorder(self, parameters : pipeline_parameters, map_ : dict) :
+        """
+        Returns image, other_image as `prepare_image_detection`.
+        """
+        image = parameters['image']
+        # Image identity is part of the key; array is kept alive in memo so its id can't be reused.
+        image_key = (id(image), image.shape, tuple(sorted(map_.items())))
+        return self._run_stage('reorder', parameters, lambda : prepare_image_detection(map_, parameters), extra_key= image_key)
+
+    def run(self, parameters : pipeline_parameters, map_ : dict) -> dict :
+        """
+        Runs (or reuses) every stage.
+
+        RETURNS
+        -------
+            result : dict
+                keys : 'image', 'other_image', 'threshold', 'spots' (after dense regions deconvolution), 'clusters' (tuple (clusters, spots_cluster_id) or None if clustering is disabled).
+        """
+        image, other_image = self.reorder(parameters, map_)
+
+        filtered_image = self._run_stage('log_filter', parameters, lambda : _apply_log_filter(
+            image=image,
+            voxel_size=parameters['voxel_size'],
+            spot_radius=parameters.get('spot_size'),
+            log_kernel_size=parameters.get('log_kernel_size'),
+        ))
+
+        local_maxima = self._run_stage('local_maxima', parameters, lambda : _local_maxima_mask(
+            image_filtered=filtered_image,
+            voxel_size=parameters['voxel_size'],
+            spot_radius=parameters.get('spot_size'),
+            minimum_distance=parameters.get('minimum_distance'),
+        ))
+
+        threshold = self._run_stage('threshold', parameters, lambda : self._compute_threshold(image, parameters))
+
+        spots = self._run_stage('spots', parameters, lambda : detection.spots_thresholding(
+            image=filtered_image,
+            mask_local_max=local_maxima,
+            threshold=threshold
+        )[0], extra_key= (threshold,))
+
+        if parameters['do_dense_regions_deconvolution'] :
+            spots = self._run_stage('decompose', parameters, lambda : launch_dense_region_deconvolution(image, spots, parameters))
+        else :
+            spots = self._run_stage('decompose', parameters, lambda : spots)
+
+        if parameters['do_cluster_computation'] :
+            clusters = self._run_stage('cluster', parameters, lambda : self._compute_clusters(spots, parameters))
+        else :
+            clusters = None
+
+        return { # Copies : memoized outputs must not be modified by later steps (some wrappers clip spots in place).
+            'image' : image,
+            'other_image' : other_image,
+            'threshold' : threshold,
+            'spots' : spots.copy(),
+            'clusters' : None if clusters is None else (clusters[0].copy(), clusters[1].copy()),
+        }
+
+    @staticmethod
+    def _compute_threshold(image, parameters : pipeline_parameters) :
+        threshold = parameters.get('threshold')
+        if type(threshold) != type(None) : return threshold
+
+        threshold_penalty = parameters.get('threshold_penalty')
+        if type(threshold_penalty) == type(None) : threshold_penalty = 1
+        threshold = threshold_penalty * compute_auto_threshold(
+            image,
+            voxel_size=parameters['voxel_size'],
+            spot_radius=parameters.get('spot_size'),
+            log_kernel_size=parameters.get('log_kernel_size'),
+            minimum_distance=parameters.get('minimum_distance')
+            )
+        return max(threshold, 1)
+
+    @staticmethod
+    def _compute_clusters(spots, parameters : pipeline_parameters) :
+        clusters, clustered_spots = launch_clustering(spots, parameters)
+        return clusters, clustered_spots[:,-1]
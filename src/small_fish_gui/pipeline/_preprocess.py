@@ -25,19 +25,62 @@ class MappingError(ValueError) :
     def get_map(self) :
         return self.map_
 
+class ChannelStack :
+    """
+    Access to the channels of a reordered stack (channel first) excluding some channels, without copying data.
+    Indexing behaves like `np.delete(stack, excluded_channels, axis=0)` but returns views on the original stack.
+    """
+
+    def __init__(self, stack : np.ndarray, excluded_channels = ()) :
+        self.stack = stack
+        excluded_channels = [int(channel) for channel in excluded_channels]
+        self.channels = [channel for channel in range(len(stack)) if channel not in excluded_channels]
+
+    def __len__(self) :
+        return len(self.channels)
+
+    def __getitem__(self, index : int) -> np.ndarray :
+        return self.stack[self.channels[index]]
+
+    def __iter__(self) :
+        for channel in self.channels :
+            yield self.stack[channel]
+
+    def __array__(self, dtype=None, copy=None) :
+        #Only called if a consumer needs a real array : this copies data.
+        return np.asarray(self.stack[self.channels], dtype=dtype)
+
+    @property
+    def shape(self) -> tuple :
+        return (len(self.channels),) + self.stack.shape[1:]
+
+    @property
+    def ndim(self) -> int :
+        return self.stack.ndim
+
+    @property
+    def dtype(self) :
+        return self.stack.dtype
+
+    def get_channel(self, channel : int) -> np.ndarray :
+        """
+        Returns view on channel using its index in the original stack (excluded channels included).
+        """
+        return self.stack[int(channel)]
+
 def prepare_image_detection(map_, user_parameters) :
     """
     Return monochannel image for ready for spot detection; 
     if image is already monochannel, nothing happens.
     else : image is the image on which detection is performed, other_image are the other layer to show in Napari Viewer.
+    Both are views on user_parameters['image'] : other_image is a ChannelStack, no data is copied.
     """
     image = reorder_image_stack(map_, user_parameters['image'])
     assert len(image.shape) != 5 , "Time stack not supported, should never be True"
     
     if user_parameters['is_multichannel'] :
         channel_to_compute = int(user_parameters['channel_to_compute'])
-        other_image = image.copy()
-        other_image = np.delete(other_image, channel_to_compute, axis=0)
+        other_image = ChannelStack(image, excluded_channels=[channel_to_compute])
         image: np.ndarray = image[channel_to_compute]
 
     else :
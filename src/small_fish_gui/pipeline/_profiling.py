@@ -0,0 +1,154 @@
+"""
+Submodule providing lightweight per-stage timing and memory instrumentation.
+
+Pipeline functions call `profile_stage` unconditionally : stages are only recorded when an `AcquisitionProfiler` is active in the current thread, otherwise it does nothing.
+"""
+
+import sys, time, threading, tracemalloc
+import pandas as pd
+from contextlib import contextmanager, nullcontext
+
+try :
+    import resource
+except ImportError : #Not available on Windows
+    resource = None
+
+_local = threading.local()
+
+def _get_active_profilers() -> list :
+    if not hasattr(_local, 'profilers') : _local.profilers = []
+    return _local.profilers
+
+def get_active_profiler() :
+    """
+    Returns the innermost profiler active in current thread, None if no profiler is active.
+    """
+    profilers = _get_active_profilers()
+    return profilers[-1] if len(profilers) > 0 else None
+
+def get_peak_rss() :
+    """
+    Peak resident set size of the process (MB). None if not available on this platform.
+    """
+    if resource is None : return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin' : peak /= 1024 #bytes on macOS, kilobytes on Linux
+    return round(peak / 1024, 2)
+
+def profile_stage(stage_name : str) :
+    """
+    Context manager recording `stage_name` in the active profiler, does nothing if no profiler is active.
+    """
+    profiler = get_active_profiler()
+    if profiler is None : return nullcontext()
+    return profiler.stage(stage_name)
+
+class AcquisitionProfiler :
+    """
+    Records wall time, peak RSS and (optionally) tracemalloc peak of each stage run for one acquisition.
+    Use as a context manager to activate it in current thread, stages are then recorded with `profile_stage`.
+    Records are shared between threads, each thread keeps its own stack of open stages (see `activate_in_thread` for worker threads).
+
+    PARAMETERS
+    ----------
+        acquisition_id : int
+        filename : str
+        trace_memory : bool
+            If True python allocations are traced with tracemalloc to get per stage memory peak. This slows down the pipeline.
+    """
+
+    def __init__(self, acquisition_id = None, filename = None, trace_memory = False) :
+        self.acquisition_id = acquisition_id
+        self.filename = filename
+        self.trace_memory = trace_memory
+        self.records = []
+        self._local = threading.local() # per thread stack of open stages : [name, tracemalloc peak of already closed children]
+        self._lock = threading.Lock()
+        self._stage_count = 0
+        self._started_tracemalloc = False
+
+    @property
+    def _stage_stack(self) -> list :
+        if not hasattr(self._local, 'stage_stack') : self._local.stage_stack = []
+        return self._local.stage_stack
+
+    def __enter__(self) :
+        if self.trace_memory and not tracemalloc.is_tracing() :
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        _get_active_profilers().append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) :
+        _get_active_profilers().remove(self)
+        if self._started_tracemalloc :
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        return False
+
+    @contextmanager
+    def activate_in_thread(self, parent_stage : str = None) :
+        """
+        Activates profiler in a worker thread, stages run there are recorded as children of `parent_stage` (stage left open by the thread that submitted the work).
+        """
+        if parent_stage is not None : self._stage_stack.append([parent_stage, 0])
+        try :
+            with self :
+                yield self
+        finally :
+            if parent_stage is not None : self._stage_stack.pop()
+
+    def _get_traced_peak(self) :
+        if not (self.trace_memory and tracemalloc.is_tracing()) : return None
+        return tracemalloc.get_traced_memory()[1]
+
+    @contextmanager
+    def stage(self, stage_name : str) :
+        """
+        Times the enclosed block. Stages can be nested, parent stage is kept in the records.
+        """
+        parent = self._stage_stack[-1][0] if len(self._stage_stack) > 0 else None
+        with self._lock :
+            order = self._stage_count
+            self._stage_count += 1
+
+        #Parent peak is saved before resetting so nested stages don't hide it.
+        if len(self._stage_stack) > 0 :
+            parent_peak = self._get_traced_peak()
+            if parent_peak is not None : self._stage_stack[-1][1] = max(self._stage_stack[-1][1], parent_peak)
+        if self._get_traced_peak() is not None : tracemalloc.reset_peak()
+
+        self._stage_stack.append([stage_name, 0])
+        start = time.perf_counter()
+        try :
+            yield self
+        finally :
+            duration = time.perf_counter() - start
+            _, children_peak = self._stage_stack.pop()
+            traced_peak = self._get_traced_peak()
+            if traced_peak is not None :
+                traced_peak = max(traced_peak, children_peak)
+                if len(self._stage_stack) > 0 : self._stage_stack[-1][1] = max(self._stage_stack[-1][1], traced_peak)
+                tracemalloc.reset_peak()
+                traced_peak = round(traced_peak / 1024**2, 2)
+
+            record = {
+                'acquisition_id' : self.acquisition_id,
+                'filename' : self.filename,
+                'order' : order,
+                'stage' : stage_name,
+                'parent_stage' : parent,
+                'duration_s' : round(duration, 4),
+                'peak_rss_mb' : get_peak_rss(),
+                'tracemalloc_peak_mb' : traced_peak,
+            }
+            with self._lock :
+                self.records.append(record)
+
+    def to_dataframe(self) -> pd.DataFrame :
+        """
+        Returns records as a DataFrame (one line per stage) sorted by stage starting order.
+        """
+        columns = ['acquisition_id', 'filename', 'order', 'stage', 'parent_stage', 'duration_s', 'peak_rss_mb', 'tracemalloc_peak_mb']
+        timings = pd.DataFrame(self.records, columns=columns)
+        return timings.sort_values('order').reset_index(drop=True)
@@ -0,0 +1,54 @@
+"""
+Per acquisition cache of projections : the same 3D images and labels are projected by segmentation, segmentation visuals, spot visuals and features computation.
+"""
+
+import threading
+import numpy as np
+
+PROJECTIONS = {
+    'max' : np.max,
+    'mean' : np.mean,
+}
+
+class ProjectionCache :
+    """
+    Projections keyed by array identity and axis, each projection is computed once and handed out as a read-only view.
+
+    Identity is (memory address, shape, strides, dtype) so that different view objects of the same data (e.g. `image[channel]` taken twice) share their projection.
+    Source arrays are kept referenced so their memory can't be reused while cached; they must not be modified while the cache is in use.
+    Create one cache per acquisition.
+    """
+
+    def __init__(self) :
+        self._projections = {} # key : (source array, projection)
+        self._lock = threading.Lock()
+
+    def project(self, array : np.ndarray, axis = 0, method = 'max') -> np.ndarray :
+        key = (array.__array_interface__['data'][0], array.shape, array.strides, array.dtype.str, axis, method)
+        with self._lock :
+            entry = self._projections.get(key)
+            if type(entry) == type(None) :
+                projection = PROJECTIONS[method](array, axis=axis)
+                projection.flags.writeable = False
+                entry = (array, projection)
+                self._projections[key] = entry
+
+        return entry[1].view()
+
+    def clear(self) :
+        with self._lock :
+            self._projections = {}
+
+def maximum_projection(array : np.ndarray, projection_cache : ProjectionCache = None) -> np.ndarray :
+    """
+    Maximum projection along first axis, from `projection_cache` if given (read-only).
+    """
+    if type(projection_cache) == type(None) : return np.max(array, axis=0)
+    return projection_cache.project(array, axis=0, method='max')
+
+def mean_projection(array : np.ndarray, projection_cache : ProjectionCache = None) -> np.ndarray :
+    """
+    Mean projection along first axis, from `projection_cache` if given (read-only).
+    """
+    if type(projection_cache) == type(None) : return np.mean(array, axis=0)
+    return projection_cache.project(array, axis=0, method='mean')
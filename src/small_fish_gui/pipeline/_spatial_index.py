@@ -0,0 +1,111 @@
+"""
+Spatial index of spots for distance queries in nanometers.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+class SpotIndex :
+    """
+    KD-tree over spots (or cluster centroids) coordinates scaled to nanometers with voxel_size. Tree is built on first query.
+
+    PARAMETERS
+    ----------
+        spots : np.ndarray
+            (spot_number, dim) pixel coordinates.
+        voxel_size : tuple
+            (z,y,x) or (y,x) in nanometers.
+    """
+
+    def __init__(self, spots : np.ndarray, voxel_size : tuple) :
+        dim = len(voxel_size)
+        self.coordinates_nm = np.asarray(spots, dtype=float).reshape(-1, dim) * np.asarray(voxel_size, dtype=float)
+        self._tree = None
+
+    def __len__(self) :
+        return len(self.coordinates_nm)
+
+    @property
+    def tree(self) -> cKDTree :
+        if type(self._tree) == type(None) : self._tree = cKDTree(self.coordinates_nm)
+        return self._tree
+
+    def nearest(self, query : 'SpotIndex', exclude_self = False) :
+        """
+        For each point of `query`, distance (nm) and index of nearest point of this index.
+        If `exclude_self` query is this index and each point is not matched with itself.
+        Distance is nan and index -1 when no point can be matched.
+
+        RETURNS
+        -------
+            distances : np.ndarray (float32)
+            indices : np.ndarray (int32)
+        """
+        distances = np.full(len(query), np.nan, dtype=np.float32)
+        indices = np.full(len(query), -1, dtype=np.int32)
+        if len(query) == 0 or len(self) < (2 if exclude_self else 1) : return distances, indices
+
+        if exclude_self :
+            # Point itself is not always first neighbour : spots sharing coordinates are returned in any order.
+            nearest_distances, nearest_indices = self.tree.query(query.coordinates_nm, k=3)
+            is_other = nearest_indices != np.arange(len(query))[:,np.newaxis]
+            first_other = np.argmax(is_other, axis=1)
+            rows = np.arange(len(query))
+            nearest_distances, nearest_indices = nearest_distances[rows, first_other], nearest_indices[rows, first_other]
+        else :
+            nearest_distances, nearest_indices = self.tree.query(query.coordinates_nm, k=1)
+
+        distances[:] = nearest_distances
+        indices[:] = nearest_indices
+        return distances, indices
+
+def compute_nearest_neighbour_table(
+        channels : dict,
+        voxel_size : tuple,
+) -> pd.DataFrame :
+    """
+    Nearest neighbour distances between every spot / cluster centroid and each population of the field of view :
+    spot -> spot, spot -> cluster, cluster -> cluster within a channel and between channels.
+
+    PARAMETERS
+    ----------
+        channels : dict
+            channel : (spots, clusters) with clusters as returned by detection (coordinates then spot number and cluster id) or None.
+        voxel_size : tuple
+
+    RETURNS
+    -------
+        distances_df : pd.DataFrame
+            One line per source object and target population : 'source_channel', 'source', 'source_id', 'target_channel', 'target', 'target_id', 'distance_nm' (float32).
+            'source' and 'target' are 'spot' or 'cluster', ids are row indexes in spots/clusters arrays.
+    """
+    dim = len(voxel_size)
+    indexes = {}
+    for channel, (spots, clusters) in channels.items() :
+        indexes[(channel, 'spot')] = SpotIndex(spots, voxel_size)
+        if type(clusters) != type(None) and len(clusters) > 0 :
+            indexes[(channel, 'cluster')] = SpotIndex(np.asarray(clusters)[:,:dim], voxel_size)
+
+    distances_df_list = []
+    for (source_channel, source), source_index in indexes.items() :
+        for (target_channel, target), target_index in indexes.items() :
+            if source == 'cluster' and target == 'spot' : continue
+            is_same_population = (source_channel, source) == (target_channel, target)
+            distances, target_ids = target_index.nearest(source_index, exclude_self= is_same_population)
+            distances_df_list.append(pd.DataFrame({
+                'source_channel' : source_channel,
+                'source' : source,
+                'source_id' : np.arange(len(source_index), dtype=np.int32),
+                'target_channel' : target_channel,
+                'target' : target,
+                'target_id' : target_ids,
+                'distance_nm' : distances,
+            }))
+
+    if len(distances_df_list) == 0 : return pd.DataFrame()
+    distances_df = pd.concat(distances_df_list, axis=0, ignore_index=True)
+    distances_df['source'] = distances_df['source'].astype('category')
+    distances_df['target'] = distances_df['target'].astype('category')
+
+    return distances_df
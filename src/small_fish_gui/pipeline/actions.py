@@ -2,7 +2,6 @@
 This submodule groups all the possible actions of the user in the main windows. It is the start of each action the user can do.
 """
 
-from torch import layout
 from ..gui.prompts import output_image_prompt, prompt_save_segmentation, prompt_load_segmentation
 from ..gui.prompts import ask_detection_confirmation, ask_cancel_detection, ask_confirmation
 from ..gui.prompts import rename_prompt
@@ -14,16 +13,17 @@ from ..interface.inoutput import input_segmentation, output_segmentation
 from ..interface import get_settings, SettingsDict, write_settings
 
 from ._preprocess import map_channels
-from ._preprocess import prepare_image_detection
 from ._preprocess import reorder_shape, reorder_image_stack
 from ._preprocess import ask_input_parameters
 
 from .detection import initiate_detection, launch_detection, launch_features_computation
 from .detection import get_nucleus_signal
+from ._detection_graph import DetectionGraph
 from .spots import launch_spots_extraction
 from .spots import load_spots, reconstruct_acquisition_data, reconstruct_cell_data
 
 from .segmentation import launch_segmentation
+from .utils import compact_label
 from ._colocalisation import initiate_colocalisation, launch_colocalisation
 
 from ..hints import pipeline_parameters
@@ -78,6 +78,8 @@ def add_detection(user_parameters : pipeline_parameters, acquisition_id, cytopla
     user_parameters['reordered_shape'] = reorder_shape(user_parameters['shape'], map_)
 
     #Detection
+    detection_graph = DetectionGraph() # Stages outputs are kept between tries : only stages whose parameters changed are recomputed
+    auto_threshold = None # Automatic threshold of last try, written in user_parameters for display and results
     while True : # This loop allow user to try detection with different thresholds or parameters before launching features computation
         detection_parameters = initiate_detection(
             user_parameters,
@@ -87,6 +89,8 @@ def add_detection(user_parameters : pipeline_parameters, acquisition_id, cytopla
 
         if type(detection_parameters) != type(None) :
             user_parameters.update(detection_parameters) 
+            if type(auto_threshold) != type(None) and user_parameters.get('threshold') == auto_threshold :
+                user_parameters['threshold'] = None # Prefilled auto threshold not changed by user : threshold stays automatic
         else : #If user clicks cancel
             
             cancel = ask_cancel_detection()
@@ -95,16 +99,27 @@ def add_detection(user_parameters : pipeline_parameters, acquisition_id, cytopla
             else : continue
 
         acquisition_id += 1
-        image, other_image = prepare_image_detection(map_, user_parameters) 
+        image, other_image = detection_graph.reorder(user_parameters, map_)
         nucleus_signal = get_nucleus_signal(image, other_image, user_parameters)
         
         try : # Catch error raised if user enter a spot size too small compare to voxel size
+            if user_parameters['show_interactive_threshold_selector'] :
+                precomputed_spots, precomputed_clusters = None, None
+                auto_threshold = None
+            else :
+                detection_result = detection_graph.run(user_parameters, map_)
+                auto_threshold = detection_result['threshold'] if type(user_parameters.get('threshold')) == type(None) else None
+                user_parameters['threshold'] = detection_result['threshold']
+                precomputed_spots, precomputed_clusters = detection_result['spots'], detection_result['clusters']
+
             user_parameters, frame_result, spots, clusters, spots_cluster_id, image, nucleus_label, cytoplasm_label = launch_detection(
                 image,
                 other_image,
                 user_parameters,
                 cell_label=cytoplasm_label,
-                nucleus_label=nucleus_label
+                nucleus_label=nucleus_label,
+                precomputed_spots=precomputed_spots,
+                precomputed_clusters=precomputed_clusters,
             )
 
         except ValueError as error :
@@ -237,6 +252,9 @@ def load_segmentation(nucleus_label, cytoplasm_label, segmentation_done) :
     if type(cytoplasm_label) != type(None) and type(cytoplasm_label) != np.ndarray :
         cytoplasm_label = cytoplasm_label['arr_0']
 
+    if type(nucleus_label) != type(None) : nucleus_label = compact_label(nucleus_label)
+    if type(cytoplasm_label) != type(None) : cytoplasm_label = compact_label(cytoplasm_label)
+
     segmentation_done = (type(nucleus_label) != type(None) and type(cytoplasm_label) != type(None))
 
     if segmentation_done : assert type(nucleus_label) == np.ndarray and type(cytoplasm_label) == np.ndarray
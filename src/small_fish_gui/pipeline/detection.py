@@ -5,19 +5,19 @@ from ..hints import pipeline_parameters
 
 from ._preprocess import ParameterInputError
 from ._preprocess import check_integrity, convert_parameters_types
+from ._preprocess import ChannelStack
 
-from ..gui.napari_visualiser import correct_spots, interactive_detection
 from ..gui import add_default_loading
 from ..gui import detection_parameters_promt
 
 from ..interface import get_voxel_size
 from ..utils import compute_anisotropy_coef
-from ._bigfish_wrapers import compute_snr_spots, _apply_log_filter, _local_maxima_mask
-
-from magicgui import magicgui
+from ._bigfish_wrapers import compute_snr_spots, decompose_dense_regions, _apply_log_filter, _local_maxima_mask
+from ._profiling import profile_stage
+from ._projection import ProjectionCache, maximum_projection
 
 from types import GeneratorType
-from napari.types import LayerDataTuple
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 from numpy import nan
@@ -28,8 +28,9 @@ import bigfish.stack as stack
 import bigfish.multistack as multistack
 import bigfish.classification as classification
 from bigfish.detection.spot_detection import get_object_radius_pixel
-from skimage.measure import regionprops
+from skimage.measure import regionprops_table
 from scipy.ndimage import binary_dilation
+from scipy import ndimage
 
 def compute_auto_threshold(images, voxel_size=None, spot_radius=None, log_kernel_size=None, minimum_distance=None, im_number= 15, crop_zstack= None) :
     """
@@ -279,35 +280,40 @@ def detect_spots(image, image_input_values: dict) :
     minimum_distance = image_input_values.get('minimum_distance')
     
     if type(threshold) == type(None) :     
-        threshold = threshold_penalty * compute_auto_threshold(image, voxel_size=voxel_size, spot_radius=spot_size, log_kernel_size=log_kernel_size, minimum_distance=minimum_distance)
-        threshold = max(threshold,1)
+        with profile_stage('auto_threshold') :
+            threshold = threshold_penalty * compute_auto_threshold(image, voxel_size=voxel_size, spot_radius=spot_size, log_kernel_size=log_kernel_size, minimum_distance=minimum_distance)
+            threshold = max(threshold,1)
 
-    filtered_image = _apply_log_filter(
-        image=image,
-        voxel_size=voxel_size,
-        spot_radius=spot_size,
-        log_kernel_size = log_kernel_size,
-    )
+    with profile_stage('log_filter') :
+        filtered_image = _apply_log_filter(
+            image=image,
+            voxel_size=voxel_size,
+            spot_radius=spot_size,
+            log_kernel_size = log_kernel_size,
+        )
 
-    local_maxima = _local_maxima_mask(
-        image_filtered=filtered_image,
-        voxel_size=voxel_size,
-        spot_radius=spot_size,
-        minimum_distance=minimum_distance
-    )
+    with profile_stage('local_maxima') :
+        local_maxima = _local_maxima_mask(
+            image_filtered=filtered_image,
+            voxel_size=voxel_size,
+            spot_radius=spot_size,
+            minimum_distance=minimum_distance
+        )
 
-    spots = detection.spots_thresholding(
-        image=filtered_image,
-        mask_local_max=local_maxima,
-        threshold=threshold
-    )[0]
+    with profile_stage('spots_thresholding') :
+        spots = detection.spots_thresholding(
+            image=filtered_image,
+            mask_local_max=local_maxima,
+            threshold=threshold
+        )[0]
         
     return spots, threshold
 
 @add_default_loading
-def launch_dense_region_deconvolution(image, spots, image_input_values: dict,) :
+def launch_dense_region_deconvolution(image, spots, image_input_values: dict, reference_spot = None) :
     """
-    Performs spot decomposition
+    Performs spot decomposition, dense regions are decomposed in parallel on 'dense_regions_workers' threads (defaults to cpu number).
+    If reference_spot is given it is used instead of computing reference spot from image.
     """
     
     ##Initiate lists
@@ -319,7 +325,7 @@ def launch_dense_region_deconvolution(image, spots, image_input_values: dict,) :
     gamma = image_input_values.get('gamma')
     deconvolution_kernel = image_input_values.get('deconvolution_kernel')
         
-    spots, dense_regions, ref_spot = detection.decompose_dense(
+    spots, ref_spot = decompose_dense_regions(
         image=image, 
         spots=spots, 
         voxel_size=voxel_size, 
@@ -327,9 +333,11 @@ def launch_dense_region_deconvolution(image, spots, image_input_values: dict,) :
         kernel_size=deconvolution_kernel, 
         alpha=alpha, 
         beta=beta, 
-        gamma=gamma
+        gamma=gamma,
+        reference_spot=reference_spot,
+        max_workers=image_input_values.get('dense_regions_workers'),
         )
-    del dense_regions, ref_spot
+    del ref_spot
 
     return spots
 
@@ -342,7 +350,8 @@ def launch_post_detection(image, spots, image_input_values: dict,) :
 
     #features
     fov_res['spot_number'] = len(spots)
-    snr_res = compute_snr_spots(image, spots, voxel_size, spot_size)
+    with profile_stage('snr') :
+        snr_res = compute_snr_spots(image, spots, voxel_size, spot_size)
     if len(spots) == 0 :
         fov_res['spotsSignal_median'], fov_res['spotsSignal_mean'], fov_res['spotsSignal_std'] = np.nan, np.nan, np.nan
     else :
@@ -362,6 +371,49 @@ def launch_post_detection(image, spots, image_input_values: dict,) :
 
     return fov_res
 
+def _compute_labelled_statistics(signal : np.ndarray, label : np.ndarray, index : np.ndarray) -> dict :
+    """
+    Mean, median, max and min of signal pixels of each label in index, computed for all labels at once. nan for labels without pixels.
+    """
+    index = np.asarray(index, dtype=int)
+    statistics = {key : np.full(len(index), np.nan) for key in ['mean', 'median', 'max', 'min']}
+    pixel_count = np.bincount(label.ravel(), minlength= index.max() + 1 if len(index) > 0 else 1)
+    is_present = pixel_count[index] > 0
+    present_index = index[is_present]
+    if len(present_index) == 0 : return statistics
+
+    statistics['mean'][is_present] = ndimage.mean(signal, labels=label, index=present_index)
+    statistics['median'][is_present] = ndimage.median(signal, labels=label, index=present_index)
+    statistics['max'][is_present] = ndimage.maximum(signal, labels=label, index=present_index)
+    statistics['min'][is_present] = ndimage.minimum(signal, labels=label, index=present_index)
+
+    return statistics
+
+def _compute_cell_features(cell : dict, dim : int, voxel_size : tuple, compute_foci : bool) :
+    """
+    Bigfish features of one cell from `multistack.extract_cell` result. Only cell crops are read so cells can be computed in parallel threads.
+    """
+    with np.errstate(divide= 'ignore', invalid= 'ignore') :
+        features = classification.compute_features(
+            cell_mask=cell['cell_mask'],
+            nuc_mask=cell['nuc_mask'],
+            ndim=dim,
+            rna_coord= cell['rna_coord'],
+            foci_coord=cell.get('clusters_coords'),
+            voxel_size_yx= float(voxel_size[-1]),
+            smfish=cell['image'],
+            centrosome_coord=None,
+            compute_centrosome=False,
+            compute_area=True,
+            compute_dispersion=True,
+            compute_distance=True,
+            compute_foci= compute_foci,
+            compute_intranuclear=True,
+            compute_protrusion=False,
+            compute_topography=True
+        )
+    return features
+
 def _compute_cell_snr(image: np.ndarray, bbox, spots, voxel_size, spot_size) :
     
     min_y, min_x, max_y, max_x = bbox
@@ -404,7 +456,8 @@ def launch_cell_extraction(
     nucleus_signal, 
     cell_label, 
     nucleus_label, 
-    user_parameters : pipeline_parameters
+    user_parameters : pipeline_parameters,
+    projection_cache : ProjectionCache = None,
     ) :
 
     #Extract parameters
@@ -428,13 +481,13 @@ def launch_cell_extraction(
     if do_clustering : do_clustering = len(clusters) > 0
 
     if image.ndim == 3 :
-        image = stack.maximum_projection(image)
+        image = maximum_projection(image, projection_cache)
     if nucleus_signal.ndim == 3 :
-        nucleus_signal = stack.maximum_projection(nucleus_signal)
+        nucleus_signal = maximum_projection(nucleus_signal, projection_cache)
     if cell_label.ndim == 3 :
-        cell_label = stack.maximum_projection(cell_label)
+        cell_label = maximum_projection(cell_label, projection_cache)
     if nucleus_label.ndim == 3 :
-        nucleus_label = stack.maximum_projection(nucleus_label)
+        nucleus_label = maximum_projection(nucleus_label, projection_cache)
 
     cells_results = multistack.extract_cell(
         cell_label=cell_label,
@@ -468,55 +521,37 @@ def launch_cell_extraction(
         features_names += ['cluster_coords', 'clustered_spots_coords', 'free_spots_coords']
         features_names += ['clustered_spot_number', 'free_spot_number']
 
+    #Cell centers and nucleus signal are measured once for the whole fov
+    cell_ids = [cell['cell_id'] for cell in cells_results]
+    cell_centers = regionprops_table(cell_label, properties=('label', 'centroid'))
+    cell_centers = dict(zip(cell_centers['label'], zip(cell_centers['centroid-0'], cell_centers['centroid-1'])))
+    nucleus_statistics = _compute_labelled_statistics(nucleus_signal, nucleus_label, cell_ids)
+
+    #Bigfish features : cells are independent, computed in a thread pool (crops are shared, nothing is pickled), results keep cells order.
+    compute_foci = do_clustering and len(clusters) > 0
+    workers = max(1, int(user_parameters.get('cell_features_workers', 1)))
+    if workers > 1 and len(cells_results) > 1 :
+        with ThreadPoolExecutor(max_workers= workers) as executor :
+            cells_features = list(executor.map(lambda cell : _compute_cell_features(cell, dim, voxel_size, compute_foci), cells_results))
+    else :
+        cells_features = [_compute_cell_features(cell, dim, voxel_size, compute_foci) for cell in cells_results]
+
     result_frame = pd.DataFrame()
 
-    for cell in cells_results :
+    for cell_index, cell in enumerate(cells_results) :
 
         #Extract cell results
         cell_id = cell['cell_id']
-        cell_mask = cell['cell_mask']
         nuc_mask = cell ['nuc_mask']
         cell_bbox = cell['bbox'] # (min_y, min_x, max_y, max_x)
-        min_y, min_x, max_y, max_x = cell['bbox'] # (min_y, min_x, max_y, max_x)
-        nuc_signal = nucleus_signal[min_y:max_y, min_x:max_x]
         rna_coords = cell['rna_coord']
         foci_coords = cell.get('clusters_coords')
         clustered_spots_coords = cell.get('clustered_spots')
         free_spots_coords = cell.get('free_spots')
-        signal = cell['image']
-
-        if do_clustering :
-            if len(clusters) > 0 :
-                compute_foci = True
-            else : 
-                compute_foci = False
-        else : compute_foci = False
-
-        with np.errstate(divide= 'ignore', invalid= 'ignore') :
-            features = classification.compute_features(
-                cell_mask=cell_mask,
-                nuc_mask=nuc_mask,
-                ndim=dim,
-                rna_coord= rna_coords,
-                foci_coord=foci_coords,
-                voxel_size_yx= float(voxel_size[-1]),
-                smfish=signal,
-                centrosome_coord=None,
-                compute_centrosome=False,
-                compute_area=True,
-                compute_dispersion=True,
-                compute_distance=True,
-                compute_foci= compute_foci,
-                compute_intranuclear=True,
-                compute_protrusion=False,
-                compute_topography=True
-            )
+        features = cells_features[cell_index]
 
         #center of cell coordinates
-        local_cell_center = regionprops(
-            label_image=cell_mask.astype(int)
-        )[0]['centroid']
-        cell_center = (local_cell_center[0] + min_y, local_cell_center[1] + min_x)
+        cell_center = cell_centers[cell_id]
 
         #foci in nucleus
         if type(foci_coords) != type(None) :
@@ -550,7 +585,7 @@ def launch_cell_extraction(
         snr_std = snr_dict['snr_std']
 
         features = list(features)
-        features += [np.mean(nuc_signal), np.median(nuc_signal), np.max(nuc_signal), np.min(nuc_signal)]
+        features += [nucleus_statistics[key][cell_index] for key in ['mean', 'median', 'max', 'min']]
         features += [snr_mean, snr_median, snr_std]
         features += [cell_center]
         if not foci_coords is None :
@@ -599,6 +634,9 @@ def launch_detection(
         cell_label= None,
         nucleus_label = None,
         hide_loading=False,
+        dense_reference_spot = None,
+        precomputed_spots = None,
+        precomputed_clusters = None,
         ) :
     """
     Main call for features computation :
@@ -619,12 +657,18 @@ def launch_detection(
     USER_PARAMETERS UPDATE
     ----------------------
         'threshold'
+
+    PRECOMPUTED RESULTS
+    -------------------
+        precomputed_spots : spots after detection and dense regions deconvolution, these steps are skipped if given.
+        precomputed_clusters : tuple (clusters, spots_cluster_id), clustering is skipped if given.
     """
     fov_result = {}
     do_dense_region_deconvolution = user_parameters['do_dense_regions_deconvolution']
     do_clustering = user_parameters['do_cluster_computation']
 
     if user_parameters['show_interactive_threshold_selector'] :
+        from ..gui.napari_visualiser import interactive_detection #Lazy import : napari is slow to load
         spots, image, updated_parameters = interactive_detection(
             image=image,
             voxel_size=user_parameters['voxel_size'],
@@ -645,15 +689,24 @@ def launch_detection(
 
         user_parameters.update(updated_parameters)
 
+    elif type(precomputed_spots) != type(None) :
+        spots = precomputed_spots
+
     else :
-        spots, threshold  = detect_spots(image, user_parameters, hide_loading = hide_loading)
+        with profile_stage('spot_detection') :
+            spots, threshold  = detect_spots(image, user_parameters, hide_loading = hide_loading)
         user_parameters['threshold'] = threshold
             
         if do_dense_region_deconvolution : 
-            spots = launch_dense_region_deconvolution(image, spots, user_parameters, hide_loading = hide_loading)
+            with profile_stage('dense_region_deconvolution') :
+                spots = launch_dense_region_deconvolution(image, spots, user_parameters, reference_spot=dense_reference_spot, hide_loading = hide_loading)
             
-    if do_clustering : 
-        clusters, clustered_spots = launch_clustering(spots, user_parameters, hide_loading = hide_loading) #012 are coordinates #3 is number of spots per cluster, #4 is cluster index
+    if do_clustering and type(precomputed_clusters) != type(None) :
+        clusters, spots_cluster_id = precomputed_clusters
+
+    elif do_clustering : 
+        with profile_stage('clustering') :
+            clusters, clustered_spots = launch_clustering(spots, user_parameters, hide_loading = hide_loading) #012 are coordinates #3 is number of spots per cluster, #4 is cluster index
         spots, spots_cluster_id = clustered_spots[:,:-1], clustered_spots[:,-1]
 
     else : 
@@ -662,6 +715,7 @@ def launch_detection(
 
     if user_parameters['show_napari_corrector'] :
         
+        from ..gui.napari_visualiser import correct_spots #Lazy import : napari is slow to load
         spots, clusters, new_cluster_radius, new_min_spot_number, nucleus_label, cell_label = correct_spots(
             image, 
             spots, 
@@ -686,7 +740,8 @@ def launch_detection(
         else :
             spots_cluster_id = None
 
-    post_detection_dict = launch_post_detection(image, spots, user_parameters, hide_loading = hide_loading)
+    with profile_stage('post_detection') :
+        post_detection_dict = launch_post_detection(image, spots, user_parameters, hide_loading = hide_loading)
     fov_result.update(post_detection_dict)
     
     return user_parameters, fov_result, spots, clusters, spots_cluster_id, image, nucleus_label, cell_label
@@ -704,7 +759,8 @@ def launch_features_computation(
         nucleus_label, 
         cell_label, 
         user_parameters : pipeline_parameters, 
-        frame_results
+        frame_results,
+        projection_cache : ProjectionCache = None,
         ) :
 
     dim = image.ndim
@@ -718,17 +774,19 @@ def launch_features_computation(
     if type(cell_label) != type(None) and type(nucleus_label) != type(None): 
         
         try :
-            cell_result_dframe = launch_cell_extraction(
-                acquisition_id=acquisition_id,
-                spots=spots,
-                clusters=clusters,
-                spots_cluster_id = spots_cluster_id,
-                image=image,
-                nucleus_signal=nucleus_signal,
-                cell_label= cell_label,
-                nucleus_label=nucleus_label,
-                user_parameters=user_parameters,
-            )
+            with profile_stage('cell_features') :
+                cell_result_dframe = launch_cell_extraction(
+                    acquisition_id=acquisition_id,
+                    spots=spots,
+                    clusters=clusters,
+                    spots_cluster_id = spots_cluster_id,
+                    image=image,
+                    nucleus_signal=nucleus_signal,
+                    cell_label= cell_label,
+                    nucleus_label=nucleus_label,
+                    user_parameters=user_parameters,
+                    projection_cache=projection_cache,
+                )
 
         except IndexError as e: #User loaded a segmentation and no cells can be extracted out of it.
             raise NoCellInFrameError("No cell was fit for quantification in segmentation. This can happen if you loaded empty segmentation or there is a missmatch between cytoplasm and nuclei.\nIf you didn't load segmentation please report the issue as this should not happen.") from e
@@ -808,7 +866,10 @@ def get_nucleus_signal(image, other_images, user_parameters) :
         if type(nucleus_signal_channel) == type(None) :
             return np.zeros(shape=image.shape)
 
-        if rna_signal_channel == nucleus_signal_channel :
+        if isinstance(other_images, ChannelStack) : #Original channel index is available, no shift needed
+            nucleus_signal = other_images.get_channel(nucleus_signal_channel)
+
+        elif rna_signal_channel == nucleus_signal_channel :
             nucleus_signal = image
         
         elif nucleus_signal_channel > rna_signal_channel :
@@ -822,7 +883,7 @@ def get_nucleus_signal(image, other_images, user_parameters) :
     else :
         return image
 
-def output_spot_tiffvisual(channel,spots_list, path_output, dot_size = 3, rescale = True):
+def output_spot_tiffvisual(channel,spots_list, path_output, dot_size = 3, rescale = True, projection_cache : ProjectionCache = None):
     
     """
     Outputs a tiff image with one channel being {channel} and the other a mask containing dots where sports are located.
@@ -844,7 +905,7 @@ def output_spot_tiffvisual(channel,spots_list, path_output, dot_size = 3, rescal
     if isinstance(spots_list, np.ndarray) : spots_list = [spots_list]
 
     if channel.ndim == 3 : 
-        channel = stack.maximum_projection(channel)
+        channel = maximum_projection(channel, projection_cache)
 
     im = np.zeros([1 + len(spots_list)] + list(channel.shape))
     im[0,:,:] = channel
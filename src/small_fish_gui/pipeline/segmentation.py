@@ -2,21 +2,21 @@
 Contains cellpose wrappers to segmentate images.
 """
 
-from cellpose.core import use_gpu
 from skimage.measure import label
 from ..hints import pipeline_parameters
 from ..interface import get_settings
 from ..gui import prompt, ask_cancel_segmentation, segmentation_prompt
-from ..gui.napari_visualiser import show_segmentation as napari_show_segmentation
 from ..interface import open_image, SettingsDict, get_settings
 
 from .utils import from_label_get_centeroidscoords
 from ._preprocess import ask_input_parameters
 from ._preprocess import map_channels, reorder_shape, reorder_image_stack
+from ._preprocess import ChannelStack
+from ._profiling import profile_stage
+from ._projection import ProjectionCache, maximum_projection, mean_projection
 
 from matplotlib.colors import ListedColormap
 import matplotlib as mpl
-import cellpose.models as models
 import numpy as np
 import bigfish.multistack as multistack
 import bigfish.stack as stack
@@ -24,7 +24,7 @@ import bigfish.plot as plot
 import FreeSimpleGUI as sg
 import matplotlib.pyplot as plt
 import os
-from .utils import using_mps
+from .utils import using_mps, compact_label
 
 def launch_segmentation(user_parameters: pipeline_parameters, nucleus_label, cytoplasm_label, batch_mode=False) :
     """
@@ -133,12 +133,13 @@ def launch_segmentation(user_parameters: pipeline_parameters, nucleus_label, cyt
         if segmentation_parameters["show_segmentation"] :
             if is_multichannel :
                 if segmentation_parameters["segment_only_nuclei"] :
-                    other_image = np.delete(image, [segmentation_parameters["nucleus_channel"]], axis=0)
+                    other_image = ChannelStack(image, excluded_channels=[segmentation_parameters["nucleus_channel"]])
                 else :
-                    other_image = np.delete(image, [segmentation_parameters["cytoplasm_channel"], segmentation_parameters["nucleus_channel"]], axis=0)
+                    other_image = ChannelStack(image, excluded_channels=[segmentation_parameters["cytoplasm_channel"], segmentation_parameters["nucleus_channel"]])
             else :
                 other_image = None
                 
+            from ..gui.napari_visualiser import show_segmentation as napari_show_segmentation #Lazy import : napari is slow to load
             nucleus_label, cytoplasm_label = napari_show_segmentation(
                 nuc_image=image[segmentation_parameters["nucleus_channel"]] if type(segmentation_parameters["other_nucleus_image"]) == type(None) else segmentation_parameters["other_nucleus_image"],
                 nuc_label= nucleus_label,
@@ -234,6 +235,7 @@ def cell_segmentation(
         cytoplasm_cellprob_threshold = 0.,
         do_only_nuc=False,
         external_nucleus_image = None,
+        projection_cache : ProjectionCache = None,
         **segmentation_parameters : pipeline_parameters
         ) :
 
@@ -247,37 +249,38 @@ def cell_segmentation(
 
     if nuc.ndim >= 3 and not nucleus_3D_segmentation:
 
-        if segmentation_parameters["nucleus_max_proj"] : nuc = np.max(nuc, axis=0)
-        elif segmentation_parameters["nucleus_mean_proj"] : nuc = np.mean(nuc, axis=0)
+        if segmentation_parameters["nucleus_max_proj"] : nuc = maximum_projection(nuc, projection_cache)
+        elif segmentation_parameters["nucleus_mean_proj"] : nuc = mean_projection(nuc, projection_cache)
         elif segmentation_parameters["nucleus_select_slice"] : nuc = nuc[segmentation_parameters["nucleus_selected_slice"]]
         else : raise AssertionError("No option found for 2D nucleus seg. Should be impossible as this error is raised after integrity checks")
     
     
-    nuc_label = _segmentate_object(
-        nuc, 
-        nucleus_model_name, 
-        nucleus_diameter, 
-        do_3D=nucleus_3D_segmentation, 
-        anisotropy=anisotropy,
-        flow_threshold= nucleus_flow_threshold,
-        cellprob_threshold=nucleus_cellprob_threshold,
-        min_size=segmentation_parameters["nucleus_min_size"]
-        )
+    with profile_stage('nucleus_segmentation') :
+        nuc_label = _segmentate_object(
+            nuc, 
+            nucleus_model_name, 
+            nucleus_diameter, 
+            do_3D=nucleus_3D_segmentation, 
+            anisotropy=anisotropy,
+            flow_threshold= nucleus_flow_threshold,
+            cellprob_threshold=nucleus_cellprob_threshold,
+            min_size=segmentation_parameters["nucleus_min_size"]
+            )
     
     if not do_only_nuc : 
         cyto_channel = channels[0]
         nuc = reordered_image[nuc_channel] if type(external_nucleus_image) == type(None) else external_nucleus_image
 
         if reordered_image[cyto_channel].ndim >= 3 and not cyto_3D_segmentation:
-            if segmentation_parameters["cytoplasm_max_proj"] : cyto = np.max(reordered_image[cyto_channel], axis=0)
-            elif segmentation_parameters["cytoplasm_mean_proj"] : cyto = np.mean(reordered_image[cyto_channel], axis=0)
+            if segmentation_parameters["cytoplasm_max_proj"] : cyto = maximum_projection(reordered_image[cyto_channel], projection_cache)
+            elif segmentation_parameters["cytoplasm_mean_proj"] : cyto = mean_projection(reordered_image[cyto_channel], projection_cache)
             elif segmentation_parameters["cytoplasm_select_slice"] : cyto = reordered_image[cyto_channel][segmentation_parameters["cytoplasm_selected_slice"]]
             else : raise AssertionError("No option found for 2D cytoplasm seg. Should be impossible as this error is raised after integrity checks")
         else : 
             cyto = reordered_image[cyto_channel]
         if nuc.ndim >= 3 and not cyto_3D_segmentation:
-            if segmentation_parameters["cytoplasm_max_proj"] : nuc = np.max(nuc, axis=0)
-            elif segmentation_parameters["cytoplasm_mean_proj"] : nuc = np.mean(nuc, axis=0)
+            if segmentation_parameters["cytoplasm_max_proj"] : nuc = maximum_projection(nuc, projection_cache)
+            elif segmentation_parameters["cytoplasm_mean_proj"] : nuc = mean_projection(nuc, projection_cache)
             elif segmentation_parameters["cytoplasm_select_slice"] : nuc = nuc[segmentation_parameters["cytoplasm_selected_slice"]]
             else : raise AssertionError("No option found for 2D cytoplasm seg. Should be impossible as this error is raised after integrity checks")
 
@@ -288,23 +291,25 @@ def cell_segmentation(
         dest = source[-1:] + source[:-1]
         reordered_image = np.moveaxis(reordered_image, source=range(reordered_image.ndim), destination= dest)
 
-        cytoplasm_label = _segmentate_object(
-            reordered_image, 
-            cytoplasm_model_name, 
-            cytoplasm_diameter, 
-            do_3D=cyto_3D_segmentation, 
-            anisotropy=anisotropy,
-            flow_threshold=cytoplasm_flow_threshold,
-            cellprob_threshold=cytoplasm_cellprob_threshold,
-            min_size=segmentation_parameters["cytoplasm_min_size"]
-            )
+        with profile_stage('cytoplasm_segmentation') :
+            cytoplasm_label = _segmentate_object(
+                reordered_image, 
+                cytoplasm_model_name, 
+                cytoplasm_diameter, 
+                do_3D=cyto_3D_segmentation, 
+                anisotropy=anisotropy,
+                flow_threshold=cytoplasm_flow_threshold,
+                cellprob_threshold=cytoplasm_cellprob_threshold,
+                min_size=segmentation_parameters["cytoplasm_min_size"]
+                )
 
         if cytoplasm_label.ndim == 3 and nuc_label.ndim == 2 :
             nuc_label = np.repeat(nuc_label[np.newaxis], len(cytoplasm_label), axis= 0)
         if nuc_label.ndim == 3 and cytoplasm_label.ndim == 2 :
             cytoplasm_label = np.repeat(cytoplasm_label[np.newaxis], len(nuc_label), axis= 0)
 
-        nuc_label, cytoplasm_label = multistack.match_nuc_cell(nuc_label=nuc_label, cell_label=cytoplasm_label, single_nuc=True, cell_alone=False)
+        with profile_stage('nucleus_cell_matching') :
+            nuc_label, cytoplasm_label = multistack.match_nuc_cell(nuc_label=nuc_label, cell_label=cytoplasm_label, single_nuc=True, cell_alone=False)
     else :
         cytoplasm_label = nuc_label
 
@@ -321,6 +326,9 @@ def _segmentate_object(
         min_size = 15 #Default cellpose
         ) :
     
+    #Lazy imports : cellpose loads torch which is slow, only needed when segmenting.
+    import cellpose.models as models
+    from cellpose.core import use_gpu
 
     model = models.CellposeModel(
         gpu= use_gpu(),
@@ -340,7 +348,7 @@ def _segmentate_object(
         min_size=min_size,
         )
     
-    label = np.array(label, dtype= np.int64)
+    label = compact_label(label)
     if not do_3D : label = remove_disjoint(label) # Too much time consuming in 3D
     
     return label
@@ -647,7 +655,7 @@ def remove_disjoint(image):
     image_cleaned = np.zeros_like(image)
 
     # loop over instances
-    max_label = image.max()
+    max_label = int(image.max())
     for i in range(1, max_label + 1):
 
         # get instance mask
@@ -687,20 +695,21 @@ def plot_segmentation(
         nuc_image : np.ndarray, 
         nuc_label : np.ndarray,
         path :str, 
-        do_only_nuc=False
+        do_only_nuc=False,
+        projection_cache : ProjectionCache = None,
         ) :
 
     if nuc_image.ndim == 3 :
-        nuc_image = np.max(nuc_image,axis=0)
+        nuc_image = maximum_projection(nuc_image, projection_cache)
     
     if cyto_label.ndim == 3 :
-        cyto_label = np.max(cyto_label,axis=0)
+        cyto_label = maximum_projection(cyto_label, projection_cache)
     
     if nuc_label.ndim == 3 :
-        nuc_label = np.max(nuc_label,axis=0)
+        nuc_label = maximum_projection(nuc_label, projection_cache)
     
     if cyto_image.ndim == 3 :
-        cyto_image = np.max(cyto_image,axis=0)
+        cyto_image = maximum_projection(cyto_image, projection_cache)
     
     plot.plot_segmentation_boundary(
         image=nuc_image,
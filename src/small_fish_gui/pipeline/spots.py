@@ -43,94 +43,122 @@ def compute_Spots(
         nucleus_label : np.ndarray = None,
         cell_label : np.ndarray = None,
 ) :
+    """
+    Builds individual spots table : one line per spot with numeric coordinates columns ('z' if 3D, 'y', 'x').
+    Spots on cells touching fov edges get cell_label 0.
+    """
 
     if len(spots) == 0 :
         return pd.DataFrame()
 
+    spots = np.asarray(spots)
+    spot_number, dim = spots.shape
+    index = tuple(spots.T)
+    coordinates_dtype = np.uint16 if spots.max() <= np.iinfo(np.uint16).max else np.int32
+
     if type(cluster_id) == type(None) : #When user doesn't select cluster
-        cluster_id = [np.nan]*len(spots)
+        cluster_id = np.full(spot_number, np.nan)
+    else :
+        cluster_id = np.asarray(cluster_id).astype(np.int32)
 
-    index = tuple(spots.T.tolist())
-    spot_intensities_list = list(image[index])
+    spot_intensities = image[index]
     if type(nucleus_label) != type(None) :
         if nucleus_label.ndim == 2 :
-            in_nuc_list = list(nucleus_label.astype(bool)[index[-2:]]) #Only plane coordinates
+            in_nucleus = nucleus_label[index[-2:]] != 0 #Only plane coordinates
         else :
-            in_nuc_list = list(nucleus_label.astype(bool)[index])
+            in_nucleus = nucleus_label[index] != 0
     else :
-        in_nuc_list = np.nan
-    if type(cell_label) != type(None) :
+        in_nucleus = np.nan
 
-        # Collect all labels that are on fov edge
+    if type(cell_label) != type(None) :
         if cell_label.ndim == 3 :
-            on_edge_labels = np.unique(
-                np.concatenate([
-                    cell_label[:,:,0],
-                    cell_label[:,:,-1],
-                    cell_label[:,0,:],
-                    cell_label[:,-1,:],
-                ])
-            ).astype(int)
-            cell_label_list = list(cell_label[index])
+            cell_labels = cell_label[index]
+            edges = [cell_label[:,:,0], cell_label[:,:,-1], cell_label[:,0,:], cell_label[:,-1,:]]
         else :
-            on_edge_labels = np.unique(
-                np.concatenate([
-                    cell_label[:,0],
-                    cell_label[:,-1],
-                    cell_label[0,:],
-                    cell_label[-1,:],
-                ])
-            ).astype(int)
-            cell_label_list = list(cell_label[index[-2:]]) #Only plane coordinates
+            cell_labels = cell_label[index[-2:]] #Only plane coordinates
+            edges = [cell_label[:,0], cell_label[:,-1], cell_label[0,:], cell_label[-1,:]]
 
+        # Filter on edge cells : lookup table label -> touches fov edge
+        on_edge = np.zeros(int(cell_label.max()) + 1, dtype=bool)
+        for edge in edges : on_edge[edge.ravel()] = True
+        cell_labels = np.where(on_edge[cell_labels], 0, cell_labels)
     else :
-        cell_label_list = np.nan
-    id_list = np.arange(len(spots))
-
-    coord_list = list(zip(*index))
+        cell_labels = np.nan
 
     Spots = pd.DataFrame({
-        'acquisition_id' : [acquisition_id] * len(spots),
-        'spot_id' : id_list,
-        'intensity' : spot_intensities_list,
-        'cell_label' : cell_label_list,
-        'in_nucleus' : in_nuc_list,
-        'coordinates' : coord_list,
-        'cluster_id' : cluster_id,
+        'acquisition_id' : np.full(spot_number, acquisition_id, dtype=np.int32),
+        'spot_id' : np.arange(spot_number, dtype=np.int32),
+        'intensity' : spot_intensities,
+        'cell_label' : cell_labels,
+        'in_nucleus' : in_nucleus,
     })
-    
-    if type(cell_label) != type(None) : #Filter on edge cells
-        target_index = Spots.loc[Spots["cell_label"].isin(on_edge_labels)].index
-        Spots.loc[target_index,["cell_label"]] = 0
+    for axis, coordinates in zip(['z','y','x'][-dim:], index) :
+        Spots[axis] = coordinates.astype(coordinates_dtype)
+    Spots['cluster_id'] = cluster_id
 
     return Spots
     
+#Columns read when loading a spots table, other columns are skipped (column projection).
+SPOTS_TABLE_COLUMNS = ['acquisition_id', 'spot_id', 'intensity', 'cell_label', 'in_nucleus', 'z', 'y', 'x', 'coordinates', 'cluster_id']
+SPOTS_TABLE_DTYPES = {'z' : np.int32, 'y' : np.int32, 'x' : np.int32, 'coordinates' : str}
+
+def _read_arrow_table(table_path : str) -> pd.DataFrame :
+    """
+    Reads parquet or feather/arrow table memory mapped, only SPOTS_TABLE_COLUMNS are loaded.
+    """
+    try :
+        import pyarrow.parquet as pq #Lazy import : only needed for arrow formats
+        import pyarrow.feather as feather
+    except ImportError :
+        raise ValueError("pyarrow is needed to read .parquet, .feather or .arrow tables.")
+
+    if table_path.endswith('.parquet') :
+        table_file = pq.ParquetFile(table_path, memory_map=True)
+        columns = [column for column in table_file.schema_arrow.names if column in SPOTS_TABLE_COLUMNS]
+        table = table_file.read(columns=columns)
+    else :
+        table = feather.read_table(table_path, memory_map=True)
+        table = table.select([column for column in table.column_names if column in SPOTS_TABLE_COLUMNS])
+
+    return table.to_pandas()
+
 def load_spots(
         table_path : str
         ) -> pd.DataFrame :
+    """
+    Loads spots table saved by spots extraction for colocalisation. Numeric 'z', 'y', 'x' columns are read directly, legacy 'coordinates' column with tuples is parsed.
+    Supported formats : .csv, .xlsx, .xls, .parquet, .feather, .arrow
+
+    RETURNS
+    -------
+        Spots : pd.DataFrame
+            with coordinates as 'z' (if 3D), 'y', 'x' columns and 'coordinates' column (list per spot).
+    """
     
     if table_path.endswith('.csv') :
-        Spots = pd.read_csv(table_path, sep= ";")
+        Spots = pd.read_csv(table_path, sep= ";", usecols= lambda column : column in SPOTS_TABLE_COLUMNS, dtype=SPOTS_TABLE_DTYPES)
     elif table_path.endswith('.xlsx') or table_path.endswith('.xls') :
-        Spots = pd.read_excel(table_path)
-    elif table_path.endswith('.feather') :
-        Spots = pd.read_feather(table_path)
+        Spots = pd.read_excel(table_path, usecols= lambda column : column in SPOTS_TABLE_COLUMNS, dtype=SPOTS_TABLE_DTYPES)
+    elif table_path.endswith('.parquet') or table_path.endswith('.feather') or table_path.endswith('.arrow') :
+        Spots = _read_arrow_table(table_path)
     else :
-        raise ValueError("Table format not recognized. Please use .csv, .xlsx or .feather files.")
+        raise ValueError("Table format not recognized. Please use .csv, .xlsx, .parquet or .feather files.")
     
-    if "coordinates" in Spots.columns :
-        reconstructed_spots=reconstruct_spots(Spots["coordinates"])
+    if "y" in Spots.columns and "x" in Spots.columns :
+        coordinates_columns = ["z", "y", "x"] if "z" in Spots.columns else ["y", "x"]
+        spots = Spots.loc[:,coordinates_columns].to_numpy()
+
+    elif "coordinates" in Spots.columns :
+        spots = reconstruct_spots(Spots["coordinates"])
+        coordinates_columns = ["z", "y", "x"][-spots.shape[1]:]
         Spots = Spots.drop("coordinates",axis=1)
-        Spots.loc[:,["coordinates"]] = pd.Series(index=Spots.index, data=reconstructed_spots.tolist())
+        for axis, coordinates in zip(coordinates_columns, spots.T) : Spots[axis] = coordinates
         
-    elif "y" in Spots.columns and "x" in Spots.columns :
-        if "z" in Spots.columns :
-            pass
-        else :
-            pass
     else :
         raise ValueError("Coordinates information not found in table. Please provide a 'coordinates' column with tuples (z,y,x) or (y,x) or 'y' and 'x' columns.")
 
+    Spots["coordinates"] = pd.Series(index=Spots.index, data=spots.tolist())
+
     return Spots
 
 def reconstruct_acquisition_data(
@@ -181,50 +209,71 @@ def reconstruct_acquisition_data(
 
 def reconstruct_spots(
         coordinates_serie : pd.Series
-        ) :
-    spots = coordinates_serie.str.replace('(','').str.replace(')','')
-    spots = spots.str.split(',')
-    spots = spots.apply(np.array)
-    spots = np.array(spots.to_list()).astype(int)
+        ) -> np.ndarray :
+    """
+    Parses legacy coordinates column ("(z, y, x)" strings) into a (spot_number, dim) int array : all strings are joined and parsed at once.
+    """
+    if len(coordinates_serie) == 0 : return np.empty(shape=(0,3), dtype=int)
+
+    dim = coordinates_serie.iat[0].count(',') + 1
+    text = coordinates_serie.str.cat(sep=',')
+    for character in '()[]' : text = text.replace(character, '')
+    spots = np.fromstring(text, dtype=np.int64, sep=',')
 
-    return spots
+    if len(spots) != dim * len(coordinates_serie) :
+        raise ValueError("Coordinates have different dimensions.")
 
+    return spots.reshape(-1, dim)
+
+
+def _to_object_column(arrays : list) -> np.ndarray :
+    """
+    1D object array holding each array as is (no stacking even when all arrays have same shape).
+    """
+    column = np.empty(len(arrays), dtype=object)
+    for i, array in enumerate(arrays) : column[i] = array
+    return column
 
 def reconstruct_cell_data(
         Spots : pd.DataFrame,
         max_id : int,
         filename : str,
         ) :
-    
-
+    """
+    Aim : creating cells to add to cell_result_dataframe from loaded spots for co-localization use.
+    Spots are sorted by cell label once, each cell coordinates are a view (contiguous slice) of the sorted coordinates array.
+    """
 
     has_cluster = not Spots['cluster_id'].isna().all()
-    if 'cell_label' in Spots.columns : Spots = Spots.loc[Spots["cell_label"] !=0]
-    cell = Spots.groupby('cell_label')['coordinates'].apply(np.array).rename("rna_coords")
-    cell = Spots.groupby('cell_label').agg({
-        'coordinates' : np.array
+    Spots = Spots.loc[Spots["cell_label"].notna() & (Spots["cell_label"] !=0)]
+
+    coordinates_columns = [axis for axis in ["z", "y", "x"] if axis in Spots.columns]
+    spots = Spots.loc[:,coordinates_columns].to_numpy()
+    cell_labels = Spots['cell_label'].to_numpy()
+
+    order = np.argsort(cell_labels, kind='stable')
+    cell_labels = cell_labels[order]
+    spots = spots[order]
+    cell_ids, offsets = np.unique(cell_labels, return_index=True)
+    ends = np.append(offsets[1:], len(spots)).astype(int)
+
+    cell = pd.DataFrame({
+        'cell_id' : cell_ids,
+        'rna_coords' : _to_object_column([spots[start:end] for start, end in zip(offsets, ends)]),
+        'total_rna_number' : ends - offsets,
     })
-    cell = cell.rename(columns={"coordinates" : "rna_coords"})
-    
-    #Handle cells with no spots
-    na_mask =cell[cell['rna_coords'].isna()].index
-    cell.loc[na_mask, ['rna_coords']] = pd.Series([np.empty(shape=(0,3))]*len(na_mask), dtype= object, index=na_mask)
-    cell.loc[~na_mask, "rna_coords"] = cell.loc[~na_mask, "rna_coords"].apply(list).apply(np.array)
 
-    cell['total_rna_number'] = cell['rna_coords'].apply(len)
     if has_cluster :
-        cell['clustered_spots_coords'] = Spots[Spots['cluster_id'] !=-1].groupby('cell_label')['coordinates'].apply(np.array).rename("clustered_spots_coords")
-        
-        #Handle cells with no clusters
-        na_mask =cell[cell['clustered_spots_coords'].isna()].index
-        cell.loc[na_mask, ['clustered_spots_coords']] = pd.Series([np.empty(shape=(0,3))]*len(na_mask), dtype= object, index=na_mask)
-        cell["clustered_spots_coords"] = cell["clustered_spots_coords"].apply(list).apply(np.array)
-        
-        cell['clustered_spot_number'] = cell['clustered_spots_coords'].apply(len)
+        is_clustered = Spots['cluster_id'].to_numpy()[order] != -1
+        clustered_spots = spots[is_clustered]
+        clustered_labels = cell_labels[is_clustered]
+        clustered_starts = np.searchsorted(clustered_labels, cell_ids, side='left')
+        clustered_ends = np.searchsorted(clustered_labels, cell_ids, side='right')
+
+        cell['clustered_spots_coords'] = _to_object_column([clustered_spots[start:end] for start, end in zip(clustered_starts, clustered_ends)])
+        cell['clustered_spot_number'] = clustered_ends - clustered_starts
 
     cell['acquisition_id'] = max_id + 1
     cell['name'] = "(loaded_spots)_{}".format(filename.split('.', maxsplit=1)[0])
-    cell = cell.reset_index(drop=False)
-    cell = cell.rename(columns={"cell_label": "cell_id"})
 
-    return cell
\ No newline at end of file
+    return cell
@@ -1,6 +1,5 @@
 import numpy as np
 import platform
-import torch
 
 from math import ceil
 from itertools import zip_longest
@@ -16,6 +15,14 @@ def from_label_get_centeroidscoords(label: np.ndarray):
 
     centroid = regionprops_table(label, properties= ["label","centroid"])
     return centroid
+
+def compact_label(label: np.ndarray) -> np.ndarray :
+    """
+    Casts label to the smallest dtype holding its maximum label : uint16, promoted to int32 above 65535 labels (uint32 is not accepted by bigfish).
+    """
+    label_dtype = np.uint16 if label.size == 0 or label.max() <= np.iinfo(np.uint16).max else np.int32
+    return np.asarray(label, dtype= label_dtype)
   
 def using_mps():
+    import torch #Lazy import : torch is slow to load and only needed for segmentation
     return platform.system() == "Darwin" and torch.backends.mps.is_available()
\ No newline at end of file
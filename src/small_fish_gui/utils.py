@@ -1,5 +1,6 @@
-import inspect
+import inspect, json, hashlib
 import datetime as dt
+import numpy as np
 
 def check_parameter(**kwargs):
     """Check dtype of the function's parameters.
@@ -57,4 +58,16 @@ def compute_anisotropy_coef(voxel_size) :
     
 
 def get_datetime():
-    return dt.datetime.now().strftime("%Y%m%d %H-%M-%S")
\ No newline at end of file
+    return dt.datetime.now().strftime("%Y%m%d %H-%M-%S")
+
+def hash_parameters(parameters : dict, ignored_keys : 'list[str]' = []) -> str :
+    """
+    Returns a sha256 hex digest of parameters that don't change between runs.
+    Non string keys (gui elements), arrays and `ignored_keys` are not hashed.
+    """
+    hashed_parameters = {
+        key : value for key, value in parameters.items() 
+        if isinstance(key, str) and key not in ignored_keys and not isinstance(value, np.ndarray)
+        }
+    serialized = json.dumps(hashed_parameters, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode()).hexdigest()